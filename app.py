@@ -3,17 +3,33 @@ import os
 import time
 import uuid
 import base64
+import hashlib
 import json
-import math
-from datetime import datetime
 import streamlit as st
-import firebase_admin
-from firebase_admin import credentials, firestore, storage
-from streamlit_folium import st_folium
-import folium
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
+from streamlit.errors import StreamlitAPIException
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from firebase_admin import firestore
 import bcrypt
+from firebase_init import init_firebase
+from density import (DAY_MS, GRID_PRECISIONS, DensityWriter, covering_cells, day_of, heat_points, parent_precision,
+                     read_grid, zoom_precision)
+from events import event_stats, event_summary, group_by_event, leave_event
+from fanout import IO_POOL_WORKERS, CallTimeout, io_pool, run_all
+from feed import (FEED_MAX_DOCS, FEED_WINDOW, append_older, chunk_html, chunk_posts, evicted_count, new_feed_state,
+                  post_html, prepend_new, restore_newer, visible_window, within_radius)
+from geocoding import LOOKUP_BUDGET_S, Geocoder, GeocoderUnavailable
+from incidents import INCIDENT_TYPES, LEVELS, TIME_WINDOWS, Incident, load_heavy, matches_filters
+from mapdelta import MapDeltaTracker, event_markers
+from memsize import state_sizes
+from notify import event_items, missed_incidents, notification_html
+from outbox import DEFAULT_OUTBOX_PATH, ReportOutbox
+from photos import release_photo
+from places import DEFAULT_PLACES_PATH, PlaceIndex
+from reports import deliver_report, queue_report
+from ratelimit import FirestoreBuckets, MemoryBuckets, RateLimiter, wait_text
+from snapshot import DEFAULT_SNAPSHOT_PATH, IncidentSnapshot
+from store import open_stores
+from writebehind import LastSeenWriter
 
 
 # optional autorefresh helper
@@ -23,35 +39,63 @@ except Exception:
     def st_autorefresh(interval, limit, key):
         return None
 
+# incident map: Leaflet in the browser, fed add/remove marker deltas (components/incident_map)
+_incident_map = st.components.v1.declare_component(
+    "incident_map", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "incident_map"))
+
+# partial reruns (Streamlit >= 1.37); older versions just rerun the whole script
+if hasattr(st, "fragment"):
+    fragment = st.fragment
+elif hasattr(st, "experimental_fragment"):
+    fragment = st.experimental_fragment
+else:
+    def fragment(func=None, **kwargs):
+        return func if func is not None else (lambda f: f)
+
+def rerun_fragment():
+    """Rerun only the calling fragment where supported, otherwise the whole app."""
+    try:
+        st.rerun(scope="fragment")
+    except (TypeError, StreamlitAPIException):
+        st.rerun()
+
 # ---------------- Config ----------------
 st.set_page_config(page_title="Report Disasters", layout="wide", initial_sidebar_state="collapsed")
 
-# ---------- Firebase init ----------
-try:
-    if not firebase_admin._apps:
-        if "serviceAccount" in st.secrets:  # ✅ For Streamlit Cloud
-            cred = credentials.Certificate(dict(st.secrets["serviceAccount"]))
-            firebase_admin.initialize_app(cred)
-        # else:  # ✅ Local fallback (for dev)
-        #     SERVICE_ACCOUNT_PATH = "serviceAccount.json"
-        #     if not os.path.exists(SERVICE_ACCOUNT_PATH):
-        #         st.error("Missing serviceAccount.json or [serviceAccount] in secrets.toml")
-        #         st.stop()
-        #     cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
-        #     firebase_admin.initialize_app(cred)
-
-    db = firestore.client()
+def get_secret(name, default=None):
     try:
-        bucket = storage.bucket()
+        return st.secrets.get(name, default)
     except Exception:
-        bucket = None
+        return default
 
+# ---------- Storage / Firebase init ----------
+# STORAGE_BACKEND: "firestore" (default), "sqlite" (file at SQLITE_PATH) or "memory"; see store.py.
+# Events, the density heatmap and shared rate limits need Firestore and are skipped otherwise.
+STORAGE_BACKEND = get_secret("STORAGE_BACKEND") or "firestore"
+db = bucket = None
+if STORAGE_BACKEND == "firestore":
+    try:
+        db, bucket = init_firebase(st.secrets["serviceAccount"] if "serviceAccount" in st.secrets else None)  # ✅ For Streamlit Cloud
+    except Exception as e:
+        st.error(f"🔥 Firebase initialization failed: {e}")
+        st.stop()
+
+@st.cache_resource
+def _stores():
+    return open_stores(STORAGE_BACKEND, db, get_secret("SQLITE_PATH"))
+
+try:
+    incident_store, user_store = _stores()
 except Exception as e:
-    st.error(f"🔥 Firebase initialization failed: {e}")
+    st.error(f"Storage initialization failed: {e}")
     st.stop()
 
-USERS_COLLECTION = "app_users"
-INCIDENTS_COLLECTION = "incidents"
+LAST_SEEN_FLUSH_SECONDS = 5
+
+SNAPSHOT_REFRESH_SECONDS = 30
+
+# how long "Submit report" waits for the outbox to deliver before answering "queued"
+SUBMIT_WAIT_SECONDS = 3
 
 # ---------------- Helpers ----------------
 def hash_password(pw: str) -> bytes:
@@ -65,25 +109,25 @@ def create_user_in_firestore(email: str, password: str, username: str):
     username = username.strip() if username else ""
     if '@' not in email or len(password) < 8 or len(username) < 2:
         return False, "Provide a valid email, username (min 2 chars) and password >= 8 chars."
-    doc_ref = db.collection(USERS_COLLECTION).document(email)
-    if doc_ref.get().exists:
+    if user_store.get(email) is not None:
         return False, "Email already registered"
     hashed = hash_password(password)
-    doc_ref.set({
+    created = user_store.create(email, {
         "email": email,
         "username": username,
         "password_hash": base64.b64encode(hashed).decode("utf-8"),
         "last_seen_ms": int(time.time()*1000),
         "created": firestore.SERVER_TIMESTAMP
     })
+    if not created:
+        return False, "Email already registered"
     return True, None
 
 def authenticate_user(email: str, password: str):
     email = email.strip().lower()
-    doc = db.collection(USERS_COLLECTION).document(email).get()
-    if not doc.exists:
+    data = user_store.get(email)
+    if data is None:
         return False, "No account with this email"
-    data = doc.to_dict()
     hashed_b64 = data.get("password_hash")
     if not hashed_b64:
         return False, "Account corrupted"
@@ -96,26 +140,79 @@ def get_user_doc(email):
     try:
         if not email:
             return None
-        doc = db.collection(USERS_COLLECTION).document(email.strip().lower()).get()
-        return doc.to_dict() if doc.exists else None
+        data = user_store.get(email.strip().lower())
+        # overlay a newer last_seen_ms still sitting in the write-behind queue
+        pending = _last_seen_writer().pending_for(email)
+        if data is not None and pending and pending > int(data.get("last_seen_ms") or 0):
+            data["last_seen_ms"] = pending
+        return data
     except Exception:
         return None
 
+# ---------------- Rate limits ----------------
+# {action: {scope: (burst, period seconds)}}; "client" is the client IP (see client_id), else the session id.
+# Sign-in is limited strictly per (client, email), so nobody can lock a victim out by failing with their
+# address; the per-email limit only stops attacks spread over many clients.
+RATE_LIMITS = {
+    "submit": {"user": (5, 60), "client": (10, 60)},
+    "login": {"client_email": (5, 300), "client": (10, 60), "email": (50, 3600)},
+    # Nominatim's usage policy is ~1 request/s for the whole app
+    "geocode": {"client": (20, 60), "global": (5, 5)},
+}
+
+@st.cache_resource
+def rate_limiters():
+    shared = db is not None and get_secret("RATE_LIMIT_BACKEND") == "firestore"
+    backend = FirestoreBuckets(db) if shared else MemoryBuckets()
+    return {name: RateLimiter(name, limits, backend) for name, limits in RATE_LIMITS.items()}
+
+def client_id():
+    """
+    The peer address of the connection. Behind TRUSTED_PROXY_HOPS reverse proxies of our own, the
+    X-Forwarded-For entry the outermost one appended instead: entries further left come from the
+    client and can be anything.
+    """
+    try:
+        hops = int(get_secret("TRUSTED_PROXY_HOPS") or 0)
+        forwarded = [a.strip() for a in (st.context.headers.get("X-Forwarded-For") or "").split(",") if a.strip()]
+        ip = forwarded[-hops] if hops and len(forwarded) >= hops else st.context.ip_address
+        if isinstance(ip, str) and ip:
+            return "ip-" + ip
+    except Exception:
+        pass
+    st.session_state.setdefault("_client_id", "s-" + uuid.uuid4().hex)
+    return st.session_state["_client_id"]
+
+def rate_limited(action, **keys):
+    """Seconds to wait when the action is over its limit, else 0."""
+    client = client_id()
+    if keys.get("email"):
+        keys["client_email"] = f"{client}|{keys['email']}"
+    allowed, retry_after = rate_limiters()[action].allow(client=client, **keys)
+    return 0 if allowed else retry_after
+
+# last_seen_ms updates are coalesced per user and written in batches by one process-wide writer
+@st.cache_resource
+def _last_seen_writer():
+    return LastSeenWriter(user_store, interval=LAST_SEEN_FLUSH_SECONDS).start()
+
 def set_user_last_seen(email, ms=None):
     if not email:
         return
     try:
-        if ms is None:
-            ms = int(time.time()*1000)
-        db.collection(USERS_COLLECTION).document(email.strip().lower()).set({"last_seen_ms": ms}, merge=True)
+        _last_seen_writer().enqueue(email, ms)
     except Exception:
         pass
 
+def flush_last_seen():
+    """Write all queued last_seen_ms updates now (tests / shutdown). Returns docs written."""
+    return _last_seen_writer().flush()
+
 def set_user_home_location(email, lat, lng):
     if not email:
         return
     try:
-        db.collection(USERS_COLLECTION).document(email.strip().lower()).set({"home_lat": float(lat), "home_lng": float(lng)}, merge=True)
+        user_store.update(email.strip().lower(), {"home_lat": float(lat), "home_lng": float(lng)})
     except Exception:
         pass
 
@@ -133,245 +230,139 @@ def set_user_home_location(email, lat, lng):
 #         return None, None, None
 #     return None, None, None
 
-def save_incident(uid_email, username, inc_type, description, lat, lng, level="Normal", photo_bytes=None, photo_name=None):
-    created_ms = int(time.time()*1000)
-    country, region, display_addr = reverse_geocode(lat, lng)
-    doc = {
-        "uid": (uid_email or "anonymous").strip().lower(),
-        "username": username or (uid_email or "anonymous").split("@")[0],
-        "type": inc_type,
-        "description": description,
-        "level": level,
-        "country": country,
-        "region": region,
-        "display_address": display_addr,
-        "location": firestore.GeoPoint(float(lat), float(lng)),
-        "created": firestore.SERVER_TIMESTAMP,
-        "created_ms": created_ms,
-        "source": "streamlit"
-    }
-    if photo_bytes and bucket:
-        ext = (photo_name.split(".")[-1] if photo_name and "." in photo_name else "jpg")
-        dest = f"images/{(uid_email or 'anon')}_{int(time.time())}_{uuid.uuid4().hex}.{ext}"
-        blob = bucket.blob(dest)
-        blob.upload_from_string(photo_bytes, content_type=f"image/{ext}")
-        try:
-            blob.make_public()
-            doc["photo_url"] = blob.public_url
-        except Exception:
-            doc["photo_url"] = None
-    db.collection(INCIDENTS_COLLECTION).add(doc)
-
-import time
-import traceback
-import requests
-import streamlit as st
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
-
-# ----- Robust OpenCage + Nominatim wrapper -----
-def _geocode_opencage(q, api_key, max_retries=2):
-    if not api_key:
-        return None
-    url = "https://api.opencagedata.com/geocode/v1/json"
-    params = {"q": q, "key": api_key, "limit": 1, "no_annotations": 1}
-    backoff = 1.0
-    for attempt in range(1, max_retries + 1):
-        try:
-            r = requests.get(url, params=params, timeout=8)
-            if r.status_code == 200:
-                j = r.json()
-                if j.get("results"):
-                    res = j["results"][0]
-                    lat = res["geometry"]["lat"]
-                    lng = res["geometry"]["lng"]
-                    formatted = res.get("formatted") or ""
-                    return lat, lng, formatted
-                return None
-            else:
-                st.warning(f"OpenCage returned {r.status_code} (attempt {attempt})")
-        except Exception as e:
-            st.warning(f"OpenCage network error (attempt {attempt}): {e}")
-        time.sleep(backoff)
-        backoff *= 2
-    return None
-
-def _geocode_nominatim(q, user_agent_contact, max_retries=3):
-    # user_agent must include contact per Nominatim policy
-    contact = user_agent_contact or "report-disasters (no-contact@example.com)"
-    ua = f"report-disasters ({contact})"
-    geolocator = Nominatim(user_agent=ua, timeout=15)
-
-    backoff = 1.0
-    for attempt in range(1, max_retries + 1):
-        try:
-            res = geolocator.geocode(q, addressdetails=False, exactly_one=True)
-            if res:
-                return res.latitude, res.longitude, res.address
-            # no result — return None (no need to retry)
-            return None
-        except GeocoderTimedOut:
-            st.warning(f"Nominatim timeout for '{q}' (attempt {attempt}) — retrying...")
-        except GeocoderServiceError as e:
-            st.error(f"Nominatim service error: {e}")
-            st.write(traceback.format_exc())
-            return None
-        except Exception as e:
-            st.error(f"Unexpected geocoding error: {e}")
-            st.write(traceback.format_exc())
-            return None
-        time.sleep(backoff)
-        backoff *= 2
-    st.error(f"Geocoding failed after {max_retries} attempts for '{q}'.")
-    return None
+def save_incident(uid_email, username, inc_type, description, lat, lng, level="Normal", photo_bytes=None,
+                  photo_name=None, idempotency_key=None, title=None):
+    """
+    Queue the report in the local outbox and return its key right away; the outbox drainer
+    delivers it (deliver_incident) and retries until Firestore / Storage accept it.
+    """
+    return queue_report(_report_outbox(), uid_email, username, inc_type, description, lat, lng, level,
+                        photo_bytes, photo_name, idempotency_key, title)
+
+def deliver_incident(key, payload, photo_bytes=None, photo_name=None):
+    result = deliver_report(incident_store, key, payload, photo_bytes, photo_name,
+                            reverse_geocode=reverse_geocode, bucket=bucket, db=db, density=_density_writer())
+    fetch_filtered_incidents.clear()
+    return result
+
+# submitted reports wait here until delivered (durable across restarts; see outbox.py)
+@st.cache_resource
+def _report_outbox():
+    return ReportOutbox(get_secret("OUTBOX_PATH") or DEFAULT_OUTBOX_PATH, deliver_incident).start()
+
+# ----- Geocoding (OpenCage + Nominatim behind circuit breakers, see geocoding.py) -----
+@st.cache_resource
+def _geocoder():
+    return Geocoder(opencage_key=get_secret("OPENCAGE_KEY") or get_secret("opencage_key"),
+                    contact=get_secret("geocoder_contact") or get_secret("GEOCODER_CONTACT"),
+                    budget_s=float(get_secret("GEOCODE_BUDGET_S") or LOOKUP_BUDGET_S))
 
 def geocode_address(q):
     """
-    Drop-in replacement for your original geocode_address.
     Returns (lat, lng, address) or None.
     Prefers OPENCAGE_KEY if present in st.secrets, otherwise uses Nominatim.
     """
     if not q:
         return None
-
-    # 1) Try OpenCage if API key present
+    wait = rate_limited("geocode", **{"global": "all"})
+    if wait:
+        st.warning(f"Too many location lookups — try again in {wait_text(wait)}.")
+        return None
     try:
-        opencage_key = None
-        # Use st.secrets safely (works on local and Streamlit Cloud)
-        opencage_key = st.secrets.get("OPENCAGE_KEY") or st.secrets.get("opencage_key")
-    except Exception:
-        opencage_key = None
+        return _geocode_lookup(q)
+    except GeocoderUnavailable as e:
+        print("geocode unavailable:", e)
+        st.warning("Location search is unavailable right now — try again in a minute.")
+        return None
 
-    if opencage_key:
-        try:
-            res = _geocode_opencage(q, api_key=opencage_key)
-            if res:
-                return res
-        except Exception as e:
-            st.warning(f"OpenCage fallback error: {e}")
+def _geocode_lookup(q):
+    """The provider calls behind geocode_address, without the rate limit check. Raises GeocoderUnavailable."""
+    return _geocoder().geocode(q)
 
-    # 2) Fallback to Nominatim with contact from secrets
+@st.cache_resource
+def _places():
     try:
-        contact = st.secrets.get("geocoder_contact") or st.secrets.get("GEOCODER_CONTACT")
-    except Exception:
-        contact = None
-
-    return _geocode_nominatim(q, user_agent_contact=contact)
-
+        return PlaceIndex.load(get_secret("PLACES_PATH") or DEFAULT_PLACES_PATH)
+    except Exception as e:
+        print("places index unavailable:", e)
+        return PlaceIndex([])
 
-# Improved reverse_geocode (use same user_agent + retries)
 def reverse_geocode(lat, lng):
+    """
+    (country, region, display address). Country and region come from the bundled gazetteer (places.py);
+    the network is only asked for the display address (off with REVERSE_GEOCODE_NETWORK = false), and fills
+    country / region for points far from any known place. Safe off the script thread.
+    """
+    country, region = _places().locate(lat, lng)
+    if str(get_secret("REVERSE_GEOCODE_NETWORK", "true")).lower() in ("false", "0", "no", "off"):
+        return country, region, None
     try:
-        contact = None
-        try:
-            contact = st.secrets.get("geocoder_contact") or st.secrets.get("GEOCODER_CONTACT")
-        except Exception:
-            contact = None
-        contact = contact or "report-disasters (no-contact@example.com)"
-        ua = f"report-disasters ({contact})"
-        geolocator = Nominatim(user_agent=ua, timeout=15)
-        backoff = 1.0
-        for attempt in range(1, 4):
-            try:
-                loc = geolocator.reverse((lat, lng), timeout=10, language="en", addressdetails=True)
-                if loc and loc.raw:
-                    addr = loc.raw.get("address", {})
-                    country = addr.get("country")
-                    region = addr.get("state") or addr.get("region") or addr.get("county")
-                    display = loc.address
-                    return country, region, display
-                return None, None, None
-            except GeocoderTimedOut:
-                st.warning(f"Nominatim reverse timeout (attempt {attempt}) — retrying...")
-            except Exception as e:
-                st.error(f"Reverse geocoding error: {e}")
-                st.write(traceback.format_exc())
-                return None, None, None
-            time.sleep(backoff)
-            backoff *= 2
-    except Exception:
-        return None, None, None
-    return None, None, None
-
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371.0
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-    return 2 * R * math.asin(math.sqrt(a))
+        net_country, net_region, display = _geocoder().reverse(lat, lng) or (None, None, None)
+    except Exception as e:
+        print("reverse geocode error:", e)
+        return country, region, None
+    if country is None:
+        country, region = net_country, net_region
+    return country, region, display
+
+# ----- Place search boxes: type-ahead over the bundled gazetteer, network geocoder for the rest -----
+# options sent to the browser (largest places first); smaller places in the file still resolve when typed out
+PLACE_SUGGESTIONS = 1000
+
+def place_search(label, key, placeholder="Type a city, or any address and press Enter"):
+    """Place box whose suggestions filter in the browser as you type; free text (addresses) is accepted too."""
+    return st.selectbox(label, _places().labels(PLACE_SUGGESTIONS), index=None, key=key,
+                        accept_new_options=True, placeholder=placeholder)
+
+def find_place(q, near=None):
+    """(lat, lng, address) for a search box value: the gazetteer when it names a known place, else geocode_address."""
+    place = _places().resolve(q, near=near)
+    if place is not None:
+        return place.lat, place.lng, place.label
+    return geocode_address(q)
+
+def did_you_mean(q):
+    hints = _places().suggest(q.split(",")[0], limit=3)
+    return (" Did you mean: " + " / ".join(p.label for p in hints) + "?") if hints else ""
 
 # Notification helper (JS)
-def _send_browser_notifications(items):
+def event_notifications(incs, prefix="New"):
     """
-    items: list of dicts with keys: title, body, optional 'level' (e.g. "Dangerous","Warning","Normal","Peace")
-    This builds a small SVG data-URI icon colored by level and sends notifications via the browser Notification API.
+    One notification per event instead of one per report. Events this session has already
+    announced (or already had on screen) are skipped, so a flood of follow-up reports stays quiet.
     """
+    return event_items(incs, st.session_state.setdefault("_notified_events", set()), prefix)
+
+def _send_browser_notifications(items):
+    """items: list of dicts with keys: title, body, optional 'level' (see notify.notification_html)."""
     if not items:
         return
-
-    def _level_color(lv):
-        if not lv:
-            return "#2563EB"
-        lv_l = str(lv).strip().lower()
-        if lv_l in ("dangerous", "danger", "high"):
-            return "#ef4444"
-        if lv_l in ("warning",):
-            return "#f59e0b"
-        if lv_l in ("peace", "normal", "ok", "safe"):
-            return "#10b981"
-        return "#2563EB"
-
-    enriched = []
-    for it in items:
-        title = it.get("title", "")
-        body = it.get("body", "")
-        level = it.get("level", None)
-        color = _level_color(level)
-
-        symbol = "•"
-        if level:
-            lv = str(level).lower()
-            if "danger" in lv:
-                symbol = "❗"
-            elif "warn" in lv:
-                symbol = "⚠️"
-            elif lv in ("normal", "peace", "ok", "safe"):
-                symbol = "✓"
-
-        svg = f"""<svg xmlns='http://www.w3.org/2000/svg' width='128' height='128'>
-  <rect rx='20' width='100%' height='100%' fill='{color}'/>
-  <text x='50%' y='58%' text-anchor='middle' font-size='68' font-family='Segoe UI, Arial, sans-serif' fill='white'>{symbol}</text>
-</svg>"""
-        svg_b64 = base64.b64encode(svg.encode("utf-8")).decode("utf-8")
-        icon_data = f"data:image/svg+xml;base64,{svg_b64}"
-
-        enriched.append({"title": title, "body": body, "icon": icon_data})
-
-    payload = json.dumps(enriched)
-
-    notify_html = f"""
-    <script>
-      (async function(){{
-        const items = {payload};
-        try {{
-          const perm = await Notification.requestPermission();
-          if (perm === 'granted') {{
-            for (const it of items) {{
-              try {{
-                const n = new Notification(it.title, {{ body: it.body, icon: it.icon }});
-                setTimeout(()=>n.close(), 6000);
-              }} catch(e){{ console.warn(e); }}
-            }}
-          }} else {{
-            console.log('Notification permission:', perm);
-          }}
-        }} catch(e){{ console.error('notify error', e); }}
-      }})();
-    </script>
-    """
-    st.components.v1.html(notify_html, height=0)
+    st.components.v1.html(notification_html(items), height=0)
+
+# ---------------- Concurrent I/O ----------------
+# Independent store / geocoder calls of one rerun (feed bootstrap, sign-in) are fanned out on a shared
+# pool (fanout.py) so the page waits for the slowest call instead of their sum. Per-call timeouts, seconds:
+IO_TIMEOUTS = {"user_doc": 5, "feed_page": 10, "geocode": 8, "auth": 10, "missed": 6}
+
+@st.cache_resource
+def _io_pool():
+    return io_pool(int(get_secret("IO_POOL_WORKERS") or IO_POOL_WORKERS))
+
+def _in_script_run(fn):
+    """Run fn on a pool thread as part of the current script run, so st.cache_*, secrets and session state work."""
+    ctx = get_script_run_ctx()
+    def call(*args):
+        add_script_run_ctx(ctx=ctx)
+        return fn(*args)
+    return call
+
+def fan_out(calls):
+    """{name: (fn, args, timeout)} -> {name: result, exception or CallTimeout}; see fanout.run_all."""
+    results = run_all(_io_pool(), calls, wrap=_in_script_run)
+    for name, res in results.items():
+        if isinstance(res, CallTimeout):
+            print("fan-out timeout:", res)
+    return results
 
 # ---------------- Session defaults & simple cache ----------------
 st.session_state.setdefault("user", None)   # dict: {email, username}
@@ -386,41 +377,270 @@ st.session_state.setdefault("_inc_cache", {"ts": 0, "params": None, "data": None
 st.session_state.setdefault("map_markers_loaded", False)
 st.session_state.setdefault("_inc_feed", None)
 st.session_state.setdefault("feed_loaded", False)
+st.session_state.setdefault("feed_view_start", 0)
+# idempotency key of the report being composed (see save_incident / outbox.py)
+st.session_state.setdefault("report_key", uuid.uuid4().hex)
 
 INC_CACHE_TTL_SECONDS = 20
 
+# ---------------- Session memory ----------------
+# Each session's state is sized (memsize.state_sizes) at most every SESSION_SIZE_INTERVAL seconds into
+# a process-wide table shown on the Account page; sessions above SESSION_STATE_WARN_BYTES are logged.
+SESSION_SIZE_INTERVAL = 30
+SESSION_STATE_WARN_BYTES = 5_000_000
+# table entries of sessions not sampled for this long (closed tabs) are dropped
+SESSION_SIZE_TTL = 3600
+
+def feed_max_docs():
+    """Loaded feed posts kept per session (FEED_MAX_DOCS secret); at least one render window plus a page."""
+    try:
+        configured = int(get_secret("FEED_MAX_DOCS") or FEED_MAX_DOCS)
+    except (TypeError, ValueError):
+        configured = FEED_MAX_DOCS
+    return max(configured, FEED_WINDOW + 30)
+
+@st.cache_resource
+def _session_sizes():
+    return {}   # session id -> (bytes, sampled at)
+
+def _session_id():
+    try:
+        return get_script_run_ctx().session_id
+    except Exception:
+        return client_id()
+
+def track_session_size(force=False):
+    """Sample this session's state size; returns the latest sample in bytes."""
+    now = time.time()
+    if not force and now - st.session_state.get("_state_sampled", 0) < SESSION_SIZE_INTERVAL:
+        return st.session_state.get("_state_bytes")
+    st.session_state._state_sampled = now
+    try:
+        sizes = state_sizes(st.session_state.to_dict())
+    except Exception as e:
+        print("session size error:", e)
+        return None
+    total = sum(sizes.values())
+    st.session_state._state_bytes = total
+    table = _session_sizes()
+    table[_session_id()] = (total, now)
+    for sid, (_, ts) in list(table.items()):
+        if now - ts > SESSION_SIZE_TTL:
+            table.pop(sid, None)
+    if total > SESSION_STATE_WARN_BYTES:
+        largest = sorted(sizes.items(), key=lambda kv: kv[1], reverse=True)[:3]
+        print(f"session state is {total} bytes; largest keys:", largest)
+    return total
+
+def session_size_stats():
+    sizes = [b for b, _ in list(_session_sizes().values())]
+    return {"sessions": len(sizes), "total_bytes": sum(sizes), "max_bytes": max(sizes, default=0)}
+
 def _inc_cache_key(limit, order_by_field, order_desc, extra=None):
     return json.dumps({"limit": limit, "order_by_field": order_by_field, "order_desc": order_desc, "extra": extra})
 
-def fetch_incidents(limit=200, order_by_field="created", order_desc=True, force_refresh=False):
-    params_key = _inc_cache_key(limit, order_by_field, order_desc)
+# ---------------- Filters ----------------
+# type / level / time window filters run server-side (composite indexes: hosting/firestore.indexes.json).
+# Results are shared across sessions, one cache entry per combination; the window start is rounded
+# down to FILTER_BUCKET_MS so everyone asking for "last 24h" in the same minute hits the same entry.
+FILTER_BUCKET_MS = 60_000
+DEFAULT_FILTERS = ((), (), "Any time")
+
+def current_filters():
+    return st.session_state.get("incident_filters") or DEFAULT_FILTERS
+
+def filter_since_ms(window):
+    span = TIME_WINDOWS.get(window)
+    if span is None:
+        return None
+    return (int(time.time()*1000) - span) // FILTER_BUCKET_MS * FILTER_BUCKET_MS
+
+@st.cache_data(ttl=INC_CACHE_TTL_SECONDS, max_entries=256, show_spinner=False)
+def fetch_filtered_incidents(types, levels, since_ms, limit):
+    return incident_store.query(types, levels, since_ms, limit=limit)[0]
+
+def fetch_incidents(limit=200, filters=DEFAULT_FILTERS, force_refresh=False):
+    params_key = _inc_cache_key(limit, "created_ms", True, extra=filters)
     now = time.time()
     cache = st.session_state.get("_inc_cache", {"ts": 0, "params": None, "data": None})
     if (not force_refresh) and cache.get("params") == params_key and (now - cache.get("ts", 0) < INC_CACHE_TTL_SECONDS) and cache.get("data") is not None:
         return cache.get("data")
+    types, levels, window = filters
     try:
-        direction = firestore.Query.DESCENDING if order_desc else firestore.Query.ASCENDING
-        docs = list(db.collection(INCIDENTS_COLLECTION).order_by(order_by_field, direction=direction).limit(limit).stream())
-    except Exception:
+        docs = fetch_filtered_incidents(types, levels, filter_since_ms(window), limit)
+    except Exception as e:
+        print("fetch_incidents error:", e)
         docs = []
     st.session_state["_inc_cache"] = {"ts": now, "params": params_key, "data": docs}
     return docs
 
-# fetch page helper (keeps pagination)
-def fetch_incidents_page(page_size=30, order_by_field="created_ms", order_desc=True, start_after_snapshot=None):
+# event documents carry the full report count; read once per set of loaded events
+@st.cache_data(ttl=INC_CACHE_TTL_SECONDS, max_entries=256, show_spinner=False)
+def fetch_event_stats(event_ids):
+    if db is None or not event_ids:
+        return {}
+    return event_stats(db, event_ids)
+
+def loaded_event_stats(incs):
+    try:
+        return fetch_event_stats(tuple(sorted({inc.event_id for inc in incs if inc.event_id})))
+    except Exception as e:
+        print("event stats error:", e)
+        return {}
+
+# ---------------- Density heatmap ----------------
+# precomputed grid counts (density.py); a view reads a few small documents per day, never incidents
+DENSITY_DEFAULT_DAYS = 30
+
+# grid changes are summed in memory and written once per document every DENSITY_FLUSH_SECONDS;
+# writes that fail stay queued for the next flush
+@st.cache_resource
+def _density_writer():
+    if db is None:
+        return None
+    return DensityWriter(db, interval=float(get_secret("DENSITY_FLUSH_SECONDS") or 3)).start()
+
+@st.cache_data(ttl=60, max_entries=256, show_spinner=False)
+def fetch_density(precision, parents, days, types, levels):
+    if db is None:
+        return []
+    return heat_points(read_grid(db, precision, parents, days, types, levels))
+
+def density_heat(filters, view):
+    """Heat points for the map viewport ({zoom, bbox} reported by the map component) and filters."""
+    types, levels, window = filters
+    now_ms = int(time.time()*1000)
+    since = filter_since_ms(window) or now_ms - DENSITY_DEFAULT_DAYS*DAY_MS
+    days = tuple(range(day_of(since), day_of(now_ms) + 1))
+    view = view or {}
+    lat, lng = st.session_state.get("map_center", (24.86, 67.01))
+    bbox = view.get("bbox") or (lng - 0.3, lat - 0.2, lng + 0.3, lat + 0.2)
+    precision = zoom_precision(view.get("zoom", 12))
+    parents = covering_cells(bbox, parent_precision(precision))
+    # very wide views fall back to a coarser grid rather than reading many documents
+    while parents is None and precision > min(GRID_PRECISIONS):
+        precision -= 1
+        parents = covering_cells(bbox, parent_precision(precision))
+    if not parents:
+        return []
+    try:
+        return fetch_density(precision, tuple(parents), days, types, levels)
+    except Exception as e:
+        print("density read error:", e)
+        return []
+
+def filter_controls(where):
+    """Type / severity / time window pickers; the choice is shared by the feed and the map."""
+    types, levels, window = current_filters()
+    c1, c2, c3 = st.columns([2, 2, 1])
+    with c1:
+        types = st.multiselect("Type", INCIDENT_TYPES, default=list(types), key=f"flt_types_{where}", placeholder="All types")
+    with c2:
+        levels = st.multiselect("Severity", LEVELS, default=list(levels), key=f"flt_levels_{where}", placeholder="All levels")
+    with c3:
+        windows = list(TIME_WINDOWS)
+        window = st.selectbox("When", windows, index=windows.index(window), key=f"flt_window_{where}")
+    # canonical order so the same selection always maps to the same cache entry
+    filters = (tuple(t for t in INCIDENT_TYPES if t in types), tuple(lv for lv in LEVELS if lv in levels), window)
+    st.session_state.incident_filters = filters
+    return filters
+
+# fetch page helper (keeps pagination), newest first; returns Incidents + the id of the last one as cursor
+def fetch_incidents_page(page_size=30, after_id=None, filters=DEFAULT_FILTERS):
     try:
-        collection = db.collection(INCIDENTS_COLLECTION)
-        direction = firestore.Query.DESCENDING if order_desc else firestore.Query.ASCENDING
-        query = collection.order_by(order_by_field, direction=direction).limit(page_size)
-        if start_after_snapshot:
-            query = query.start_after(start_after_snapshot)
-        docs = list(query.stream())
-        last_snap = docs[-1] if docs else None
-        return docs, last_snap
+        types, levels, window = filters
+        return incident_store.query(types, levels, filter_since_ms(window), limit=page_size, after=after_id)
     except Exception as e:
         print("fetch_incidents_page error:", e)
         return [], None
 
+# Local columnar snapshot (see snapshot.py): memory-mapped once per process, then kept current with
+# created_ms > watermark delta queries. Build the file with `python snapshot.py build`. A full re-scan
+# runs in the background every SNAPSHOT_REBUILD_HOURS (default 24; 0 = never) to pick up back-dated
+# bulk imports, which the delta query cannot see.
+@st.cache_resource
+def incident_snapshot():
+    return IncidentSnapshot.load_or_empty(get_secret("INCIDENT_SNAPSHOT_PATH") or DEFAULT_SNAPSHOT_PATH)
+
+def fresh_snapshot():
+    snap = incident_snapshot()
+    try:
+        snap.refresh(incident_store, min_interval=SNAPSHOT_REFRESH_SECONDS,
+                     rebuild_interval=float(get_secret("SNAPSHOT_REBUILD_HOURS", 24) or 0) * 3600)
+    except Exception as e:
+        print("snapshot refresh error:", e)
+    return snap
+
+# heavy Incident fields (description, address, photo) dropped from memory are re-read in one batched get
+Incident.loader = incident_store.heavy
+
+# ---------------- Live mode ----------------
+# opt-in auto refresh: each tick asks only for incidents newer than this session's high-water mark
+LIVE_INTERVALS = {"10 s": 10, "30 s": 30, "1 min": 60}
+LIVE_MAX_NEW = 100
+
+def fetch_incidents_since(since_ms, limit=LIVE_MAX_NEW):
+    try:
+        return incident_store.newer_than(since_ms, limit=limit)
+    except Exception as e:
+        print("fetch_incidents_since error:", e)
+        return []
+
+def _loaded_high_water():
+    feed_state = st.session_state.get("_inc_feed") or {}
+    loaded = list(feed_state.get("docs") or []) + list(st.session_state.get("_inc_cache", {}).get("data") or [])
+    return max((inc.created_ms for inc in loaded), default=int(time.time()*1000))
+
+def live_poll():
+    """Merge incidents newer than the high-water mark into the feed and map state; notify for those only."""
+    hwm = st.session_state.get("live_hwm_ms") or _loaded_high_water()
+    new = fetch_incidents_since(hwm)
+    st.session_state.live_hwm_ms = max([hwm] + [inc.created_ms for inc in new])
+    if not new:
+        return []
+    types, levels, window = current_filters()
+    since_ms = filter_since_ms(window)
+    newest_first = [inc for inc in sorted(new, key=lambda inc: inc.created_ms, reverse=True)
+                    if matches_filters(inc, types, levels, since_ms)]
+    feed_state = st.session_state.get("_inc_feed")
+    if feed_state is not None:
+        prepend_new(feed_state, newest_first, feed_max_docs())
+    cache = st.session_state.get("_inc_cache") or {}
+    if cache.get("data") is not None:
+        known = {inc.id for inc in cache["data"]}
+        cache["data"][:0] = [inc for inc in newest_first if inc.id not in known]
+        # map markers are bounded like the feed buffer
+        del cache["data"][feed_max_docs():]
+    me = st.session_state.user["email"] if st.session_state.user else None
+    items = event_notifications([inc for inc in sorted(new, key=lambda inc: inc.created_ms, reverse=True) if inc.uid != me])
+    if items:
+        _send_browser_notifications(items)
+    if me:
+        set_user_last_seen(me, st.session_state.live_hwm_ms)
+    return new
+
+def live_controls(where):
+    """Live toggle + interval; call inside a fragment so each tick reruns only that fragment."""
+    c1, c2 = st.columns([2, 1])
+    with c1:
+        live = st.checkbox("🔴 Live updates", value=st.session_state.get("live_enabled", False), key=f"live_{where}")
+    with c2:
+        labels = list(LIVE_INTERVALS)
+        current = st.session_state.get("live_interval", labels[1])
+        interval = st.selectbox("Refresh every", labels, index=labels.index(current), key=f"live_interval_{where}",
+                                label_visibility="collapsed", disabled=not live)
+    if live != st.session_state.get("live_enabled", False):
+        st.session_state.live_enabled = live
+        st.session_state.live_hwm_ms = _loaded_high_water() if live else None
+    st.session_state.live_interval = interval
+    if not live:
+        return []
+    st_autorefresh(interval=LIVE_INTERVALS[interval]*1000, limit=None, key=f"live_tick_{where}")
+    new = live_poll()
+    if new:
+        st.caption(f"🔴 {len(new)} new report(s) just arrived")
+    return new
+
 def get_qparam(k, default=None):
     q = st.query_params
     v = q.get(k)
@@ -445,115 +665,42 @@ setpage = get_qparam("setPage")
 if setpage:
     st.session_state.page = setpage
 
-# ---------------- Styling (unchanged) ----------------
-st.markdown("""
-<style>
-:root {
-  --bg: #F9FAFB;
-  --text: #0F172A;
-  --primary: #2563EB;
-  --nav: #E5E7EB;
-  --btn-grad: linear-gradient(90deg,#0b66ff,#0077ff);
-}
+# ---------------- Styling ----------------
+# All CSS lives in hosting/public/app.css (also deployable with Firebase Hosting). It is added to the
+# page <head> once per browser session instead of being re-sent as <style> markdown on every rerun.
+STYLESHEET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hosting", "public", "app.css")
 
-html, body, .stApp {
-  background: var(--bg) !important;
-  color: var(--text) !important;
-  font-family: Inter, system-ui, -apple-system, "Segoe UI", Roboto, "Helvetica Neue", Arial !important;
-}
-
-/* Navbar */
-.navbar {
-  background: var(--nav);
-  padding: 10px 20px;
-  border-radius: 12px;
-  display:flex;
-  align-items:center;
-  gap:14px;
-  margin-bottom: 18px;
-  box-shadow: 0 4px 14px rgba(2,6,23,0.06);
-}
-.brand { font-weight:700; font-size:18px; color:var(--text); }
-.nav-right { margin-left:auto; display:flex; gap:12px; align-items:center; }
-.nav-btn {
-  background: transparent;
-  border: none;
-  padding:8px 12px;
-  border-radius:8px;
-  font-weight:600;
-  cursor:pointer;
-  color: var(--text);
-}
-.nav-btn.active {
-  background: var(--btn-grad);
-  color: white;
-  box-shadow: 0 8px 24px rgba(11,102,255,0.12);
-}
+@st.cache_resource
+def _stylesheet():
+    with open(STYLESHEET_PATH, "r", encoding="utf-8") as f:
+        css = f.read()
+    return css, hashlib.sha1(css.encode("utf-8")).hexdigest()[:10]
 
-/* Card (form container) */
-.card {
-  background: #fff;
-  padding: 24px 28px;
-  border-radius: 12px;
-  box-shadow: 0 8px 30px rgba(15,23,42,0.06);
-  max-width: 420px; /* 🔹 narrower width */
-  margin: 60px auto; /* centered with top margin */
-  box-sizing: border-box;
-}
-
-/* Inputs */
-input, textarea, .stTextInput>div>input, .stTextArea>div>textarea {
-  color: var(--text) !important;
-  background: #ffffff !important;
-  border: 1px solid #E6EEF8 !important;
-  border-radius: 8px !important;
-  padding: 10px 12px !important;
-  height: 44px !important;
-  font-size: 14px !important;
-}
-
-/* Buttons */
-.stButton>button {
-  background: var(--btn-grad) !important;
-  color: #fff !important;
-  font-weight:700 !important;
-  border-radius: 8px !important;
-  padding: 10px 12px !important;
-  width: 100%;
-  height: 44px !important;
-  font-size: 15px !important;
-}
-.stButton>button:hover {
-  opacity: 0.95 !important;
-  transform: translateY(-1px);
-}
-
-/* Helper text */
-.small { font-size:13px; color:#475569; text-align:center; }
-
-/* Feed area layout (unchanged) */
-.feed-card {
-  padding:12px;
-  border-radius:12px;
-  background:#fff;
-  border:1px solid #EEF2FF;
-  margin-bottom:14px;
-  box-shadow: 0 6px 18px rgba(2,6,23,0.04);
-}
+def inject_styles():
+    css, version = _stylesheet()
+    if st.session_state.get("_styles_version") == version:
+        return
+    # STYLESHEET_URL: the same file served from Firebase Hosting (cached by the CDN / browser)
+    url = get_secret("STYLESHEET_URL")
+    if url:
+        node = f"var n=d.createElement('link');n.rel='stylesheet';n.href={json.dumps(url + '?v=' + version)};"
+    else:
+        node = f"var n=d.createElement('style');n.textContent={json.dumps(css)};"
+    st.components.v1.html(f"""
+    <script>
+      (function(){{
+        var d = window.parent.document, id = 'rd-styles-{version}';
+        if (d.getElementById(id)) return;
+        d.querySelectorAll('[id^="rd-styles-"]').forEach(function(old){{ old.remove(); }});
+        {node}
+        n.id = id;
+        d.head.appendChild(n);
+      }})();
+    </script>
+    """, height=0)
+    st.session_state["_styles_version"] = version
 
-.feed-wrap {
-  padding-left: 48px;
-  padding-right: 48px;
-  max-width: 1100px;
-  margin-left: auto;
-  margin-right: auto;
-}
-@media (max-width: 800px) {
-  .feed-wrap { padding-left: 16px; padding-right: 16px; max-width: 100%; }
-}
-.block-container { padding-top: 0 !important; }
-</style>
-""", unsafe_allow_html=True)
+inject_styles()
 
 
 # ---------------- Navbar renderer ----------------
@@ -563,85 +710,6 @@ def render_sidebar():
     if "user" not in st.session_state:
         st.session_state.user = None
 
-    # Strong, precise CSS targeting Streamlit sidebar buttons
-    st.markdown("""
-    <style>
-    /* Sidebar base */
-    [data-testid="stSidebar"] {
-        background-color: #ebeced;
-        border-right: 1px solid #E5E7EB;
-        padding: 12px 12px 24px 12px;
-    }
-
-    /* Hide the default sidebar nav if present */
-    [data-testid="stSidebarNav"] { display: none; }
-
-    .sidebar-title {
-        font-weight: 700;
-        font-size: 20px;
-        color: #0F172A;
-        margin-bottom: 12px;
-        padding-left: 4px;
-    }
-
-    /* Ensure wrapper divs take full width */
-    [data-testid="stSidebar"] > div, 
-    [data-testid="stSidebar"] > nav,
-    [data-testid="stSidebar"] .css-1d391kg { width: 100% !important; }
-
-    /* === The important part: force all sidebar buttons to identical size ===
-       Target both Streamlit wrapper (.stButton) and any custom .sidebar-btn/.active-page wrappers
-    */
-    [data-testid="stSidebar"] .stButton > button,
-    [data-testid="stSidebar"] .sidebar-btn button,
-    [data-testid="stSidebar"] .active-page button {
-        width: 100% !important;
-        box-sizing: border-box !important;
-        min-height: 44px !important;
-        height: 44px !important;
-        padding: 8px 12px !important;
-        display: flex !important;
-        align-items: center !important;
-        justify-content: center !important;
-        gap: 3px !important;
-        white-space: nowrap !important;
-        overflow: hidden !important;
-        text-overflow: ellipsis !important;
-        font-size: 15px !important;
-        font-weight: 700 !important;
-        border-radius: 8px !important;
-        margin: 3px 0 !important;
-        background: transparent !important;
-        color: #0F172A !important;
-        cursor: pointer !important;
-    }
-
-    /* Hover + active */
-    [data-testid="stSidebar"] .stButton > button:hover,
-    [data-testid="stSidebar"] .sidebar-btn button:hover {
-        background-color: #E2E8F0 !important;
-    }
-    [data-testid="stSidebar"] .active-page button {
-        background-color: #0F172A !important;
-        color: #fff !important;
-    }
-
-    /* If icons / emoji make lines taller, cap them to same height */
-    [data-testid="stSidebar"] .stButton > button > span,
-    [data-testid="stSidebar"] .stButton > button > div {
-        line-height: 1 !important;
-        display: inline-flex !important;
-        align-items: center !important;
-        justify-content: center !important;
-    }
-
-    /* Small screens: slightly taller tap targets */
-    @media (max-width: 480px) {
-      [data-testid="stSidebar"] .stButton > button { height: 50px !important; min-height: 50px !important; }
-    }
-    </style>
-    """, unsafe_allow_html=True)
-
     with st.sidebar:
         st.markdown("<div class='sidebar-title'>📣 Report Disasters</div>", unsafe_allow_html=True)
 
@@ -700,120 +768,6 @@ def show_alert(msg, type_="info"):
 
 # ---------------- HOME PAGE ----------------
 def page_home():
-    
-    st.markdown("""
-        <style>
-                .block-container {
-    padding-top: 0 !important;
-}
-        /* ---------- HOME PAGE STYLES ---------- */
-        .home-hero {
-            text-align: center;
-            padding: 60px 20px 40px 20px;
-            background: #F9FAFB;
-            border-radius: 18px;
-            color: #0F172A;
-            # box-shadow: 0 10px 25px rgba(0,0,0,0.15);
-            animation: fadeSlideIn 0.8s ease-out forwards;
-
-        }
-        .home-hero h1 {
-            font-size: 42px;
-            margin-bottom: 14px;
-            font-weight: 800;
-            letter-spacing: -0.5px;
-        }
-        .home-hero p {
-            font-size: 18px;
-            line-height: 1.5;
-            max-width: 700px;
-            margin: 0 auto 24px auto;
-            opacity: 0.9;
-        }
-        .cta-buttons {
-            display: flex;
-            justify-content: center;
-            gap: 20px;
-            flex-wrap: wrap;
-        }
-        .cta-buttons button {
-            font-size: 16px !important;
-            padding: 10px 24px;
-            border-radius: 12px;
-            transition: transform 0.2s ease, background 0.3s;
-            border: none;
-            cursor: pointer;
-        }
-        .cta-buttons button:hover {
-            transform: translateY(-3px);
-        }
-        .btn-primary {
-            background: #DC2626;
-            color: white;
-        }
-        .btn-primary:hover {
-            background: #B91C1C;
-        }
-        .btn-secondary {
-            background: #2563EB;
-            color: white;
-        }
-        .btn-secondary:hover {
-            background: #1E3A8A;
-        }
-
-        .info-section {
-            text-align: center;
-            padding: 60px 20px;
-            max-width: 800px;
-            margin: 0 auto;
-            animation: fadeSlideUp 1s ease-out forwards;
-        }
-        .info-section h2 {
-            color: var(--text);
-            margin-bottom: 16px;
-        }
-        .info-section p {
-            color: #334155;
-            font-size: 16px;
-            line-height: 1.6;
-        }
-
-        .features {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(240px, 1fr));
-            gap: 20px;
-            padding: 40px 20px;
-            max-width: 1000px;
-            margin: auto;
-        }
-        .feature-card {
-            background: white;
-            border-radius: 14px;
-            padding: 24px;
-            box-shadow: 0 4px 14px rgba(0,0,0,0.06);
-            text-align: center;
-            transition: transform 0.25s ease;
-        }
-        .feature-card:hover {
-            transform: translateY(-6px);
-        }
-        .feature-icon {
-            font-size: 36px;
-            margin-bottom: 12px;
-        }
-
-        @keyframes fadeSlideIn {
-            from {opacity: 0; transform: translateY(-20px);}
-            to {opacity: 1; transform: translateY(0);}
-        }
-        @keyframes fadeSlideUp {
-            from {opacity: 0; transform: translateY(20px);}
-            to {opacity: 1; transform: translateY(0);}
-        }
-        </style>
-    """, unsafe_allow_html=True)
-
     # -------- Hero Section --------
     st.markdown("""
         <div class='home-hero'>
@@ -887,6 +841,20 @@ def page_home():
     """, unsafe_allow_html=True)
 
 # ---------------- LOGIN / REGISTER (unchanged) ----------------
+def _missed_since_last_seen(email):
+    """Reports created since the user was last seen, near their home location when they saved one; oldest first."""
+    user_doc = get_user_doc(email)
+    stored_last_seen = 0
+    home = None
+    try:
+        if user_doc:
+            stored_last_seen = int(user_doc.get("last_seen_ms") or 0)
+            if user_doc.get("home_lat") is not None and user_doc.get("home_lng") is not None:
+                home = (float(user_doc.get("home_lat")), float(user_doc.get("home_lng")))
+    except Exception:
+        stored_last_seen = 0
+    return missed_incidents(incident_store, stored_last_seen, home)
+
 def page_login():
     with st.form("login_form"):
         st.markdown("## 🔐 Sign in")
@@ -898,51 +866,27 @@ def page_login():
             if not email or not pwd:
                 st.error("Enter both email & password")
             else:
-                ok, username_or_err = authenticate_user(email, pwd)
+                # checked before bcrypt so floods of attempts cost no hashing
+                wait = rate_limited("login", email=email.strip().lower())
+                results = {}
+                if wait:
+                    ok, username_or_err = False, f"Too many sign-in attempts — try again in {wait_text(wait)}."
+                else:
+                    # the password check (bcrypt) and the user doc -> missed reports lookup run side by side;
+                    # the missed reports are only used once the password checked out
+                    results = fan_out({"auth": (authenticate_user, (email, pwd), IO_TIMEOUTS["auth"]),
+                                       "missed": (_missed_since_last_seen, (email,), IO_TIMEOUTS["missed"])})
+                    auth = results["auth"]
+                    if isinstance(auth, CallTimeout):
+                        ok, username_or_err = False, "Sign-in is taking too long — please try again."
+                    elif isinstance(auth, Exception):
+                        ok, username_or_err = False, f"Sign-in failed: {auth}"
+                    else:
+                        ok, username_or_err = auth
                 if ok:
-                    user_doc = get_user_doc(email)
-                    stored_last_seen = 0
-                    home_lat = home_lng = None
+                    missed = results["missed"] if not isinstance(results["missed"], Exception) else []
                     try:
-                        if user_doc:
-                            stored_last_seen = int(user_doc.get("last_seen_ms") or 0)
-                            if user_doc.get("home_lat") is not None and user_doc.get("home_lng") is not None:
-                                home_lat = float(user_doc.get("home_lat"))
-                                home_lng = float(user_doc.get("home_lng"))
-                    except Exception:
-                        stored_last_seen = 0
-
-                    missed_items = []
-                    try:
-                        try:
-                            rows = db.collection(INCIDENTS_COLLECTION).where(
-                                "created_ms", ">", stored_last_seen
-                            ).order_by("created_ms", direction=firestore.Query.ASCENDING).limit(50).stream()
-                        except Exception:
-                            rows = db.collection(INCIDENTS_COLLECTION).order_by(
-                                "created_ms", direction=firestore.Query.DESCENDING
-                            ).limit(200).stream()
-                        for rr in rows:
-                            d = rr.to_dict()
-                            created_ms = d.get("created_ms") or 0
-                            if created_ms <= stored_last_seen:
-                                continue
-                            if home_lat is not None and home_lng is not None:
-                                try:
-                                    loc = d.get("location")
-                                    if loc:
-                                        dist_km = haversine(
-                                            home_lat, home_lng,
-                                            float(loc.latitude), float(loc.longitude)
-                                        )
-                                        if dist_km > 100:
-                                            continue
-                                except Exception:
-                                    pass
-                            missed_items.append({
-                                "title": f"Missed: {d.get('type','Report')}",
-                                "body": (d.get('description') or "")[:140]
-                            })
+                        missed_items = event_notifications(missed[::-1], prefix="Missed")
                     except Exception:
                         missed_items = []
 
@@ -984,7 +928,11 @@ def page_register():
             elif len(pwd) < 8:
                 st.error("Password must be at least 8 characters")
             else:
-                ok, err = create_user_in_firestore(email, pwd, username)
+                wait = rate_limited("login", email=email.strip().lower())
+                if wait:
+                    ok, err = False, f"Too many attempts — try again in {wait_text(wait)}."
+                else:
+                    ok, err = create_user_in_firestore(email, pwd, username)
                 if ok:
                     st.success("Account created — please sign in.")
                     st.session_state.page = "login"
@@ -993,109 +941,6 @@ def page_register():
                     st.error(err)
 
     st.markdown("<div class='small'>Already have an account? <a href='?setPage=login'>Sign in</a></div>", unsafe_allow_html=True)
-st.markdown("""
-<style>
-:root {
-  --bg: #F0F2F5;
-  --white: #FFFFFF;
-  --text-color: #111827;
-  --primary-color: #2563EB;
-  --light-gray: #E5E7EB;
-  --btn-grad: linear-gradient(90deg,#2563EB,#1D4ED8);
-}
-
-/* 🌙 Base layout */
-html, body, .stApp {
-  background: var(--bg) !important;
-  color: var(--text-color) !important;
-  font-family: "Inter", system-ui, -apple-system, "Segoe UI", Roboto, "Helvetica Neue", Arial !important;
-}
-
-/* ✨ Centered form with top padding */
-.stForm {
-  background: var(--white) !important;
-  padding: 3rem 3.5rem !important;
-  border-radius: 18px !important;
-  box-shadow: 0 12px 36px rgba(0,0,0,0.1) !important;
-  width: 540px !important;
-  font-size: 16px !important;
-  margin: 90px auto 0 auto !important;  /* 🔥 Adds top gap */
-}
-
-/* 📝 Input fields */
-input[type="text"], input[type="password"], input[type="email"], textarea,
-.stTextInput>div>div>input, .stTextArea>div>textarea {
-  background: #FAFAFA !important;
-  border: 1px solid var(--light-gray) !important;
-  color: var(--text-color) !important;
-  border-radius: 10px !important;
-  padding: 14px 16px !important;
-  width: 100% !important;
-  font-size: 15px !important;
-}
-input:focus, textarea:focus {
-  border-color: var(--primary-color) !important;
-  box-shadow: 0 0 0 3px rgba(37,99,235,0.25) !important;
-  outline: none !important;
-}
-
-/* Label color fix */
-label, .stTextInput label, .stTextArea label {
-  color: var(--text-color) !important;
-  font-weight: 600 !important;
-}
-
-/* 🔘 Buttons (login/register + others) */
-.stButton>button {
-  background: #cacccf !important; /* 🩶 Default muted gray */
-  color: #fff !important;  /* hides text until hover */
-  font-weight: 700 !important;
-  border-radius: 10px !important;
-  padding: 12px 18px !important;
-  width: 100% !important;
-  height: 50px !important;
-  font-size: 16px !important;
-  border: none !important;
-  margin-top: 20px !important; /* adds breathing space from inputs */
-  transition: all 0.35s ease !important;
-  letter-spacing: 0.5px !important;
-  cursor: pointer !important;
-}
-
-/* On hover — gradient reveal */
-.stButton>button:hover {
-  background: var(--btn-grad) !important;
-  color: #fff !important;
-  transform: translateY(-2px) !important;
-  box-shadow: 0 8px 20px rgba(37,99,235,0.25) !important;
-}
-
-/* 🧾 Headings */
-h2, h3 {
-  font-size: 26px !important;
-  font-weight: 700 !important;
-  text-align: center !important;
-  margin-bottom: 1.5rem !important;
-  color: var(--text-color) !important;
-}
-
-/* 📎 Helper text / links */
-.small {
-  font-size: 14px !important;
-  color: #475569 !important;
-  text-align: center !important;
-  margin-top: 16px !important;
-}
-.small a {
-  color: var(--primary-color) !important;
-  font-weight: 600 !important;
-  text-decoration: none !important;
-}
-.small a:hover {
-  text-decoration: underline !important;
-}
-</style>
-""", unsafe_allow_html=True)
 
 
 # ---------------- DASHBOARD (unchanged map behavior) ----------------
@@ -1107,185 +952,226 @@ def page_dashboard():
 
     left, right = st.columns([1, 1.6], gap="large")
 
+    # each panel is a fragment: a map click reruns only the map, typing in the form only the form
     with left:
-        st.markdown("<div class='card'>", unsafe_allow_html=True)
-        st.markdown("### 📝 New Report")
-        st.write(f"Signed in as: **@{st.session_state.user['username']}**")
-
-        predefined = ["Flood", "Fire", "Earthquake", "Storm", "Landslide", "Roadblock", "Other"]
-        inc_type = st.selectbox("Disaster type", predefined, index=0, key="ui_inc_type")
-        if inc_type == "Other":
-            custom_title = st.text_input("Enter custom disaster title", key="ui_custom_type")
-            inc_title = custom_title.strip() if custom_title and custom_title.strip() else "Other"
-        else:
-            inc_title = inc_type
+        _report_form()
 
-        level = st.selectbox("Severity", ["Peace", "Normal", "Warning", "Dangerous"], index=1, key="ui_level")
-        description = st.text_area("Description", max_chars=1000, height=140, key="ui_desc")
+    # RIGHT: Map (markers load explicitly)
+    with right:
+        _map_panel()
 
-        st.markdown("<div class='small'>Pick a location on the map (right) — click to select. Or use search / Detect my location.</div>", unsafe_allow_html=True)
-        search_q = st.text_input("Search place (address / city / landmark)", key="ui_search")
+@fragment
+def _report_form():
+    st.markdown("<div class='card'>", unsafe_allow_html=True)
+    st.markdown("### 📝 New Report")
+    st.write(f"Signed in as: **@{st.session_state.user['username']}**")
 
-        s1, s2 = st.columns([1,1])
-        if s1.button("Search"):
-            if search_q.strip():
-                res = geocode_address(search_q.strip())
-                if res:
-                    lat, lng, addr = res
-                    st.session_state.map_center = (lat, lng)
-                    st.session_state.selected_lat = lat
-                    st.session_state.selected_lng = lng
-                    st.success(f"Found & selected: {addr}")
-                else:
-                    st.error("Not found. Try another query.")
-            else:
-                st.error("Enter search text.")
-
-        # detect_html = """
-        # <button id="detectBtn" style="padding:8px 12px;border-radius:8px;border:none;background:#0b66ff;color:white;font-weight:700;cursor:pointer">Detect my location</button>
-        # <script>
-        # const b = document.getElementById('detectBtn');
-        # b.addEventListener('click', function(){
-        #     if (!navigator.geolocation) { alert('Geolocation not supported'); return; }
-        #     navigator.geolocation.getCurrentPosition(function(p){
-        #         var lat = p.coords.latitude;
-        #         var lng = p.coords.longitude;
-        #         var base = window.location.protocol + "//" + window.location.host + window.location.pathname;
-        #         window.location.replace(base + '?lat=' + encodeURIComponent(lat) + '&lng=' + encodeURIComponent(lng) + '&setPage=dashboard');
-        #     }, function(err){
-        #         alert('Location error: ' + (err && err.message ? err.message : err.code));
-        #     }, { enableHighAccuracy:true, timeout:15000 });
-        # });
-        # </script>
-        # """
-        # st.components.v1.html(detect_html, height=48)
-
-        photo = st.file_uploader("Attach Photo (optional)", type=["jpg","jpeg","png"], key="ui_photo")
-
-        c1, c2 = st.columns([1,1])
-        if c1.button("Submit report"):
-            lat = st.session_state.get("selected_lat")
-            lng = st.session_state.get("selected_lng")
-            if lat is None or lng is None:
-                st.error("Location not selected. Click on map (right), search & press Search, or use Detect my location.")
+    inc_type = st.selectbox("Disaster type", INCIDENT_TYPES, index=0, key="ui_inc_type")
+    if inc_type == "Other":
+        custom_title = st.text_input("Enter custom disaster title", key="ui_custom_type")
+        inc_title = custom_title.strip() if custom_title and custom_title.strip() else "Other"
+    else:
+        inc_title = inc_type
+
+    level = st.selectbox("Severity", LEVELS, index=1, key="ui_level")
+    description = st.text_area("Description", max_chars=1000, height=140, key="ui_desc")
+
+    st.markdown("<div class='small'>Pick a location on the map (right) — click to select. Or use search / Detect my location.</div>", unsafe_allow_html=True)
+    search_q = place_search("Search place (address / city / landmark)", key="ui_search") or ""
+
+    if st.session_state.get("search_notice"):
+        st.success(st.session_state.pop("search_notice"))
+
+    s1, s2 = st.columns([1,1])
+    if s1.button("Search"):
+        if search_q.strip():
+            res = find_place(search_q.strip(), near=st.session_state.get("map_center"))
+            if res:
+                lat, lng, addr = res
+                st.session_state.map_center = (lat, lng)
+                st.session_state.selected_lat = lat
+                st.session_state.selected_lng = lng
+                st.session_state.search_notice = f"Found & selected: {addr}"
+                # the map is a separate fragment; a full rerun re-centers it
+                st.rerun()
             else:
+                st.error("Not found. Try another query." + did_you_mean(search_q))
+        else:
+            st.error("Enter search text.")
+
+    # detect_html = """
+    # <button id="detectBtn" style="padding:8px 12px;border-radius:8px;border:none;background:#0b66ff;color:white;font-weight:700;cursor:pointer">Detect my location</button>
+    # <script>
+    # const b = document.getElementById('detectBtn');
+    # b.addEventListener('click', function(){
+    #     if (!navigator.geolocation) { alert('Geolocation not supported'); return; }
+    #     navigator.geolocation.getCurrentPosition(function(p){
+    #         var lat = p.coords.latitude;
+    #         var lng = p.coords.longitude;
+    #         var base = window.location.protocol + "//" + window.location.host + window.location.pathname;
+    #         window.location.replace(base + '?lat=' + encodeURIComponent(lat) + '&lng=' + encodeURIComponent(lng) + '&setPage=dashboard');
+    #     }, function(err){
+    #         alert('Location error: ' + (err && err.message ? err.message : err.code));
+    #     }, { enableHighAccuracy:true, timeout:15000 });
+    # });
+    # </script>
+    # """
+    # st.components.v1.html(detect_html, height=48)
+
+    photo = st.file_uploader("Attach Photo (optional)", type=["jpg","jpeg","png"], key="ui_photo")
+
+    queued = _report_outbox().pending_for(st.session_state.user["email"])
+    if queued:
+        st.caption(f"📤 {queued} report(s) waiting to be sent — they are retried automatically.")
+
+    c1, c2 = st.columns([1,1])
+    if c1.button("Submit report"):
+        lat = st.session_state.get("selected_lat")
+        lng = st.session_state.get("selected_lng")
+        # only complete submissions count against the limit
+        wait = rate_limited("submit", user=st.session_state.user["email"]) if lat is not None and lng is not None else 0
+        if lat is None or lng is None:
+            st.error("Location not selected. Click on map (right), search & press Search, or use Detect my location.")
+        elif wait:
+            st.error(f"You're sending reports very quickly — please wait {wait_text(wait)} and try again.")
+        else:
+            try:
+                photo_bytes = photo.getvalue() if photo else None
+
+                # Queue the report (durable, idempotent) and give the drainer a moment to deliver it
+                key = save_incident(
+                    st.session_state.user["email"],
+                    st.session_state.user["username"],
+                    inc_type,
+                    description or "",
+                    lat, lng,
+                    level,
+                    photo_bytes,
+                    getattr(photo, "name", None),
+                    idempotency_key=st.session_state.report_key,
+                    title=inc_title
+                )
+                result = _report_outbox().wait_delivered(key, timeout=SUBMIT_WAIT_SECONDS)
+                event_id = (result or {}).get("event_id")
+                new_event = (result or {}).get("new_event", False)
+
+                # Immediate UI feedback
+                st.success("Report submitted — thank you." if result else "Report saved — it will be sent as soon as the connection allows.")
+
+                # (1) Send an immediate browser notification for this submission
                 try:
-                    photo_bytes = photo.getvalue() if photo else None
-
-                    # Save the incident to Firestore
-                    save_incident(
-                        st.session_state.user["email"],
-                        st.session_state.user["username"],
-                        inc_title,
-                        description or "",
-                        lat, lng,
-                        level,
-                        photo_bytes,
-                        getattr(photo, "name", None)
-                    )
-
-                    # Immediate UI feedback
-                    st.success("Report submitted — thank you.")
-
-                    # (1) Send an immediate browser notification for this submission
-                    try:
-                        _send_browser_notifications([{
-                            "title": f"Report submitted: {inc_title}",
-                            "body": (description or "")[:200],
-                            "level": level
-                        }])
-                    except Exception as e:
-                        # don't block the flow on notify failure; log small warning for debugging
-                        st.warning(f"Notification call failed: {e}")
-
-                    # (2) Update Firestore user's last_seen_ms so this user won't be treated as having "missed" their own report later
-                    try:
-                        set_user_last_seen(st.session_state.user["email"], int(time.time()*1000))
-                    except Exception:
-                        pass
+                    _send_browser_notifications([{
+                        "title": (f"Report queued: {inc_title}" if result is None
+                                  else f"Report submitted: {inc_title}" if new_event or not event_id
+                                  else f"Report added to an ongoing {inc_title} event"),
+                        "body": (description or "")[:200],
+                        "level": level
+                    }])
+                except Exception as e:
+                    # don't block the flow on notify failure; log small warning for debugging
+                    st.warning(f"Notification call failed: {e}")
 
-                    # (3) Clear feed + map caches so Feed / map will re-fetch and show the new report
-                    st.session_state["_inc_feed"] = None
-                    st.session_state["_inc_cache"] = {"ts": 0, "params": None, "data": None}
-                    st.session_state.map_markers_loaded = False
+                # (2) Update Firestore user's last_seen_ms so this user won't be treated as having "missed" their own report later
+                try:
+                    set_user_last_seen(st.session_state.user["email"], int(time.time()*1000))
+                except Exception:
+                    pass
 
-                    # clear selection and navigate to feed
-                    st.session_state.last_seen_ms = int(time.time()*1000)
-                    st.session_state.selected_lat = None
-                    st.session_state.selected_lng = None
-                    st.session_state.page = "feed"
-                    st.rerun()
+                # (3) Clear feed + map caches so Feed / map will re-fetch and show the new report
+                st.session_state["_inc_feed"] = None
+                st.session_state["_inc_cache"] = {"ts": 0, "params": None, "data": None}
+                fetch_filtered_incidents.clear()
+                st.session_state.map_markers_loaded = False
+
+                # clear selection and navigate to feed
+                st.session_state.last_seen_ms = int(time.time()*1000)
+                st.session_state.selected_lat = None
+                st.session_state.selected_lng = None
+                # new key for the next report; re-runs of this one (double clicks) reuse the old key
+                st.session_state.report_key = uuid.uuid4().hex
+                st.session_state.page = "feed"
+                st.rerun()
 
-                except Exception as e:
-                    st.error("Submit failed: " + str(e))
+            except Exception as e:
+                st.error("Submit failed: " + str(e))
 
-        if c2.button("Report Feed"):
-            st.session_state.page = "feed"
-            st.rerun()
+    if c2.button("Report Feed"):
+        st.session_state.page = "feed"
+        st.rerun()
 
-        st.markdown("</div>", unsafe_allow_html=True)
+    st.markdown("</div>", unsafe_allow_html=True)
 
-    # RIGHT: Map (markers load explicitly)
-    with right:
-        st.markdown("<div class='card'>", unsafe_allow_html=True)
-        st.markdown("### 🗺️ Map — click to pick location")
-        center = list(st.session_state.get("map_center", (24.86, 67.01)))
-        m = folium.Map(location=center, zoom_start=12, control_scale=True)
-
-        cols = st.columns([1,1])
-        if cols[0].button("Load map markers"):
-            st.session_state.map_markers_loaded = True
-            docs = fetch_incidents(limit=200, order_by_field="created", order_desc=True, force_refresh=True)
-            st.session_state["_inc_cache"] = {"ts": time.time(), "params": _inc_cache_key(200, "created", True), "data": docs}
-        if cols[1].button("Clear markers cache"):
-            st.session_state["_inc_cache"] = {"ts": 0, "params": None, "data": None}
-            st.session_state.map_markers_loaded = False
-            st.success("Marker cache cleared. Click 'Load map markers' to fetch again.")
-
-        if st.session_state.map_markers_loaded:
-            docs = st.session_state.get("_inc_cache", {}).get("data") or []
-            for d in docs:
-                try:
-                    dd = d.to_dict()
-                    loc = dd.get("location")
-                    if not loc:
-                        continue
-                    lat = float(loc.latitude); lng = float(loc.longitude)
-                    popup = f"<b>{dd.get('type')} ({dd.get('level','Normal')})</b><br/>{(dd.get('description') or '')[:200]}<br/><a href='?report={d.id}&setPage=feed'>View report</a>"
-                    folium.Marker([lat, lng], popup=popup).add_to(m)
-                except Exception:
-                    continue
-
-        if st.session_state.selected_lat and st.session_state.selected_lng:
-            folium.CircleMarker(location=[st.session_state.selected_lat, st.session_state.selected_lng],
-                                radius=9, color="#ff4d4f", fill=True, fill_color="#ff4d4f").add_to(m)
-            m.location = [st.session_state.selected_lat, st.session_state.selected_lng]
-
-        map_result = st_folium(m, width="100%", height=700, returned_objects=["last_clicked"])
-        last_clicked = map_result.get("last_clicked") if isinstance(map_result, dict) else None
-        if last_clicked:
-            lat = last_clicked.get("lat"); lng = last_clicked.get("lng")
-            if lat and lng:
-                st.session_state.selected_lat = float(lat)
-                st.session_state.selected_lng = float(lng)
-                st.success(f"Selected: {lat:.6f}, {lng:.6f}")
-        st.markdown("</div>", unsafe_allow_html=True)
+@fragment
+def _map_panel():
+    st.markdown("<div class='card'>", unsafe_allow_html=True)
+    st.markdown("### 🗺️ Map — click to pick location")
+    snap = fresh_snapshot()
+    if len(snap):
+        since_24h = int(time.time()*1000) - 86_400_000
+        by_level = snap.counts_by("level", since_ms=since_24h)
+        st.caption(f"📊 Last 24h: {sum(by_level.values())} reports • {by_level.get('Dangerous', 0)} dangerous • {by_level.get('Warning', 0)} warnings")
+    center = list(st.session_state.get("map_center", (24.86, 67.01)))
+
+    live_controls("map")
+    filters = filter_controls("map")
+    cols = st.columns([1,1])
+    if cols[0].button("Load map markers"):
+        st.session_state.map_markers_loaded = True
+        fetch_incidents(limit=200, filters=filters, force_refresh=True)
+    elif st.session_state.map_markers_loaded:
+        # filter changes re-query (shared cache); live updates keep extending the same list meanwhile
+        if st.session_state.get("_inc_cache", {}).get("params") != _inc_cache_key(200, "created_ms", True, extra=filters):
+            fetch_incidents(limit=200, filters=filters, force_refresh=True)
+    if cols[1].button("Clear markers cache"):
+        st.session_state["_inc_cache"] = {"ts": 0, "params": None, "data": None}
+        st.session_state.map_markers_loaded = False
+        st.success("Marker cache cleared. Click 'Load map markers' to fetch again.")
+
+    markers = []
+    if st.session_state.map_markers_loaded:
+        docs = st.session_state.get("_inc_cache", {}).get("data") or []
+        # one marker per event (newest report, stored report count, max severity)
+        markers = event_markers(docs, loaded_event_stats(docs))
+
+    selected = None
+    if st.session_state.selected_lat and st.session_state.selected_lng:
+        selected = [st.session_state.selected_lat, st.session_state.selected_lng]
+
+    prev_value = st.session_state.get("incident_map")
+    heat = None
+    # the density grid is maintained in Firestore only
+    if db is not None and st.checkbox("🔥 Density heatmap", key="map_heat"):
+        heat = density_heat(filters, prev_value.get("view") if isinstance(prev_value, dict) else None)
+
+    # the browser keeps its markers between reruns; only changes since its last ack are sent
+    tracker = st.session_state.setdefault("_map_delta", MapDeltaTracker())
+    tracker.receive(prev_value)
+    map_value = _incident_map(center=center, zoom=12, height=700, selected=selected, heat=heat,
+                              delta=tracker.delta(markers), key="incident_map", default=None)
+    click = map_value.get("click") if isinstance(map_value, dict) else None
+    last_clicked = None
+    if click and (map_value.get("instance"), click.get("n")) != st.session_state.get("_map_click_seen"):
+        st.session_state._map_click_seen = (map_value.get("instance"), click.get("n"))
+        last_clicked = click
+    if last_clicked:
+        lat = last_clicked.get("lat"); lng = last_clicked.get("lng")
+        if lat and lng and (float(lat), float(lng)) != (st.session_state.selected_lat, st.session_state.selected_lng):
+            st.session_state.selected_lat = float(lat)
+            st.session_state.selected_lng = float(lng)
+            # redraw just this fragment so the selection marker shows up immediately
+            rerun_fragment()
+    if selected:
+        st.success(f"Selected: {selected[0]:.6f}, {selected[1]:.6f}")
+    st.markdown("</div>", unsafe_allow_html=True)
 
 # ---------------- FEED (requires login; no map) ----------------
+# IMAGE_PROXY_URL: base URL of imgproxy.py; feed photos are then loaded as width-bounded WebP
+# derivatives with long cache headers instead of the full-size originals from Storage
+IMAGE_PROXY_URL = get_secret("IMAGE_PROXY_URL")
+
 def page_feed():
-    st.markdown("""
-<style>
-/* feed-only override: set page gutters while feed is active */
-.block-container {
-  padding-left: 48px !important;
-  padding-right: 48px !important;
-  max-width: 1100px !important; /* optional */
-}
-@media (max-width: 800px) {
-  .block-container { padding-left: 12px !important; padding-right: 12px !important; }
-}
-</style>
-""", unsafe_allow_html=True)
+    # marker picked up by the feed gutter rule in app.css
+    st.markdown("<div class='feed-page'></div>", unsafe_allow_html=True)
 
     if not st.session_state.user:
         st.info("Please sign in to view the Feed.")
@@ -1295,16 +1181,6 @@ def page_feed():
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.markdown("## 📢 Report Feed")
 
-    search_col1, search_col2, search_col3 = st.columns([4,2,1])
-    with search_col1:
-        feed_search_q = st.text_input("Search location to view nearby reports (city / address)", key="feed_search")
-    with search_col2:
-        radius_km = st.number_input("Radius (km)", min_value=1, max_value=500, value=50, step=5)
-    # with search_col3:
-    #     if st.button("Clear feed cache"):
-    #         st.session_state.pop("_inc_feed", None)
-    #         st.success("Feed state cleared. It will reload automatically on page open.")
-
     if st.button("Enable browser notifications"):
         js = """
         <script>
@@ -1324,7 +1200,40 @@ def page_feed():
         """
         st.components.v1.html(js, height=0)
 
-    user_doc = get_user_doc(st.session_state.user["email"])
+    if st.session_state.get("_inc_feed") is None:
+        st.session_state["_inc_feed"] = new_feed_state()
+        st.session_state.feed_view_start = 0
+
+    feed_state = st.session_state["_inc_feed"]
+    page_size = feed_state.get("page_size", 30)
+
+    # the user doc, the first feed page and the search box lookup don't depend on each other
+    calls = {"user_doc": (get_user_doc, (st.session_state.user["email"],), IO_TIMEOUTS["user_doc"])}
+    first_page_filters = None
+    if "filters" not in feed_state:
+        first_page_filters = current_filters()
+        types, levels, window = first_page_filters
+        calls["feed_page"] = (fetch_filtered_incidents, (types, levels, filter_since_ms(window), page_size),
+                              IO_TIMEOUTS["feed_page"])
+    search_q = (st.session_state.get("feed_search") or "").strip()
+    cached_geo = st.session_state.get("_feed_geo")
+    if search_q and not (cached_geo and cached_geo[0] == search_q):
+        place = _places().resolve(search_q, near=st.session_state.get("map_center"))
+        if place is not None:
+            st.session_state["_feed_geo"] = (search_q, (place.lat, place.lng, place.label))
+        elif not rate_limited("geocode", **{"global": "all"}):
+            calls["geocode"] = (_geocode_lookup, (search_q,), IO_TIMEOUTS["geocode"])
+    results = fan_out(calls)
+
+    if "geocode" in results:
+        g = results["geocode"]
+        if isinstance(g, Exception):
+            st.warning(f"Couldn't look up '{search_q}' ({g}) — showing reports from all locations.")
+            g = None
+        st.session_state["_feed_geo"] = (search_q, g)
+
+    user_doc = results["user_doc"]
+    user_doc = None if isinstance(user_doc, Exception) else user_doc
     user_home = None
     try:
         if user_doc and user_doc.get("home_lat") is not None and user_doc.get("home_lng") is not None:
@@ -1332,52 +1241,54 @@ def page_feed():
     except Exception:
         user_home = None
 
-    if st.session_state.get("_inc_feed") is None:
-        st.session_state["_inc_feed"] = {"docs": [], "last_snap": None, "finished": False, "page_size": 30}
-
-    feed_state = st.session_state["_inc_feed"]
-    page_size = feed_state.get("page_size", 30)
-
-    if not feed_state["docs"]:
-        try:
-            snaps, last_snap = fetch_incidents_page(page_size=page_size, order_by_field="created_ms", order_desc=True, start_after_snapshot=None)
-            normalized = []
-            for s in snaps:
-                try:
-                    d = s.to_dict() or {}
-                    d["_id"] = getattr(s, "id", None)
-                    normalized.append(d)
-                except Exception:
-                    continue
-            feed_state["docs"].extend(normalized)
-            feed_state["last_snap"] = last_snap
-            feed_state["finished"] = len(snaps) < page_size
-            st.session_state["_inc_feed"] = feed_state
-        except Exception as e:
-            st.error("Failed to load feed: " + str(e))
+    if first_page_filters is not None:
+        incs = results["feed_page"]
+        if isinstance(incs, Exception):
+            st.error("Failed to load feed: " + str(incs))
             st.markdown("</div>", unsafe_allow_html=True)
             return
+        _set_feed_first_page(feed_state, first_page_filters, incs)
 
         try:
             stored_last_seen = int(user_doc.get("last_seen_ms") or 0) if user_doc else 0
-            missed_items = []
-            for d in feed_state["docs"]:
-                created_ms = d.get("created_ms") or 0
-                if created_ms > stored_last_seen:
-                    missed_items.append({
-                        "title": f"New: {d.get('type','Report')}",
-                        "body": (d.get('description') or "")[:140],
-                        "level": d.get("level")
-                    })
+            missed_items = event_notifications([inc for inc in feed_state["docs"] if inc.created_ms > stored_last_seen])
+            # events already on screen count as announced; later reports joining them stay quiet
+            st.session_state.setdefault("_notified_events", set()).update(
+                inc.event_id for inc in feed_state["docs"] if inc.event_id)
             if missed_items:
                 _send_browser_notifications(missed_items)
                 set_user_last_seen(st.session_state.user["email"], int(time.time()*1000))
         except Exception:
             pass
 
+    _feed_section(user_home)
+    st.markdown("</div>", unsafe_allow_html=True)
+
+def _load_feed_first_page(feed_state, filters):
+    page_size = feed_state.get("page_size", 30)
+    types, levels, window = filters
+    _set_feed_first_page(feed_state, filters, fetch_filtered_incidents(types, levels, filter_since_ms(window), page_size))
+
+def _set_feed_first_page(feed_state, filters, incs):
+    page_size = feed_state.get("page_size", 30)
+    feed_state["docs"] = list(incs)
+    feed_state["last_snap"] = incs[-1].id if incs else None
+    feed_state["finished"] = len(incs) < page_size
+    feed_state["top_cursor"] = None
+    feed_state["evicted"] = []
+    feed_state["filters"] = filters
+    st.session_state["_inc_feed"] = feed_state
+
+def _feed_filters(user_home):
+    """Feed filter controls; returns (center_point or None, radius_km)."""
+    search_col1, search_col2 = st.columns([4,2])
+    with search_col1:
+        feed_search_q = place_search("Search location to view nearby reports (city / address)", key="feed_search")
+    with search_col2:
+        radius_km = st.number_input("Radius (km)", min_value=1, max_value=500, value=50, step=5)
+
     filter_by_map_center = st.checkbox("Filter results to current/home location (useful to limit to local area)", value=False, key="feed_filter_map")
 
-    all_docs = feed_state["docs"]
     center_point = None
     if filter_by_map_center:
         if user_home:
@@ -1399,132 +1310,138 @@ def page_feed():
                     center_point = None
 
     if feed_search_q and feed_search_q.strip():
-        g = geocode_address(feed_search_q.strip())
+        # remember the last lookup so radius / checkbox changes don't geocode again
+        q = feed_search_q.strip()
+        cached = st.session_state.get("_feed_geo")
+        if cached and cached[0] == q:
+            g = cached[1]
+        else:
+            g = find_place(q, near=user_home or st.session_state.get("map_center"))
+            st.session_state["_feed_geo"] = (q, g)
         if g:
             center_point = (g[0], g[1])
             st.markdown(f"<div class='small'>Filtering by search location: {g[2]}</div>", unsafe_allow_html=True)
 
-    filtered = []
-    for d in all_docs:
-        loc = d.get("location")
-        if center_point and not loc:
-            continue
-        if loc:
-            try:
-                lat = float(getattr(loc, "latitude", loc.get("latitude") if isinstance(loc, dict) else None))
-                lng = float(getattr(loc, "longitude", loc.get("longitude") if isinstance(loc, dict) else None))
-            except Exception:
-                if center_point:
-                    continue
-                else:
-                    lat = None; lng = None
+    return center_point, radius_km
 
-            if center_point and lat is not None and lng is not None:
-                try:
-                    dist = haversine(center_point[0], center_point[1], lat, lng)
-                    if dist > radius_km:
-                        continue
-                except Exception:
-                    continue
+# filters + post list rerun together as one fragment: changing the radius re-filters and
+# re-renders the visible window only, not the sidebar, styles or the feed bootstrap above
+@fragment
+def _feed_section(user_home):
+    feed_state = st.session_state.get("_inc_feed") or dict(new_feed_state(), finished=True)
+    page_size = feed_state.get("page_size", 30)
+    live_controls("feed")
+    filters = filter_controls("feed")
+    if feed_state.get("filters") != filters:
+        try:
+            _load_feed_first_page(feed_state, filters)
+        except Exception as e:
+            st.error("Failed to load feed: " + str(e))
+        st.session_state.feed_view_start = 0
+    all_docs = feed_state["docs"]
+    center_point, radius_km = _feed_filters(user_home)
 
-        filtered.append(d)
+    # locations were normalised when the Incidents were built, so this is plain float math
+    if center_point:
+        clat, clng = center_point
+        filtered = within_radius(all_docs, (clat, clng), radius_km)
+    else:
+        filtered = list(all_docs)
 
     posts_to_show = filtered if filtered else all_docs
 
+    # reports of the same event collapse into the newest one, which carries the count and max severity
+    groups = {}
+    if st.checkbox("Group reports of the same event", value=True, key="feed_group_events"):
+        collapsed = group_by_event(posts_to_show)
+        posts_to_show = [lead for lead, _ in collapsed]
+        stats = loaded_event_stats(posts_to_show)
+        for lead, members in collapsed:
+            count, level = event_summary(members, stats)
+            if count > 1:
+                groups[lead.id] = (count, level)
+
     if not posts_to_show:
         st.info("No reports match current filters / area.")
     else:
-        for d in posts_to_show:
-            when = d.get("created")
-            if isinstance(when, datetime):
-                when_str = when.strftime("%b %d, %Y %H:%M")
-            else:
+        # only a window of the loaded posts is rendered; the rest keep their light fields only
+        start, end = visible_window(len(posts_to_show), st.session_state.get("feed_view_start", 0))
+        visible = posts_to_show[start:end]
+        visible_ids = {inc.id for inc in visible}
+        for inc in all_docs:
+            if inc.id not in visible_ids:
+                inc.drop_heavy()
+        load_heavy(visible)
+
+        if start > 0:
+            if st.button(f"⬆ Show newer posts ({start} hidden)", key="feed_newer"):
+                st.session_state.feed_view_start = max(0, start - FEED_WINDOW)
+                rerun_fragment()
+        elif feed_state.get("evicted"):
+            # newer pages were dropped from memory while scrolling down; fetch them again by cursor
+            if st.button(f"⬆ Load newer posts ({evicted_count(feed_state)} unloaded)", key="feed_restore"):
+                types, levels, window = filters
                 try:
-                    when_str = datetime.fromtimestamp((d.get("created_ms") or 0)/1000.0).strftime("%b %d, %Y %H:%M")
-                except Exception:
-                    when_str = str(when or "")
-
-            location_str = d.get("display_address") or ((d.get("region") or "") + (", " + (d.get("country") or "") if d.get("country") else ""))
-            username = d.get("username") or "anon"
-            content = d.get("description") or ""
-            photo = d.get("photo_url")
-            initials = (username[:1].upper() if username else "A")
-
-            level_label = d.get("level") or "Normal"
-            level_norm = str(level_label).lower()
-            if "danger" in level_norm:
-                sev_color = "#ff4d4f"
-                sev_text = "Danger"
-            elif "warning" in level_norm:
-                sev_color = "#f59e0b"
-                sev_text = "Warning"
-            elif level_norm in ("peace","normal","ok","safe"):
-                sev_color = "#10b981"
-                sev_text = level_label
-            else:
-                sev_color = "#2563EB"
-                sev_text = level_label
-
-            post_html = f"""
-            <div class='feed-card'>
-                <div class='post-header'>
-                    <div class='post-avatar'>{initials}</div>
-                    <div style='flex:1'>
-                        <div style='display:flex;align-items:center;gap:8px'>
-                            <div class='post-title'>@{username}</div>
-                            <div style='margin-left:auto;font-weight:700;padding:6px 10px;border-radius:999px;background:{sev_color};color:white;font-size:12px'>{sev_text}</div>
-                        </div>
-                        <div class='post-meta'>{when_str} • {location_str or '—'}</div>
-                    </div>
-                </div>
-                <div class='post-body'>{content}</div>
-            """
-            st.markdown(post_html, unsafe_allow_html=True)
-            if photo:
+                    restore_newer(feed_state, lambda after, n: incident_store.query(
+                        types, levels, filter_since_ms(window), limit=n, after=after), feed_max_docs())
+                    st.session_state.feed_view_start = 0
+                    rerun_fragment()
+                except Exception as e:
+                    st.error("Loading newer posts failed: " + str(e))
+
+        me = st.session_state.user["email"] if st.session_state.user else None
+        for kind, item in chunk_posts(visible, lambda inc: me is not None and inc.uid == me):
+            if kind == "html":
+                st.markdown(chunk_html(item, groups, IMAGE_PROXY_URL), unsafe_allow_html=True)
+                continue
+            d = item
+            st.markdown(post_html(d, groups.get(d.id), IMAGE_PROXY_URL), unsafe_allow_html=True)
+            if st.button("Delete", key=f"delfeed_{d.id}"):
                 try:
-                    st.image(photo, caption=None, use_column_width=True)
-                except Exception:
-                    pass
+                    incident_store.delete(d.id)
+                    if db is not None:
+                        try:
+                            leave_event(db, d)
+                            _density_writer().add(d.type, d.level, d.lat, d.lng, d.created_ms, sign=-1)
+                        except Exception as e:
+                            print("event / density update error:", e)
+                        try:
+                            # the blob stays while other reports share the same photo
+                            release_photo(bucket, db, d.id, d.photo_url)
+                        except Exception as e:
+                            print("photo release error:", e)
+                    incident_snapshot().remove(d.id)
+                    fetch_filtered_incidents.clear()
+                    st.session_state.pop("_inc_feed", None)
+                    st.success("Deleted. Feed will reload on next visit.")
+                    st.rerun()
+                except Exception as e:
+                    st.error("Delete failed: " + str(e))
 
-            if st.session_state.user and d.get("uid") == st.session_state.user["email"]:
-                if st.button("Delete", key=f"delfeed_{d.get('_id')}"):
-                    try:
-                        db.collection(INCIDENTS_COLLECTION).document(d.get('_id')).delete()
-                        st.session_state.pop("_inc_feed", None)
-                        st.success("Deleted. Feed will reload on next visit.")
-                        st.rerun()
-                    except Exception as e:
-                        st.error("Delete failed: " + str(e))
+        if end < len(posts_to_show):
+            if st.button(f"⬇ Show older loaded posts ({len(posts_to_show) - end} more)", key="feed_older"):
+                st.session_state.feed_view_start = start + FEED_WINDOW
+                rerun_fragment()
 
     st.markdown("<div style='text-align:center;margin-top:12px'>", unsafe_allow_html=True)
     if not feed_state.get("finished", False):
         if st.button("Load more"):
             try:
                 last_snap = feed_state.get("last_snap", None)
-                snaps, last_snap_new = fetch_incidents_page(page_size=page_size, order_by_field="created_ms", order_desc=True, start_after_snapshot=last_snap)
-                normalized = []
-                for s in snaps:
-                    try:
-                        d = s.to_dict() or {}
-                        d["_id"] = getattr(s, "id", None)
-                        normalized.append(d)
-                    except Exception:
-                        continue
-                existing_ids = {x["_id"] for x in feed_state["docs"] if x.get("_id")}
-                for nd in normalized:
-                    if nd.get("_id") not in existing_ids:
-                        feed_state["docs"].append(nd)
-                feed_state["last_snap"] = last_snap_new
-                feed_state["finished"] = len(snaps) < page_size
+                incs, last_snap_new = fetch_incidents_page(page_size=page_size, after_id=last_snap, filters=filters)
+                append_older(feed_state, incs, last_snap_new or last_snap, feed_max_docs())
                 st.session_state["_inc_feed"] = feed_state
-                st.experimental_rerun()
+                # slide the render window to the first post of the new page; the window counts shown
+                # posts (after the area filter and event grouping), less those evicted from the top
+                kept = {inc.id for inc in feed_state["docs"]}
+                st.session_state.feed_view_start = sum(1 for inc in posts_to_show if inc.id in kept)
+                rerun_fragment()
             except Exception as e:
                 st.error("Load more failed: " + str(e))
     else:
         st.markdown("<div class='small'>No more posts.</div>", unsafe_allow_html=True)
 
     st.markdown("</div>", unsafe_allow_html=True)
-    st.markdown("</div>", unsafe_allow_html=True)
 
 # ---------------- ACCOUNT (unchanged) ----------------
 def page_account():
@@ -1543,17 +1460,17 @@ def page_account():
         st.markdown(f"Current home location: {current_home[0]:.5f}, {current_home[1]:.5f}")
     c1, c2 = st.columns([2,1])
     with c1:
-        home_addr = st.text_input("Search a place to set as your home location", key="home_search")
+        home_addr = place_search("Search a place to set as your home location", key="home_search") or ""
         if st.button("Find home location"):
             if home_addr.strip():
-                res = geocode_address(home_addr.strip())
+                res = find_place(home_addr.strip(), near=current_home)
                 if res:
                     lat, lng, addr = res
                     st.session_state['home_lat_tmp'] = lat
                     st.session_state['home_lng_tmp'] = lng
                     st.success(f"Found: {addr}")
                 else:
-                    st.error("Not found.")
+                    st.error("Not found." + did_you_mean(home_addr))
     with c2:
         if st.button("Save home location"):
             lat = st.session_state.get("home_lat_tmp"); lng = st.session_state.get("home_lng_tmp")
@@ -1562,10 +1479,28 @@ def page_account():
             else:
                 set_user_home_location(st.session_state.user["email"], lat, lng)
                 st.success("Home location saved.")
+    mine = track_session_size(force=True) or 0
+    server = session_size_stats()
+    st.caption(f"🧠 This tab holds {mine / 1024:.0f} KB of session state • this server: {server['sessions']} "
+               f"active sessions, {server['total_bytes'] / 1_048_576:.1f} MB (largest {server['max_bytes'] / 1024:.0f} KB)")
+    geo = _geocoder().health()
+    for prov in geo["providers"]:
+        latency = f", avg {prov['avg_latency_ms']:.0f} ms" if prov["avg_latency_ms"] is not None else ""
+        last = f" • last error: {prov['last_error']}" if prov["state"] != "closed" and prov["last_error"] else ""
+        st.caption(f"📍 Geocoder {prov['name']}: {prov['state'].replace('_', '-')} • {prov['successes']}/{prov['calls']} ok"
+                   f"{latency}, {prov['timeouts']} timeouts, {prov['short_circuits']} skipped while open{last}")
+    st.caption(f"📍 Geocode cache: {geo['cache']['entries']} entries, {geo['cache']['hits']} hits, "
+               f"{geo['cache']['stale_hits']} served stale")
+    for limiter in rate_limiters().values():
+        stats = limiter.stats
+        by_scope = ", ".join(f"{scope} {n}" for scope, n in stats["rejected_by"].items() if n)
+        st.caption(f"🚦 Rate limit {limiter.name}: {stats['allowed']} allowed, {stats['rejected']} rejected"
+                   + (f" ({by_scope})" if by_scope else "") + " since this server started")
     st.markdown("</div>", unsafe_allow_html=True)
 
 # ---------------- ROUTER ----------------
 def router():
+    track_session_size()
     render_sidebar()
     page = st.session_state.page
 
@@ -0,0 +1,220 @@
+# bench.py — reproducible benchmarks for the app's hot paths against a local store and a stub geocoder
+#
+#   python bench.py                                  # 1k, 100k and 1M incidents, in-memory store
+#   python bench.py --sizes 1k,100k --backend sqlite --out bench.json
+#   python bench.py --sizes 100k --baseline bench.json   # exit 1 if a p50 got > 25% slower
+#
+# Each size seeds the store with the same synthetic incidents (fixed seed, clustered around a few
+# cities, spread over 30 days, some grouped into events) and times the code the app runs:
+#
+#   feed_radius_filter   feed.within_radius over the loaded feed docs
+#   map_markers          store.query(limit=200) + mapdelta.event_markers (the map's marker load)
+#   feed_pagination      store.query pages of 30 with a type filter (fetch_incidents_page / Load more)
+#   login_missed         notify.missed_incidents + notify.event_items at sign-in
+#   notification_payload notify.notification_html for the missed items (also reports bytes)
+#   save_enqueue         reports.queue_report into a ReportOutbox (what "Submit report" waits for)
+#   save_deliver         outbox drain -> reports.deliver_report with the stub geocoder
+#
+# Results are JSON: {"meta": {...}, "sizes": {"1k": {"seed_s": ..., "<bench>": {ms stats}}}}.
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from feed import within_radius
+from mapdelta import event_markers
+from notify import event_items, missed_incidents, notification_html
+from outbox import ReportOutbox
+from reports import deliver_report, queue_report
+from store import open_stores
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+SPAN_MS = 30 * 86_400_000
+PAGE_SIZE = 30
+FEED_DOCS = 10_000
+# (lat, lng, spread in degrees)
+CITIES = [(24.86, 67.01, 0.3), (31.55, 74.34, 0.25), (33.69, 73.05, 0.2), (30.20, 71.47, 0.2),
+          (25.39, 68.37, 0.2), (34.01, 71.58, 0.2), (-6.20, 106.85, 0.4), (14.60, 120.98, 0.3)]
+TYPES = ["Flood", "Fire", "Earthquake", "Storm", "Landslide", "Roadblock", "Other"]
+LEVEL_WEIGHTS = {"Peace": 1, "Normal": 5, "Warning": 3, "Dangerous": 1}
+DESCRIPTIONS = [f"Synthetic report {i}: water rising near the main road, people need help." for i in range(64)]
+
+
+def parse_size(v):
+    if v in SIZES:
+        return SIZES[v]
+    v = v.lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(v[-1:], 1)
+    return int(float(v.rstrip("km")) * mult)
+
+
+def synthetic_incidents(n, seed=0, now_ms=None):
+    """Yield (id, document) for n incidents, oldest first; the same seed gives the same incidents."""
+    rnd = random.Random(seed)
+    now_ms = int(now_ms or time.time()*1000)
+    levels, weights = list(LEVEL_WEIGHTS), list(LEVEL_WEIGHTS.values())
+    step = SPAN_MS / max(1, n)
+    event = None
+    for i in range(n):
+        created_ms = now_ms - SPAN_MS + int(i * step)
+        if event and rnd.random() < 0.2:
+            # follow-up report of the previous event, a few hundred metres away
+            event_id, inc_type, lat, lng = event
+            lat, lng = lat + rnd.uniform(-0.002, 0.002), lng + rnd.uniform(-0.002, 0.002)
+        else:
+            clat, clng, spread = rnd.choice(CITIES)
+            lat, lng = clat + rnd.uniform(-spread, spread), clng + rnd.uniform(-spread, spread)
+            inc_type = rnd.choice(TYPES)
+            event_id = f"ev{i:07d}" if rnd.random() < 0.3 else None
+            event = (event_id, inc_type, lat, lng) if event_id else None
+        doc = {"uid": f"user{rnd.randrange(5000)}@example.com", "username": f"user{i % 5000}",
+               "type": inc_type, "level": rnd.choices(levels, weights)[0], "description": rnd.choice(DESCRIPTIONS),
+               "location": {"latitude": lat, "longitude": lng}, "created_ms": created_ms, "source": "bench"}
+        if event_id:
+            doc["event_id"] = event_id
+        yield f"b{i:07d}", doc
+
+
+def stub_reverse_geocode(delay_s=0.0):
+    def reverse_geocode(lat, lng):
+        if delay_s:
+            time.sleep(delay_s)
+        return "Pakistan", "Sindh", f"Near {lat:.3f}, {lng:.3f}"
+    return reverse_geocode
+
+
+def latency_stats(samples_s):
+    """min / p50 / p95 / max / mean in ms for durations in seconds."""
+    ms = sorted(s * 1000.0 for s in samples_s)
+    pick = lambda q: ms[min(len(ms) - 1, int(q * len(ms)))]
+    return {"runs": len(ms), "min_ms": round(ms[0], 4), "p50_ms": round(pick(0.5), 4), "p95_ms": round(pick(0.95), 4),
+            "max_ms": round(ms[-1], 4), "mean_ms": round(statistics.fmean(ms), 4)}
+
+
+def timed(fn, repeat):
+    """Call fn() `repeat` times; returns (stats, last result)."""
+    samples, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - t0)
+    return latency_stats(samples), result
+
+
+def run_size(n, backend="memory", repeat=20, seed=0, geocode_delay=0.0, workdir=None):
+    workdir = workdir or tempfile.mkdtemp(prefix="bench-")
+    now_ms = int(time.time()*1000)
+    incidents, users = open_stores(backend, sqlite_path=os.path.join(workdir, f"bench-{n}.sqlite3"))
+    out = {"incidents": n}
+
+    t0 = time.perf_counter()
+    for doc_id, doc in synthetic_incidents(n, seed, now_ms):
+        incidents.create(doc_id, doc)
+    out["seed_s"] = round(time.perf_counter() - t0, 3)
+
+    rnd = random.Random(seed + 1)
+    home = CITIES[0][:2]
+    feed_docs, _ = incidents.query(limit=min(n, FEED_DOCS))
+
+    stats, kept = timed(lambda: within_radius(feed_docs, (home[0] + rnd.uniform(-0.1, 0.1), home[1]), 10), repeat)
+    out["feed_radius_filter"] = dict(stats, items=len(feed_docs), kept=len(kept))
+
+    stats, markers = timed(lambda: event_markers(incidents.query(limit=200)[0]), repeat)
+    out["map_markers"] = dict(stats, markers=len(markers))
+
+    def paginate(pages=10):
+        cursor, got = None, 0
+        for _ in range(pages):
+            page, cursor = incidents.query(types=("Flood",), limit=PAGE_SIZE, after=cursor)
+            got += len(page)
+            if not cursor:
+                break
+        return got
+    stats, got = timed(paginate, max(1, repeat // 2))
+    out["feed_pagination"] = dict(stats, pages=10, page_size=PAGE_SIZE, incidents=got)
+
+    last_seen = now_ms - 6 * 3_600_000
+    stats, items = timed(lambda: event_items(missed_incidents(incidents, last_seen, home), set(), "Missed"), repeat)
+    out["login_missed"] = dict(stats, items=len(items))
+
+    stats, html = timed(lambda: notification_html(items), repeat)
+    out["notification_payload"] = dict(stats, items=len(items), bytes=len(html.encode("utf-8")))
+
+    reverse_geocode = stub_reverse_geocode(geocode_delay)
+    outbox = ReportOutbox(os.path.join(workdir, f"outbox-{n}.sqlite3"),
+                          lambda key, payload, photo, name: deliver_report(incidents, key, payload, photo, name,
+                                                                           reverse_geocode=reverse_geocode))
+    stats, _ = timed(lambda: queue_report(outbox, "bench@example.com", "bench", "Flood", DESCRIPTIONS[0],
+                                          home[0] + rnd.uniform(-0.1, 0.1), home[1], "Warning"), repeat)
+    out["save_enqueue"] = stats
+    outbox.drain()
+
+    stats, _ = timed(lambda: queue_report(outbox, "bench@example.com", "bench", "Fire", DESCRIPTIONS[1],
+                                          home[0], home[1], "Normal") and outbox.drain(), repeat)
+    out["save_deliver"] = dict(stats, geocode_delay_ms=geocode_delay * 1000)
+    outbox.close()
+    return out
+
+
+def compare(results, baseline, tolerance=1.25):
+    """[(size, bench, old p50, new p50)] for every benchmark whose p50 grew by more than `tolerance`x."""
+    slower = []
+    for size, benches in results["sizes"].items():
+        old = baseline.get("sizes", {}).get(size) or {}
+        for name, stats in benches.items():
+            if not isinstance(stats, dict) or not isinstance(old.get(name), dict):
+                continue
+            before, after = old[name].get("p50_ms"), stats.get("p50_ms")
+            # sub-0.05 ms timings are mostly noise
+            if before and after and after > max(before * tolerance, 0.05):
+                slower.append((size, name, before, after))
+    return slower
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the feed / map / login / submit hot paths.")
+    ap.add_argument("--sizes", default="1k,100k,1M", help="comma separated, e.g. 1k,100k,1M or 250k")
+    ap.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--geocode-delay-ms", type=float, default=0.0, help="stub reverse geocoder latency")
+    ap.add_argument("--out", help="write JSON here instead of stdout")
+    ap.add_argument("--baseline", help="earlier --out file; exit 1 when a p50 regressed beyond --tolerance")
+    ap.add_argument("--tolerance", type=float, default=1.25)
+    args = ap.parse_args(argv)
+
+    results = {
+        "meta": {"backend": args.backend, "repeat": args.repeat, "seed": args.seed,
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "started": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+        "sizes": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        for label in [s.strip() for s in args.sizes.split(",") if s.strip()]:
+            print(f"bench: {label} incidents ...", file=sys.stderr)
+            results["sizes"][label] = run_size(parse_size(label), args.backend, args.repeat, args.seed,
+                                               args.geocode_delay_ms / 1000.0, workdir)
+
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for size, name, before, after in slower:
+            print(f"REGRESSION {size} {name}: p50 {before:.3f} ms -> {after:.3f} ms", file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
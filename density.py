@@ -0,0 +1,298 @@
+# density.py — incrementally maintained incident density grid for the heatmap layer
+#
+#   python density.py rebuild [--since 30d]     # recount from the incidents collection (after bulk imports)
+#
+# Every saved incident increments one counter per grid precision (geohash 3..6, roughly 156 km down
+# to 1.2 km cells) in the UTC day it happened. Counters live in documents keyed by precision, day and
+# a parent cell two levels coarser (at most 32**2 cells per document), so drawing a heatmap for a
+# viewport reads a handful of small documents per day instead of scanning incidents:
+#
+#   density/p{precision}_{day}_{parent}: p, day, parent,
+#       cells: {cell: {n: total, t{type index}l{level index}: count, ...}}
+#
+# The app does not write a document per report: DensityWriter adds the changes up in memory and
+# flushes them as one increment per document every few seconds, so a burst of reports from one area
+# costs each of its documents one write per flush (Firestore sustains about one write per second
+# per document). A failed flush keeps its changes queued for the next one.
+import argparse
+import atexit
+import json
+import sys
+import threading
+import time
+
+from firebase_admin import firestore
+
+from geo import geohash_bounds, geohash_center, geohash_encode
+from incidents import DENSITY_COLLECTION, INCIDENT_TYPES, LEVELS, location_of, normalize_level
+
+GRID_PRECISIONS = (3, 4, 5, 6)
+DAY_MS = 86_400_000
+MAX_PARENT_CELLS = 16
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_WRITES = 400
+
+
+def parent_precision(precision):
+    # keeps one document at <= 32**2 cells while a viewport still needs only a few documents
+    return max(1, precision - 2)
+
+
+def zoom_precision(zoom):
+    """Grid precision for a Leaflet zoom level."""
+    if zoom <= 5:
+        return 3
+    if zoom <= 8:
+        return 4
+    if zoom <= 11:
+        return 5
+    return 6
+
+
+def day_of(ms):
+    return int(ms) // DAY_MS
+
+
+def doc_id(precision, day, parent):
+    return f"p{precision}_{day}_{parent}"
+
+
+def count_key(inc_type, level):
+    ti = INCIDENT_TYPES.index(inc_type) if inc_type in INCIDENT_TYPES else INCIDENT_TYPES.index("Other")
+    return f"t{ti}l{LEVELS.index(normalize_level(level))}"
+
+
+def grid_updates(inc_type, level, lat, lng, created_ms, sign=1):
+    """[(doc id, merge data)] adding (sign=1) or removing (sign=-1) one incident from every grid."""
+    day = day_of(created_ms)
+    key = count_key(inc_type, level)
+    full = geohash_encode(lat, lng, max(GRID_PRECISIONS))
+    out = []
+    for p in GRID_PRECISIONS:
+        cell, parent = full[:p], full[:parent_precision(p)]
+        out.append((doc_id(p, day, parent), {
+            "p": p, "day": day, "parent": parent,
+            "cells": {cell: {"n": firestore.Increment(sign), key: firestore.Increment(sign)}},
+        }))
+    return out
+
+
+def record(db, inc_type, level, lat, lng, created_ms, sign=1):
+    """Apply one incident to the grid in a single batch."""
+    if lat is None or lng is None:
+        return
+    batch = db.batch()
+    col = db.collection(DENSITY_COLLECTION)
+    for did, data in grid_updates(inc_type, level, lat, lng, created_ms, sign):
+        batch.set(col.document(did), data, merge=True)
+    batch.commit()
+
+
+def record_doc(db, doc, sign=1):
+    lat, lng = location_of(doc)
+    record(db, doc.get("type"), doc.get("level"), lat, lng, doc.get("created_ms") or int(time.time()*1000), sign)
+
+
+class DensityWriter:
+    """
+    Write-behind queue for grid changes: add() only sums counter deltas per document and cell,
+    flush() writes each touched document once as a merge-set of Increments (every `interval`
+    seconds after start(), at shutdown, or on demand). Chunks that fail to write are added back.
+    """
+
+    def __init__(self, db, interval=3.0):
+        self.db = db
+        self.interval = float(interval)
+        self._pending = {}   # doc id -> (p, day, parent, {cell: {key: delta}})
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"changes": 0, "written": 0, "batches": 0, "errors": 0}
+
+    def _merge(self, did, p, day, parent, cells):
+        _, _, _, pending = self._pending.setdefault(did, (p, day, parent, {}))
+        for cell, counts in cells.items():
+            target = pending.setdefault(cell, {})
+            for key, delta in counts.items():
+                target[key] = target.get(key, 0) + delta
+
+    def add(self, inc_type, level, lat, lng, created_ms, sign=1):
+        if lat is None or lng is None:
+            return
+        day = day_of(created_ms)
+        key = count_key(inc_type, level)
+        full = geohash_encode(lat, lng, max(GRID_PRECISIONS))
+        with self._lock:
+            self.stats["changes"] += 1
+            for p in GRID_PRECISIONS:
+                parent = full[:parent_precision(p)]
+                self._merge(doc_id(p, day, parent), p, day, parent, {full[:p]: {"n": sign, key: sign}})
+
+    def add_doc(self, doc, sign=1):
+        lat, lng = location_of(doc)
+        self.add(doc.get("type"), doc.get("level"), lat, lng, doc.get("created_ms") or int(time.time()*1000), sign)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Write everything queued so far. Returns the number of documents written."""
+        with self._flush_lock:
+            with self._lock:
+                items = list(self._pending.items())
+                self._pending = {}
+            col = self.db.collection(DENSITY_COLLECTION)
+            written = 0
+            for i in range(0, len(items), MAX_BATCH_WRITES):
+                chunk = items[i:i + MAX_BATCH_WRITES]
+                try:
+                    batch = self.db.batch()
+                    for did, (p, day, parent, cells) in chunk:
+                        # an add and a remove can cancel out; an empty map would clear the cell on merge
+                        changes = {cell: {k: firestore.Increment(d) for k, d in counts.items() if d}
+                                   for cell, counts in cells.items() if any(counts.values())}
+                        if changes:
+                            batch.set(col.document(did), {"p": p, "day": day, "parent": parent, "cells": changes},
+                                      merge=True)
+                    batch.commit()
+                    written += len(chunk)
+                    self.stats["batches"] += 1
+                except Exception as e:
+                    print("DensityWriter flush error:", e)
+                    self.stats["errors"] += 1
+                    # a batch commits all or nothing, so the whole chunk goes back in the queue
+                    with self._lock:
+                        for did, (p, day, parent, cells) in chunk:
+                            self._merge(did, p, day, parent, cells)
+            self.stats["written"] += written
+            return written
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._thread = threading.Thread(target=self._run, name="density-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+def covering_cells(bbox, precision, limit=MAX_PARENT_CELLS):
+    """Geohash cells of `precision` covering bbox (min_lng, min_lat, max_lng, max_lat), or None if more than limit."""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    min_lng, max_lng = max(-179.999, min_lng), min(179.999, max_lng)
+    min_lat, max_lat = max(-89.999, min_lat), min(89.999, max_lat)
+    lat_lo, lat_hi, lng_lo, lng_hi = geohash_bounds(geohash_encode(0.0, 0.0, precision))
+    dlat, dlng = lat_hi - lat_lo, lng_hi - lng_lo
+    cells = []
+    lat = min_lat
+    while True:
+        lng = min_lng
+        while True:
+            cell = geohash_encode(lat, lng, precision)
+            if cell not in cells:
+                cells.append(cell)
+                if len(cells) > limit:
+                    return None
+            if lng >= max_lng:
+                break
+            lng = min(lng + dlng, max_lng)
+        if lat >= max_lat:
+            break
+        lat = min(lat + dlat, max_lat)
+    return cells
+
+
+def read_grid(db, precision, parents, days, types=None, levels=None):
+    """{cell: count} for the given parent cells and day numbers, optionally limited to types / levels."""
+    col = db.collection(DENSITY_COLLECTION)
+    refs = [col.document(doc_id(precision, day, parent)) for day in days for parent in parents]
+    keys = None
+    if types or levels:
+        keys = {count_key(t, lv) for t in (types or INCIDENT_TYPES) for lv in (levels or LEVELS)}
+    grid = {}
+    for snap in db.get_all(refs):
+        if not snap.exists:
+            continue
+        for cell, counts in ((snap.to_dict() or {}).get("cells") or {}).items():
+            n = counts.get("n", 0) if keys is None else sum(v for k, v in counts.items() if k in keys)
+            if n > 0:
+                grid[cell] = grid.get(cell, 0) + n
+    return grid
+
+
+def heat_points(grid):
+    """[[lat, lng, count]] at cell centres."""
+    return [[*geohash_center(cell), n] for cell, n in grid.items()]
+
+
+def rebuild(db, since_ms, page_size=500):
+    """Recount every grid document from since_ms's day onwards (one incident scan, absolute writes)."""
+    from export import iter_incident_pages
+    since_ms = day_of(since_ms) * DAY_MS
+    docs = {}
+    scanned = 0
+    for page in iter_incident_pages(db, since_ms=since_ms, page_size=page_size):
+        for snap in page:
+            data = snap.to_dict()
+            lat, lng = location_of(data)
+            if lat is None or lng is None or not data.get("created_ms"):
+                continue
+            scanned += 1
+            key = count_key(data.get("type"), data.get("level"))
+            full = geohash_encode(lat, lng, max(GRID_PRECISIONS))
+            day = day_of(data["created_ms"])
+            for p in GRID_PRECISIONS:
+                did = doc_id(p, day, full[:parent_precision(p)])
+                doc = docs.setdefault(did, {"p": p, "day": day, "parent": full[:parent_precision(p)], "cells": {}})
+                counts = doc["cells"].setdefault(full[:p], {"n": 0})
+                counts["n"] += 1
+                counts[key] = counts.get(key, 0) + 1
+    col = db.collection(DENSITY_COLLECTION)
+    stale = [s.reference for s in col.where("day", ">=", day_of(since_ms)).stream() if s.id not in docs]
+    batch, n = db.batch(), 0
+    for ref in stale:
+        batch.delete(ref)
+        n += 1
+        if n % 400 == 0:
+            batch.commit()
+            batch = db.batch()
+    for did, doc in docs.items():
+        batch.set(col.document(did), doc)
+        n += 1
+        if n % 400 == 0:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+    return {"incidents": scanned, "documents": len(docs), "deleted": len(stale)}
+
+
+def main(argv=None):
+    from export import parse_since
+    from firebase_init import DEFAULT_SECRETS_PATH, init_from_cli
+
+    ap = argparse.ArgumentParser(description="Rebuild the incident density grid.")
+    ap.add_argument("command", choices=["rebuild"])
+    ap.add_argument("--since", default="30d", help="ISO time, epoch, or relative like 7d (default 30d)")
+    ap.add_argument("--secrets", default=DEFAULT_SECRETS_PATH)
+    ap.add_argument("--service-account", default=None)
+    args = ap.parse_args(argv)
+
+    started = time.time()
+    db, _ = init_from_cli(args.secrets, args.service_account)
+    result = rebuild(db, parse_since(args.since) or 0)
+    print(json.dumps(dict(result, seconds=round(time.time() - started, 2))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
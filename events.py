@@ -0,0 +1,185 @@
+# events.py — group near-duplicate reports (same type, close in space and time) into events
+#
+# Each incident is attached to an event when it is saved. Candidate events are found with one query:
+# same type, anchor geohash-6 cell in the incident's cell or its 8 neighbours, last report within
+# EVENT_WINDOW_MS. The nearest candidate within EVENT_RADIUS_KM wins; otherwise a new event starts
+# under an id derived from (type, geohash-6 cell, time bucket), so simultaneous first reports of the
+# same thing, which cannot see each other's event yet, meet in one document instead of starting two.
+# Event counters are updated with server-side transforms (Increment / Maximum), so concurrent
+# reports never overwrite each other. Joining runs in a transaction together with a membership
+# marker per incident, so a report delivered twice (outbox retry) is counted once. The feed and map
+# show the event document's count, not the number of its reports that happen to be loaded.
+#
+#   events/{id}: type, geohash6 (anchor), first_ms, last_ms, count, sum_lat, sum_lng, level_rank,
+#                first_incident_id, country, region, display_address
+#   event_members/{incident id}: event_id, left (set once the incident is deleted)
+import hashlib
+
+from firebase_admin import firestore
+
+from geo import geohash_encode, geohash_neighbors, haversine
+from incidents import EVENT_MEMBERS_COLLECTION, EVENTS_COLLECTION, LEVELS, location_of, normalize_level
+
+EVENT_RADIUS_KM = 0.5
+EVENT_WINDOW_MS = 60 * 60 * 1000
+EVENT_GEOHASH_PRECISION = 6
+
+
+def level_rank(level):
+    return LEVELS.index(normalize_level(level))
+
+
+def event_center(data):
+    count = data.get("count") or 0
+    if not count:
+        return None, None
+    return data.get("sum_lat", 0.0) / count, data.get("sum_lng", 0.0) / count
+
+
+def event_doc_id(inc_type, lat, lng, created_ms):
+    """Id of the event a report starts when no existing event matches it."""
+    cell = geohash_encode(lat, lng, EVENT_GEOHASH_PRECISION)
+    type_key = hashlib.sha1(str(inc_type or "").encode("utf-8")).hexdigest()[:10]
+    return f"{cell}-{int(created_ms) // EVENT_WINDOW_MS}-{type_key}"
+
+
+def find_event(db, inc_type, lat, lng, created_ms):
+    """Reference of the nearest matching event, or None."""
+    cells = geohash_neighbors(geohash_encode(lat, lng, EVENT_GEOHASH_PRECISION))
+    query = db.collection(EVENTS_COLLECTION).where("type", "==", inc_type).where("geohash6", "in", cells) \
+        .where("last_ms", ">=", int(created_ms) - EVENT_WINDOW_MS)
+    best = None
+    for snap in query.stream():
+        elat, elng = event_center(snap.to_dict())
+        if elat is None:
+            continue
+        dist = haversine(lat, lng, elat, elng)
+        if dist <= EVENT_RADIUS_KM and (best is None or dist < best[0]):
+            best = (dist, snap.reference)
+    return best[1] if best else None
+
+
+def assign_event(db, incident_id, doc):
+    """
+    Join the incident document to a nearby recent event of the same type, or start a new one.
+    Sets doc["event_id"] and returns (event_id, is_new_event). Incidents without a location get no event.
+    Idempotent per incident_id: a retried delivery gets the event it joined the first time and counts once.
+    """
+    lat, lng = location_of(doc)
+    if lat is None or lng is None:
+        return None, False
+    created_ms = int(doc.get("created_ms") or 0)
+    # custom "Other" reports group by their title, so unrelated ones do not merge into one event
+    event_type = doc.get("title") or doc.get("type")
+    marker = db.collection(EVENT_MEMBERS_COLLECTION).document(incident_id)
+    ref = find_event(db, event_type, lat, lng, created_ms) \
+        or db.collection(EVENTS_COLLECTION).document(event_doc_id(event_type, lat, lng, created_ms))
+
+    @firestore.transactional
+    def run(transaction):
+        joined = marker.get(transaction=transaction)
+        if joined.exists:
+            return joined.get("event_id"), False
+        # a concurrent first report may have created the same event since find_event; the transaction
+        # read makes one of the two retry and join it
+        if ref.get(transaction=transaction).exists:
+            transaction.update(ref, {
+                "count": firestore.Increment(1),
+                "sum_lat": firestore.Increment(lat),
+                "sum_lng": firestore.Increment(lng),
+                "last_ms": firestore.Maximum(created_ms),
+                "level_rank": firestore.Maximum(level_rank(doc.get("level"))),
+            })
+            new = False
+        else:
+            transaction.set(ref, {
+                "type": event_type,
+                "geohash6": geohash_encode(lat, lng, EVENT_GEOHASH_PRECISION),
+                "first_ms": created_ms,
+                "last_ms": created_ms,
+                "count": 1,
+                "sum_lat": lat,
+                "sum_lng": lng,
+                "level_rank": level_rank(doc.get("level")),
+                "first_incident_id": incident_id,
+                "country": doc.get("country"),
+                "region": doc.get("region"),
+                "display_address": doc.get("display_address"),
+            })
+            new = True
+        transaction.set(marker, {"event_id": ref.id})
+        return ref.id, new
+
+    event_id, new = run(db.transaction())
+    doc["event_id"] = event_id
+    return event_id, new
+
+
+def leave_event(db, inc):
+    """Take a deleted Incident out of its event's count and centroid (max severity is kept)."""
+    if not inc.event_id or not inc.has_location:
+        return
+    ref = db.collection(EVENTS_COLLECTION).document(inc.event_id)
+    marker = db.collection(EVENT_MEMBERS_COLLECTION).document(inc.id)
+
+    @firestore.transactional
+    def run(transaction):
+        joined = marker.get(transaction=transaction)
+        # the marker is kept as a tombstone so a repeated delete is not counted twice; incidents
+        # saved before membership markers existed have none and are taken out as before
+        if joined.exists:
+            if joined.get("left") or joined.get("event_id") != inc.event_id:
+                return
+            transaction.update(marker, {"left": True})
+        transaction.update(ref, {
+            "count": firestore.Increment(-1),
+            "sum_lat": firestore.Increment(-inc.lat),
+            "sum_lng": firestore.Increment(-inc.lng),
+        })
+
+    run(db.transaction())
+
+
+def group_by_event(incidents):
+    """
+    Collapse loaded Incidents that share an event into one entry: [(lead, members)] in input order.
+    The lead is the first member seen (the newest one for a newest-first list); incidents without
+    an event are their own group.
+    """
+    groups = {}
+    order = []
+    for inc in incidents:
+        key = inc.event_id or ("inc", inc.id)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(inc)
+    return [(groups[k][0], groups[k]) for k in order]
+
+
+def max_level(incidents):
+    return LEVELS[max(level_rank(inc.level) for inc in incidents)]
+
+
+def event_stats(db, event_ids):
+    """{event id: (report count, max level)} from the stored event documents; unknown ids are left out."""
+    refs = [db.collection(EVENTS_COLLECTION).document(eid) for eid in dict.fromkeys(event_ids) if eid]
+    stats = {}
+    for snap in db.get_all(refs) if refs else ():
+        if snap.exists:
+            data = snap.to_dict()
+            rank = min(max(int(data.get("level_rank") or 0), 0), len(LEVELS) - 1)
+            stats[snap.id] = (int(data.get("count") or 0), LEVELS[rank])
+    return stats
+
+
+def event_summary(members, stats=None):
+    """
+    (report count, max level) for a group from group_by_event: the stored event's count when known
+    (reports outside the loaded page count too), otherwise the loaded members.
+    """
+    level = max_level(members)
+    stored = (stats or {}).get(members[0].event_id)
+    if not stored or stored[0] <= 0:
+        return len(members), level
+    return stored[0], LEVELS[max(LEVELS.index(level), LEVELS.index(stored[1]))]
@@ -0,0 +1,314 @@
+# export.py — stream the incidents collection to NDJSON, GeoJSON or Parquet in constant memory
+#
+#   python export.py incidents.ndjson
+#   python export.py floods.geojson --type Flood --since 7d --bbox 66.5,24.5,67.5,25.2
+#   python export.py parquet_out/ --format parquet --level Dangerous --level Warning
+#
+# Documents are read page by page with a (created_ms, document id) cursor. After every page the
+# output is flushed and the cursor + output size are written to a state file, so an interrupted
+# export can be continued with --resume without duplicating or losing rows. The state file also
+# records the filters; resuming with different ones is refused.
+# More --type x --level combinations than one Firestore query allows are read as several disjoint
+# queries merged in (created_ms, document id) order, so the same cursor continues each of them.
+import argparse
+import heapq
+import itertools
+import json
+import os
+import sys
+import time
+
+from firebase_admin import firestore
+
+from firebase_init import DEFAULT_SECRETS_PATH, init_from_cli
+from incidents import IN_FILTER_LIMIT, INCIDENTS_COLLECTION, filter_query, parse_time_ms, to_record
+
+PARQUET_COLUMNS = [
+    ("id", "string"), ("created_ms", "int64"), ("created", "string"), ("type", "string"), ("level", "string"),
+    ("lat", "float64"), ("lng", "float64"), ("description", "string"), ("uid", "string"), ("username", "string"),
+    ("country", "string"), ("region", "string"), ("display_address", "string"), ("photo_url", "string"),
+    ("source", "string"), ("external_id", "string"),
+]
+
+
+def parse_since(v, now_ms=None):
+    """'24h' / '7d' / '90m' relative to now, otherwise anything parse_time_ms accepts."""
+    if v in (None, ""):
+        return None
+    s = str(v).strip().lower()
+    units = {"m": 60_000, "h": 3_600_000, "d": 86_400_000}
+    if s[-1:] in units and s[:-1].isdigit():
+        now_ms = now_ms if now_ms is not None else int(time.time()*1000)
+        return now_ms - int(s[:-1])*units[s[-1]]
+    return parse_time_ms(v)
+
+
+def split_filters(types=None, levels=None, limit=IN_FILTER_LIMIT):
+    """(types, levels) pairs that partition the filter into queries of at most `limit` combinations each."""
+    types = list(dict.fromkeys(types or ()))
+    levels = list(dict.fromkeys(levels or ()))
+    per_levels = min(len(levels), limit) or 1
+    per_types = max(1, limit // per_levels)
+    type_chunks = [types[i:i + per_types] for i in range(0, len(types), per_types)] or [None]
+    level_chunks = [levels[i:i + per_levels] for i in range(0, len(levels), per_levels)] or [None]
+    return [(t, lv) for t in type_chunks for lv in level_chunks]
+
+
+def _iter_query(query, cursor, page_size):
+    while True:
+        page = list((query.start_after(cursor) if cursor is not None else query).stream())
+        yield from page
+        if len(page) < page_size:
+            return
+        cursor = page[-1]
+
+
+def iter_incident_pages(db, since_ms=None, until_ms=None, types=None, levels=None, page_size=500, start_after_id=None):
+    """
+    Yield lists of DocumentSnapshots ordered by (created_ms, document id).
+    type/level use server-side equality / `in` filters (see hosting/firestore.indexes.json for the composite indexes).
+    """
+    col = db.collection(INCIDENTS_COLLECTION)
+    cursor = None
+    if start_after_id:
+        cursor = col.document(start_after_id).get()
+        if not cursor.exists:
+            raise SystemExit(f"resume cursor document {start_after_id!r} no longer exists")
+    streams = []
+    for part_types, part_levels in split_filters(types, levels):
+        query = filter_query(col, part_types, part_levels, since_ms, until_ms)
+        query = query.order_by("created_ms", direction=firestore.Query.ASCENDING).order_by("__name__").limit(page_size)
+        streams.append(_iter_query(query, cursor, page_size))
+    snaps = streams[0] if len(streams) == 1 else \
+        heapq.merge(*streams, key=lambda snap: (snap.get("created_ms"), snap.id))
+    while True:
+        page = list(itertools.islice(snaps, page_size))
+        if not page:
+            return
+        yield page
+
+
+def in_bbox(rec, bbox):
+    if not bbox:
+        return True
+    if rec.get("lat") is None or rec.get("lng") is None:
+        return False
+    min_lng, min_lat, max_lng, max_lat = bbox
+    return min_lat <= rec["lat"] <= max_lat and min_lng <= rec["lng"] <= max_lng
+
+
+# ---------------- Output writers ----------------
+class NdjsonWriter:
+    def __init__(self, path, state):
+        self.f = open(path, "r+b" if state else "wb")
+        if state:
+            self.f.truncate(state["bytes"])
+            self.f.seek(state["bytes"])
+
+    def write(self, rec):
+        self.f.write(json.dumps(rec, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+
+    def checkpoint(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return {"bytes": self.f.tell()}
+
+    def close(self):
+        self.f.close()
+
+
+class GeoJsonWriter:
+    """FeatureCollection written incrementally; the closing brackets are added by close()."""
+    HEADER = b'{"type":"FeatureCollection","features":[\n'
+    FOOTER = b"\n]}\n"
+
+    def __init__(self, path, state):
+        if state:
+            self.f = open(path, "r+b")
+            self.f.truncate(state["bytes"])
+            self.f.seek(state["bytes"])
+            self.count = state.get("features", 0)
+        else:
+            self.f = open(path, "wb")
+            self.f.write(self.HEADER)
+            self.count = 0
+
+    def write(self, rec):
+        lat, lng = rec.pop("lat", None), rec.pop("lng", None)
+        feat = {
+            "type": "Feature",
+            "id": rec.get("id"),
+            "geometry": {"type": "Point", "coordinates": [lng, lat]} if lat is not None and lng is not None else None,
+            "properties": rec,
+        }
+        if self.count:
+            self.f.write(b",\n")
+        self.f.write(json.dumps(feat, ensure_ascii=False, default=str).encode("utf-8"))
+        self.count += 1
+
+    def checkpoint(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        return {"bytes": self.f.tell(), "features": self.count}
+
+    def close(self):
+        self.f.write(self.FOOTER)
+        self.f.close()
+
+
+class ParquetWriter:
+    """
+    Directory of part-NNNNN.parquet files, one row group per page. Parts are closed every
+    `rows_per_file` rows and only closed parts are checkpointed (an unfinished part is rewritten on resume).
+    """
+
+    def __init__(self, path, state, rows_per_file=250_000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet export needs pyarrow: pip install pyarrow")
+        self.pa, self.pq = pa, pq
+        self.schema = pa.schema([(name, getattr(pa, typ)()) for name, typ in PARQUET_COLUMNS])
+        self.dir = path
+        os.makedirs(path, exist_ok=True)
+        self.rows_per_file = rows_per_file
+        self.part = state.get("part", 0) if state else 0
+        self.rows_in_part = 0
+        self.rows = []
+        self.writer = None
+
+    def write(self, rec):
+        self.rows.append({name: rec.get(name) for name, _ in PARQUET_COLUMNS})
+
+    def _flush_rows(self):
+        if not self.rows:
+            return
+        for row in self.rows:
+            for name, typ in PARQUET_COLUMNS:
+                if typ == "string" and row[name] is not None and not isinstance(row[name], str):
+                    row[name] = str(row[name])
+        if self.writer is None:
+            fname = os.path.join(self.dir, f"part-{self.part:05d}.parquet")
+            self.writer = self.pq.ParquetWriter(fname, self.schema, compression="zstd")
+        self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+        self.rows_in_part += len(self.rows)
+        self.rows = []
+
+    def checkpoint(self):
+        self._flush_rows()
+        if self.rows_in_part < self.rows_per_file:
+            return None
+        self.writer.close()
+        self.writer = None
+        self.part += 1
+        self.rows_in_part = 0
+        return {"part": self.part}
+
+    def close(self):
+        self._flush_rows()
+        if self.writer is not None:
+            self.writer.close()
+
+
+WRITERS = {"ndjson": NdjsonWriter, "geojson": GeoJsonWriter, "parquet": ParquetWriter}
+
+
+def detect_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".geojson", ".json"):
+        return "geojson"
+    if ext in (".parquet", "") or path.endswith(os.sep):
+        return "parquet"
+    return "ndjson"
+
+
+def _save_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def load_state(state_path):
+    if not state_path or not os.path.exists(state_path):
+        return None
+    with open(state_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def export(db, out, fmt, since_ms=None, until_ms=None, types=None, levels=None, bbox=None,
+           page_size=500, state_path=None, resume=False, started_ms=None):
+    """
+    started_ms: the time relative --since values were resolved against; kept in the state file so
+    a resumed export can resolve them the same way.
+    """
+    filters = {"format": fmt, "since_ms": since_ms, "until_ms": until_ms, "types": sorted(set(types or ())),
+               "levels": sorted(set(levels or ())), "bbox": list(bbox) if bbox else None}
+    state = load_state(state_path) if resume else None
+    if state:
+        if state.get("filters") != filters:
+            raise SystemExit(f"{state_path} was written by an export with other filters "
+                             f"({state.get('filters')}); rerun without --resume to start over")
+        started_ms = state.get("started_ms", started_ms)
+        print(f"resuming after {state.get('exported', 0)} rows (cursor {state.get('cursor')})")
+    started_ms = started_ms or int(time.time()*1000)
+    writer = WRITERS[fmt](out, state)
+    exported = state.get("exported", 0) if state else 0
+    scanned = 0
+    started = time.time()
+    for page in iter_incident_pages(db, since_ms, until_ms, types, levels, page_size,
+                                    start_after_id=(state or {}).get("cursor")):
+        for snap in page:
+            scanned += 1
+            rec = to_record(snap.id, snap.to_dict())
+            if not in_bbox(rec, bbox):
+                continue
+            writer.write(rec)
+            exported += 1
+        # parquet only checkpoints at part boundaries; rows after that are re-read on resume
+        progress = writer.checkpoint()
+        if progress is not None and state_path:
+            _save_state(state_path, dict(progress, cursor=page[-1].id, exported=exported, format=fmt,
+                                         filters=filters, started_ms=started_ms))
+        elapsed = max(time.time() - started, 1e-6)
+        print(f"{exported} exported | {scanned} scanned | {scanned/elapsed:.0f} docs/s", file=sys.stderr)
+    writer.close()
+    if state_path and os.path.exists(state_path):
+        os.remove(state_path)
+    return exported
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Export incidents from Firestore.")
+    ap.add_argument("out", help="output file (.ndjson / .geojson) or directory for parquet")
+    ap.add_argument("--format", dest="fmt", choices=sorted(WRITERS), default=None)
+    ap.add_argument("--since", help="ISO time, epoch, or relative like 24h / 7d")
+    ap.add_argument("--until", help="ISO time or epoch (exclusive)")
+    ap.add_argument("--type", dest="types", action="append", help="repeatable incident type filter")
+    ap.add_argument("--level", dest="levels", action="append", help="repeatable severity filter")
+    ap.add_argument("--bbox", help="min_lng,min_lat,max_lng,max_lat")
+    ap.add_argument("--page-size", type=int, default=500)
+    ap.add_argument("--state", default=None, help="cursor state file (default: <out>.state.json)")
+    ap.add_argument("--resume", action="store_true", help="continue from the state file of an interrupted export")
+    ap.add_argument("--secrets", default=DEFAULT_SECRETS_PATH)
+    ap.add_argument("--service-account", default=None)
+    args = ap.parse_args(argv)
+
+    fmt = args.fmt or detect_format(args.out)
+    bbox = [float(x) for x in args.bbox.split(",")] if args.bbox else None
+    if bbox and len(bbox) != 4:
+        ap.error("--bbox needs four numbers: min_lng,min_lat,max_lng,max_lat")
+    state_path = args.state or (args.out.rstrip("/\\") + ".state.json")
+    # a resumed export resolves a relative --since against the time the export first started
+    state = load_state(state_path) if args.resume else None
+    now_ms = (state or {}).get("started_ms") or int(time.time()*1000)
+    db, _ = init_from_cli(args.secrets, args.service_account)
+    n = export(db, args.out, fmt, parse_since(args.since, now_ms), parse_time_ms(args.until), args.types, args.levels,
+               bbox, max(1, args.page_size), state_path, args.resume, started_ms=now_ms)
+    print(json.dumps({"exported": n, "format": fmt, "out": args.out}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
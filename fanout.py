@@ -0,0 +1,38 @@
+# fanout.py — run a rerun's independent I/O calls side by side on a shared, bounded thread pool
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+IO_POOL_WORKERS = 16
+
+
+class CallTimeout(TimeoutError):
+    """Stands in for the result of a call that was still running when its timeout ran out."""
+
+
+def io_pool(workers=IO_POOL_WORKERS):
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fanout")
+
+
+def run_all(pool, calls, wrap=None):
+    """
+    calls: {name: (fn, args, timeout seconds)}. All calls are submitted at once and each one is waited
+    for up to its own timeout, counted from submission, so the caller waits for the slowest call rather
+    than the sum of them. Returns {name: result}: a call that raised gets its exception as the result,
+    one still running past its timeout gets CallTimeout (it finishes in the background, result dropped).
+    wrap(fn) -> fn is applied before submitting, e.g. to carry per-thread context over to the pool.
+    """
+    start = time.monotonic()
+    futures = {name: pool.submit(wrap(fn) if wrap else fn, *args) for name, (fn, args, _) in calls.items()}
+    results = {}
+    for name, fut in futures.items():
+        timeout = calls[name][2]
+        try:
+            results[name] = fut.result(timeout=max(0.0, timeout - (time.monotonic() - start)))
+        except Exception as e:
+            if fut.done():
+                results[name] = e
+            else:
+                # not started yet (pool busy) -> don't start it at all
+                fut.cancel()
+                results[name] = CallTimeout(f"{name} took longer than {timeout:g}s")
+    return results
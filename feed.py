@@ -0,0 +1,174 @@
+# feed.py — HTML building for the report feed (one markdown payload per chunk of posts) and its bounded post buffer
+from datetime import datetime
+from html import escape
+
+from geo import haversine
+from imgproxy import derivative_srcset
+
+# posts rendered per st.markdown call, and how many loaded posts are rendered at once
+FEED_CHUNK_SIZE = 10
+FEED_WINDOW = 60
+# loaded posts kept per session (see "Bounded feed buffer" below)
+FEED_MAX_DOCS = 300
+
+
+def severity_badge(level_label):
+    level_label = level_label or "Normal"
+    level_norm = str(level_label).lower()
+    if "danger" in level_norm:
+        return "#ff4d4f", "Danger"
+    if "warning" in level_norm:
+        return "#f59e0b", "Warning"
+    if level_norm in ("peace", "normal", "ok", "safe"):
+        return "#10b981", level_label
+    return "#2563EB", level_label
+
+
+def post_html(inc, group=None, image_base=None):
+    """
+    group: (report count, max level) when the card stands for several reports of one event.
+    image_base: imgproxy.py base URL; the photo is then served as resized derivatives instead of the original.
+    """
+    try:
+        when_str = datetime.fromtimestamp(inc.created_ms/1000.0).strftime("%b %d, %Y %H:%M")
+    except Exception:
+        when_str = ""
+    location_str = inc.display_address or ((inc.region or "") + (", " + inc.country if inc.country else ""))
+    username = inc.username or "anon"
+    initials = username[:1].upper() if username else "A"
+    sev_color, sev_text = severity_badge(group[1] if group else inc.level)
+    event_badge = f"<div class='post-event'>🔁 {group[0]} reports</div>" if group and group[0] > 1 else ""
+    photo = inc.photo_url
+    # blank lines would end the markdown HTML block, so keep the body on one line
+    body = "<br/>".join(escape(line) for line in (inc.description or "").splitlines())
+    # native lazy loading: off-screen images are not fetched until scrolled near
+    img = ""
+    if photo:
+        src, sized = photo, ""
+        if image_base:
+            src, srcset, sizes = derivative_srcset(image_base, photo)
+            sized = f"srcset='{escape(srcset, quote=True)}' sizes='{escape(sizes, quote=True)}' "
+        img = (f"<img class='post-photo' src='{escape(src, quote=True)}' {sized}loading='lazy' decoding='async' "
+               f"style='width:100%;border-radius:10px;margin-top:8px' alt=''/>")
+    return f"""<div class='feed-card' id='post-{escape(str(inc.id), quote=True)}'>
+<div class='post-header'>
+<div class='post-avatar'>{escape(initials)}</div>
+<div style='flex:1'>
+<div style='display:flex;align-items:center;gap:8px'>
+<div class='post-title'>@{escape(username)}</div>{event_badge}
+<div style='margin-left:auto;font-weight:700;padding:6px 10px;border-radius:999px;background:{sev_color};color:white;font-size:12px'>{escape(str(sev_text))}</div>
+</div>
+<div class='post-meta'>{escape(when_str)} • {escape(location_str or '—')}</div>
+</div>
+</div>
+<div class='post-body'>{body}</div>{img}
+</div>"""
+
+
+def chunk_posts(posts, is_own, chunk_size=FEED_CHUNK_SIZE):
+    """
+    Split the visible posts into render units: ("html", [posts]) runs of up to chunk_size posts that
+    become one markdown payload, and ("own", post) for the viewer's own posts, which need a Delete button.
+    """
+    units = []
+    run = []
+    for inc in posts:
+        if is_own(inc):
+            if run:
+                units.append(("html", run))
+                run = []
+            units.append(("own", inc))
+            continue
+        run.append(inc)
+        if len(run) >= chunk_size:
+            units.append(("html", run))
+            run = []
+    if run:
+        units.append(("html", run))
+    return units
+
+
+def chunk_html(posts, groups=None, image_base=None):
+    groups = groups or {}
+    return "\n".join(post_html(inc, groups.get(inc.id), image_base) for inc in posts)
+
+
+def visible_window(total, start, window=FEED_WINDOW):
+    """Clamp the window start; returns (start, end) indexes into the loaded posts."""
+    start = max(0, min(int(start or 0), max(0, total - window)))
+    return start, min(total, start + window)
+
+
+def within_radius(incs, center, radius_km):
+    """Incidents with a location within radius_km of center (lat, lng), in input order."""
+    clat, clng = center
+    return [inc for inc in incs if inc.has_location and haversine(clat, clng, inc.lat, inc.lng) <= radius_km]
+
+
+# ---- Bounded feed buffer ----
+# feed_state (kept in st.session_state) holds at most max_docs loaded posts, newest first:
+#   docs, page_size, filters
+#   last_snap / finished   cursor (last id) and end flag for "Load more" below the buffer
+#   top_cursor             id just above docs[0] (None when docs start at the newest post)
+#   evicted                [after id, count] per page dropped from the top, in top-to-bottom order
+# Scrolling down evicts whole pages from the top; bringing one back drops posts from the bottom,
+# which "Load more" re-fetches through last_snap.
+
+def new_feed_state(page_size=30):
+    return {"docs": [], "last_snap": None, "finished": False, "page_size": page_size, "top_cursor": None, "evicted": []}
+
+
+def _trim_older(feed_state, max_docs):
+    docs = feed_state["docs"]
+    if len(docs) > max_docs:
+        del docs[max_docs:]
+        feed_state["last_snap"] = docs[-1].id if docs else None
+        feed_state["finished"] = False
+
+
+def append_older(feed_state, incs, cursor, max_docs=FEED_MAX_DOCS):
+    """Add a "Load more" page at the bottom; returns how many posts were evicted from the top."""
+    docs = feed_state["docs"]
+    known = {inc.id for inc in docs}
+    docs.extend(inc for inc in incs if inc.id not in known)
+    feed_state["last_snap"] = cursor
+    feed_state["finished"] = len(incs) < feed_state["page_size"]
+    evicted = 0
+    while len(docs) > max_docs:
+        chunk = docs[:feed_state["page_size"]]
+        del docs[:len(chunk)]
+        feed_state.setdefault("evicted", []).append([feed_state.get("top_cursor"), len(chunk)])
+        feed_state["top_cursor"] = chunk[-1].id
+        evicted += len(chunk)
+    return evicted
+
+
+def prepend_new(feed_state, incs, max_docs=FEED_MAX_DOCS):
+    """Live updates: put newer posts on top, unless the top of the feed was evicted (a re-fetch brings them)."""
+    if feed_state.get("evicted"):
+        return 0
+    known = {inc.id for inc in feed_state["docs"]}
+    new = [inc for inc in incs if inc.id not in known]
+    feed_state["docs"][:0] = new
+    _trim_older(feed_state, max_docs)
+    return len(new)
+
+
+def evicted_count(feed_state):
+    return sum(count for _, count in feed_state.get("evicted") or ())
+
+
+def restore_newer(feed_state, fetch_page, max_docs=FEED_MAX_DOCS):
+    """
+    Re-fetch the last page evicted from the top; fetch_page(after_id, limit) -> (incidents, cursor).
+    Returns the number of posts brought back.
+    """
+    after, count = feed_state["evicted"][-1]
+    incs, _ = fetch_page(after, count)
+    feed_state["evicted"].pop()
+    known = {inc.id for inc in feed_state["docs"]}
+    new = [inc for inc in incs if inc.id not in known]
+    feed_state["docs"][:0] = new
+    feed_state["top_cursor"] = after
+    _trim_older(feed_state, max_docs)
+    return len(new)
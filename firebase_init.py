@@ -0,0 +1,52 @@
+# firebase_init.py — Firebase Admin setup shared by app.py and the command-line tools
+import json
+import tomllib
+
+import firebase_admin
+from firebase_admin import credentials, firestore, storage
+
+DEFAULT_SECRETS_PATH = ".streamlit/secrets.toml"
+
+
+def load_secrets(path=DEFAULT_SECRETS_PATH):
+    """Read the Streamlit secrets.toml outside of Streamlit (CLIs, benchmarks)."""
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def init_firebase(service_account_info=None, default_credentials=False):
+    """
+    Initialize the default Firebase app once and return (db, bucket).
+    service_account_info is the [serviceAccount] table from secrets. Without it the app must already
+    be initialized, unless default_credentials allows falling back to the environment's Application
+    Default Credentials (command-line tools only; the web app requires explicit secrets).
+    bucket is None when no default Storage bucket is configured.
+    """
+    if not firebase_admin._apps:
+        if service_account_info:
+            firebase_admin.initialize_app(credentials.Certificate(dict(service_account_info)))
+        elif default_credentials:
+            firebase_admin.initialize_app()
+    db = firestore.client()
+    try:
+        bucket = storage.bucket()
+    except Exception:
+        bucket = None
+    return db, bucket
+
+
+def init_from_cli(secrets_path=DEFAULT_SECRETS_PATH, service_account_path=None):
+    """
+    Resolve credentials for CLI tools: explicit service-account JSON first, then secrets.toml,
+    then Application Default Credentials.
+    """
+    info = None
+    if service_account_path:
+        with open(service_account_path, "r", encoding="utf-8") as f:
+            info = json.load(f)
+    else:
+        try:
+            info = load_secrets(secrets_path).get("serviceAccount")
+        except FileNotFoundError:
+            info = None
+    return init_firebase(info, default_credentials=True)
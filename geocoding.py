@@ -0,0 +1,242 @@
+# geocoding.py — forward / reverse geocoding over OpenCage and Nominatim with circuit breakers
+#
+# Every lookup gets one overall deadline (budget). Providers are tried in order, each call bounded by
+# the provider timeout and whatever is left of the budget; there are no sleep-and-retry loops. A
+# provider that keeps failing has its circuit opened and is skipped outright (no network) until
+# reset_after seconds have passed, then a single trial call decides whether it is back.
+# Answers are kept in a small LRU; when every provider is down an expired entry is still served.
+# Breakers and the cache are shared by all sessions of the process; health() reports them.
+# Batch callers (ingest.py) pass nominatim_interval_s to keep to Nominatim's one request per second.
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from geopy.geocoders import Nominatim
+
+OPENCAGE_URL = "https://api.opencagedata.com/geocode/v1/json"
+DEFAULT_CONTACT = "report-disasters (no-contact@example.com)"
+LOOKUP_BUDGET_S = 6.0
+PROVIDER_TIMEOUT_S = 4.0
+# not worth starting a provider call with less than this left of the budget
+MIN_CALL_S = 0.3
+CACHE_SIZE = 2048
+CACHE_TTL_S = 86_400
+# reverse lookups are cached per ~11 m cell
+REVERSE_DECIMALS = 4
+
+
+class GeocoderUnavailable(Exception):
+    """No provider answered within the budget and nothing was cached for the query."""
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` failures in a row; open -> half_open once `reset_after`
+    seconds have passed, letting one trial call through; its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name, failure_threshold=3, reset_after=30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._consecutive = 0
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "successes": 0, "failures": 0, "timeouts": 0, "short_circuits": 0,
+                      "opened": 0, "latency_ms_total": 0.0, "last_error": None, "last_failure_at": None}
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and self.clock() - self._opened_at >= self.reset_after:
+                self.state, self._trial_running = "half_open", False
+            if self.state == "closed" or (self.state == "half_open" and not self._trial_running):
+                self._trial_running = self.state == "half_open"
+                self.stats["calls"] += 1
+                return True
+            self.stats["short_circuits"] += 1
+            return False
+
+    def success(self, latency_s):
+        with self._lock:
+            self.state, self._trial_running, self._consecutive = "closed", False, 0
+            self.stats["successes"] += 1
+            self.stats["latency_ms_total"] += latency_s * 1000.0
+
+    def failure(self, error, timed_out=False):
+        with self._lock:
+            self._consecutive += 1
+            self.stats["failures"] += 1
+            self.stats["timeouts"] += 1 if timed_out else 0
+            self.stats["last_error"] = str(error)[:200]
+            self.stats["last_failure_at"] = time.time()
+            if self.state == "half_open" or self._consecutive >= self.failure_threshold:
+                if self.state != "open":
+                    self.stats["opened"] += 1
+                self.state, self._opened_at, self._trial_running = "open", self.clock(), False
+
+    def snapshot(self):
+        with self._lock:
+            snap = dict(self.stats, name=self.name, state=self.state, consecutive_failures=self._consecutive)
+        ok = snap.pop("latency_ms_total")
+        snap["avg_latency_ms"] = round(ok / snap["successes"], 1) if snap["successes"] else None
+        return snap
+
+
+class _ProviderError(Exception):
+    pass
+
+
+def _is_timeout(e):
+    return isinstance(e, (requests.Timeout, TimeoutError)) or "timed out" in str(e).lower()
+
+
+def _opencage(q, api_key, timeout):
+    """First OpenCage result for q ("lat,lng" for reverse), or None when it has no match."""
+    r = requests.get(OPENCAGE_URL, params={"q": q, "key": api_key, "limit": 1, "no_annotations": 1}, timeout=timeout)
+    if r.status_code == 400:
+        return None
+    if r.status_code != 200:
+        raise _ProviderError(f"OpenCage HTTP {r.status_code}")
+    results = r.json().get("results") or []
+    return results[0] if results else None
+
+
+def _region(addr):
+    return addr.get("state") or addr.get("region") or addr.get("county")
+
+
+class Geocoder:
+    def __init__(self, opencage_key=None, contact=None, budget_s=LOOKUP_BUDGET_S, provider_timeout_s=PROVIDER_TIMEOUT_S,
+                 failure_threshold=3, reset_after_s=30.0, cache_size=CACHE_SIZE, cache_ttl_s=CACHE_TTL_S,
+                 nominatim_interval_s=0.0):
+        self.opencage_key = opencage_key
+        self.user_agent = f"report-disasters ({contact or DEFAULT_CONTACT})"
+        self.budget_s = budget_s
+        self.provider_timeout_s = provider_timeout_s
+        self.cache_size, self.cache_ttl_s = cache_size, cache_ttl_s
+        names = (["opencage"] if opencage_key else []) + ["nominatim"]
+        self.breakers = {n: CircuitBreaker(n, failure_threshold, reset_after_s) for n in names}
+        self._nominatim = None
+        self.nominatim_interval_s = nominatim_interval_s
+        self._nominatim_next = 0.0
+        self._nominatim_lock = threading.Lock()
+        self._cache = OrderedDict()   # key -> (answer, stored at)
+        self._cache_stats = {"hits": 0, "stale_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    # ---- providers: return the answer, None for "no match", raise on failure ----
+    def _nominatim_client(self):
+        if self._nominatim is None:
+            self._nominatim = Nominatim(user_agent=self.user_agent, timeout=self.provider_timeout_s)
+        return self._nominatim
+
+    def _nominatim_slot(self):
+        """Space Nominatim calls nominatim_interval_s apart across all threads."""
+        if self.nominatim_interval_s <= 0:
+            return
+        with self._nominatim_lock:
+            wait = self._nominatim_next - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._nominatim_next = time.monotonic() + self.nominatim_interval_s
+
+    def _forward_opencage(self, q, timeout):
+        res = _opencage(q, self.opencage_key, timeout)
+        return (res["geometry"]["lat"], res["geometry"]["lng"], res.get("formatted") or "") if res else None
+
+    def _forward_nominatim(self, q, timeout):
+        self._nominatim_slot()
+        res = self._nominatim_client().geocode(q, addressdetails=False, exactly_one=True, timeout=timeout)
+        return (res.latitude, res.longitude, res.address) if res else None
+
+    def _reverse_opencage(self, point, timeout):
+        res = _opencage(f"{point[0]},{point[1]}", self.opencage_key, timeout)
+        if not res:
+            return None
+        comp = res.get("components") or {}
+        return comp.get("country"), _region(comp), res.get("formatted")
+
+    def _reverse_nominatim(self, point, timeout):
+        self._nominatim_slot()
+        loc = self._nominatim_client().reverse(point, timeout=timeout, language="en", addressdetails=True)
+        if not (loc and loc.raw):
+            return None
+        addr = loc.raw.get("address", {})
+        return addr.get("country"), _region(addr), loc.address
+
+    # ---- cache ----
+    def _cached(self, key, allow_stale=False):
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is None:
+                return None
+            fresh = time.time() - hit[1] < self.cache_ttl_s
+            if not (fresh or allow_stale):
+                return None
+            self._cache.move_to_end(key)
+            self._cache_stats["hits" if fresh else "stale_hits"] += 1
+            return hit
+
+    def _store(self, key, answer):
+        with self._lock:
+            self._cache[key] = (answer, time.time())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ---- lookups ----
+    def _lookup(self, key, arg, providers, budget_s):
+        hit = self._cached(key)
+        if hit is not None:
+            return hit[0]
+        with self._lock:
+            self._cache_stats["misses"] += 1
+        deadline = time.monotonic() + (self.budget_s if budget_s is None else budget_s)
+        errors = []
+        for name, call in providers:
+            remaining = deadline - time.monotonic()
+            if remaining < MIN_CALL_S:
+                errors.append("lookup budget used up")
+                break
+            breaker = self.breakers[name]
+            if not breaker.allow():
+                errors.append(f"{name} circuit open")
+                continue
+            t0 = time.monotonic()
+            try:
+                answer = call(arg, min(self.provider_timeout_s, remaining))
+            except Exception as e:
+                breaker.failure(e, timed_out=_is_timeout(e))
+                errors.append(f"{name}: {e}")
+                continue
+            breaker.success(time.monotonic() - t0)
+            self._store(key, answer)
+            return answer
+        stale = self._cached(key, allow_stale=True)
+        if stale is not None:
+            return stale[0]
+        raise GeocoderUnavailable("; ".join(errors) or "no geocoder configured")
+
+    def geocode(self, q, budget_s=None):
+        """(lat, lng, address) for a place name, or None when no provider knows it. Raises GeocoderUnavailable."""
+        providers = [("opencage", self._forward_opencage)] if self.opencage_key else []
+        providers.append(("nominatim", self._forward_nominatim))
+        return self._lookup(("fwd", " ".join(q.lower().split())), q, providers, budget_s)
+
+    def reverse(self, lat, lng, budget_s=None):
+        """(country, region, display address) for a point, or None. Raises GeocoderUnavailable."""
+        point = (round(float(lat), REVERSE_DECIMALS), round(float(lng), REVERSE_DECIMALS))
+        # Nominatim first: free, and OpenCage quota is kept for searches
+        providers = [("nominatim", self._reverse_nominatim)]
+        if self.opencage_key:
+            providers.append(("opencage", self._reverse_opencage))
+        return self._lookup(("rev",) + point, point, providers, budget_s)
+
+    def health(self):
+        with self._lock:
+            cache = dict(self._cache_stats, entries=len(self._cache))
+        return {"providers": [b.snapshot() for b in self.breakers.values()], "cache": cache}
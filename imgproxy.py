@@ -0,0 +1,326 @@
+# imgproxy.py — resized WebP derivatives of report photos, served with long cache headers from an on-disk LRU
+#
+# GET /img?w=640&src=<photo url> fetches the original once, scales it down to at most w pixels wide
+# (widths snap up to IMAGE_WIDTHS, so the cache holds a handful of sizes per photo), re-encodes it as
+# WebP and keeps the result in cache_dir. Cache files are named by a hash of (src, width, quality)
+# and never change, so responses carry "immutable" and an ETag; the directory is trimmed to max_bytes,
+# least recently served first. Only sources under the --allow URL prefixes (the app's own bucket) are
+# fetched: scheme, host and percent-decoded path are compared, paths with ./.. segments are refused,
+# and redirects are not followed, so the proxy cannot be used to transcode anything else.
+#
+#   python imgproxy.py serve --port 8600 --allow https://storage.googleapis.com/my-bucket/
+#   python imgproxy.py stats
+#
+# The app points <img srcset> at it when the IMAGE_PROXY_URL secret is set (see derivative_srcset).
+import argparse
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlencode, urlparse, urlsplit
+
+import requests
+from PIL import Image, ImageOps
+
+IMAGE_WIDTHS = (320, 640, 960, 1280)
+# CSS width the feed shows a photo at (the feed column), used for the srcset "sizes" hint
+FEED_IMAGE_CSS_WIDTH = 720
+WEBP_QUALITY = 78
+DEFAULT_CACHE_DIR = "data/imgcache"
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+MAX_SOURCE_BYTES = 20 * 1024 * 1024
+# refuse decompression bombs before decoding them
+MAX_SOURCE_PIXELS = 50_000_000
+FETCH_TIMEOUT_S = 10.0
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class ProxyError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def snap_width(width):
+    """Smallest configured width >= width (the largest one for anything bigger)."""
+    for w in IMAGE_WIDTHS:
+        if width <= w:
+            return w
+    return IMAGE_WIDTHS[-1]
+
+
+def derivative_url(base, src, width):
+    return f"{base.rstrip('/')}/img?{urlencode({'w': snap_width(width), 'src': src})}"
+
+
+def derivative_srcset(base, src, css_width=FEED_IMAGE_CSS_WIDTH):
+    """
+    (src, srcset, sizes) for an <img> that lets the browser pick the derivative for its layout width
+    and pixel density: widths up to 2x the displayed CSS width are offered.
+    """
+    widths = [w for w in IMAGE_WIDTHS if w <= 2 * css_width] or [IMAGE_WIDTHS[0]]
+    srcset = ", ".join(f"{derivative_url(base, src, w)} {w}w" for w in widths)
+    sizes = f"(max-width: {css_width}px) 100vw, {css_width}px"
+    return derivative_url(base, src, css_width), srcset, sizes
+
+
+def make_derivative(data, width, quality=WEBP_QUALITY):
+    """WebP bytes of the image scaled to at most `width` pixels wide (never enlarged), EXIF rotation applied."""
+    try:
+        img = Image.open(io.BytesIO(data))
+        if img.width * img.height > MAX_SOURCE_PIXELS:
+            raise ProxyError(413, "source image too large")
+        # JPEGs much larger than needed are decoded at a reduced scale; both sides stay >= width
+        # so a rotation by exif_transpose below still leaves enough pixels
+        img.draft("RGB", (width, width))
+        img = ImageOps.exif_transpose(img)
+    except ProxyError:
+        raise
+    except Exception as e:
+        raise ProxyError(415, f"not a readable image: {e}")
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+    if img.width > width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, "WEBP", quality=quality, method=4)
+    return out.getvalue()
+
+
+class DiskLRU:
+    """Files in one directory, trimmed to max_bytes by last use; the index is rebuilt from mtimes on start."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # name -> size, least recently used first
+        self.total = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        found = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                found.append((st.st_mtime, entry.name, st.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self.total += size
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._entries:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(name)
+            self.stats["hits"] += 1
+        try:
+            with open(self._path(name), "rb") as f:
+                data = f.read()
+            os.utime(self._path(name))
+            return data
+        except FileNotFoundError:
+            with self._lock:
+                self.total -= self._entries.pop(name, 0)
+            return None
+
+    def put(self, name, data):
+        tmp = self._path(f"{name}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(name))
+        with self._lock:
+            self.total += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            while self.total > self.max_bytes and len(self._entries) > 1:
+                old, size = self._entries.popitem(last=False)
+                self.total -= size
+                self.stats["evictions"] += 1
+                try:
+                    os.remove(self._path(old))
+                except FileNotFoundError:
+                    pass
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self.total, max_bytes=self.max_bytes)
+
+
+def _clean_path(path):
+    """Percent-decoded URL path, or None when it has dot segments, backslashes or is encoded twice."""
+    decoded = unquote(path)
+    if unquote(decoded) != decoded or "\\" in decoded:
+        return None
+    if any(seg in (".", "..") for seg in decoded.split("/")):
+        return None
+    return decoded
+
+
+class ImageProxy:
+    def __init__(self, cache, allow, quality=WEBP_QUALITY, session=None):
+        self.cache = cache
+        self.allow = tuple(p for p in allow or () if p)
+        if not self.allow:
+            raise ValueError("at least one allowed source URL prefix is required")
+        self._allow = []
+        for prefix in self.allow:
+            # a bare host would let in every bucket on it; the prefix has to name the bucket
+            u = urlsplit(prefix)
+            path = _clean_path(u.path)
+            if u.scheme != "https" or not path or not path.strip("/") or not path.endswith("/") or u.query:
+                raise ValueError(f"allowed prefix must be an https bucket URL ending in '/': {prefix}")
+            self._allow.append((u.scheme, u.netloc.lower(), path))
+        self.quality = quality
+        self.session = session or requests.Session()
+        # concurrent misses for the same derivative wait for one fetch instead of each fetching
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def allowed(self, src):
+        """src is an https URL on an allowed host whose decoded path, free of ./.. segments, is under a prefix."""
+        u = urlsplit(src)
+        path = _clean_path(u.path)
+        if path is None:
+            return False
+        return any(u.scheme == scheme and u.netloc.lower() == host and path.startswith(prefix)
+                   for scheme, host, prefix in self._allow)
+
+    def key(self, src, width):
+        return hashlib.sha256(f"{src}\n{width}\n{self.quality}".encode()).hexdigest()[:32] + ".webp"
+
+    def _fetch(self, src):
+        try:
+            r = self.session.get(src, timeout=FETCH_TIMEOUT_S, stream=True, allow_redirects=False)
+        except requests.RequestException as e:
+            raise ProxyError(502, f"fetch failed: {e}")
+        with r:
+            if r.status_code == 404:
+                raise ProxyError(404, "source not found")
+            if r.status_code != 200:
+                raise ProxyError(502, f"source HTTP {r.status_code}")
+            buf = io.BytesIO()
+            for chunk in r.iter_content(64 * 1024):
+                buf.write(chunk)
+                if buf.tell() > MAX_SOURCE_BYTES:
+                    raise ProxyError(413, "source image too large")
+            return buf.getvalue()
+
+    def derivative(self, src, width):
+        """(cache name, WebP bytes) for src at the snapped width; raises ProxyError."""
+        if not self.allowed(src):
+            raise ProxyError(403, "source not allowed")
+        width = snap_width(width)
+        name = self.key(src, width)
+        data = self.cache.get(name)
+        if data is not None:
+            return name, data
+        with self._lock:
+            waiter = self._inflight.get(name)
+            if waiter is None:
+                self._inflight[name] = threading.Event()
+        if waiter is not None:
+            waiter.wait(FETCH_TIMEOUT_S * 2)
+            data = self.cache.get(name)
+            if data is not None:
+                return name, data
+        try:
+            data = make_derivative(self._fetch(src), width, self.quality)
+            self.cache.put(name, data)
+            return name, data
+        finally:
+            if waiter is None:
+                with self._lock:
+                    self._inflight.pop(name).set()
+
+
+def make_handler(proxy):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body=b"", headers=None):
+            self.send_response(status)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/health":
+                return self._send(200, json.dumps(proxy.cache.snapshot()).encode(),
+                                  {"Content-Type": "application/json", "Cache-Control": "no-store"})
+            if url.path != "/img":
+                return self._send(404, b"not found", {"Content-Type": "text/plain"})
+            qs = parse_qs(url.query)
+            src = (qs.get("src") or [""])[0]
+            try:
+                width = int((qs.get("w") or [IMAGE_WIDTHS[1]])[0])
+                name, data = proxy.derivative(src, width)
+            except ValueError:
+                return self._send(400, b"bad width", {"Content-Type": "text/plain"})
+            except ProxyError as e:
+                # short negative caching so a missing photo isn't re-fetched on every scroll
+                return self._send(e.status, str(e).encode(),
+                                  {"Content-Type": "text/plain", "Cache-Control": "public, max-age=60"})
+            etag = f'"{name[:-5]}"'
+            headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Access-Control-Allow-Origin": "*"}
+            if self.headers.get("If-None-Match") == etag:
+                return self._send(304, headers=headers)
+            self._send(200, data, dict(headers, **{"Content-Type": "image/webp"}))
+
+        do_HEAD = do_GET
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def _serve(args):
+    try:
+        proxy = ImageProxy(None, allow=args.allow, quality=args.quality)
+    except ValueError as e:
+        raise SystemExit(f"imgproxy: {e}")
+    cache = proxy.cache = DiskLRU(args.cache_dir, int(args.cache_mb * 1024 * 1024))
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(proxy))
+    print(f"imgproxy on http://{args.host}:{args.port} — cache {cache.snapshot()['entries']} files, "
+          f"{cache.total / 1e6:.1f} / {args.cache_mb:g} MB in {args.cache_dir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Serve resized WebP derivatives of report photos, or inspect the cache.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sp = sub.add_parser("serve", help="run the proxy")
+    sp.add_argument("--host", default="127.0.0.1")
+    sp.add_argument("--port", type=int, default=8600)
+    sp.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    sp.add_argument("--cache-mb", type=float, default=DEFAULT_CACHE_BYTES / 1024 / 1024)
+    sp.add_argument("--quality", type=int, default=WEBP_QUALITY)
+    sp.add_argument("--allow", action="append", required=True,
+                    help="allowed source URL prefix, e.g. https://storage.googleapis.com/<bucket>/ (repeatable)")
+    stats = sub.add_parser("stats", help="size of the on-disk cache")
+    stats.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    args = ap.parse_args(argv)
+    if args.command == "serve":
+        _serve(args)
+    else:
+        t0 = time.perf_counter()
+        cache = DiskLRU(args.cache_dir, DEFAULT_CACHE_BYTES)
+        print(json.dumps(dict(cache.snapshot(), scan_ms=round((time.perf_counter() - t0) * 1000, 1))))
+
+
+if __name__ == "__main__":
+    main()
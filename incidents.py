@@ -0,0 +1,252 @@
+# incidents.py — incident document schema shared by the app and the ingestion/export tools
+import time
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+USERS_COLLECTION = "app_users"
+INCIDENTS_COLLECTION = "incidents"
+EVENTS_COLLECTION = "events"
+EVENT_MEMBERS_COLLECTION = "event_members"
+DENSITY_COLLECTION = "density"
+PHOTOS_COLLECTION = "photos"
+
+INCIDENT_TYPES = ["Flood", "Fire", "Earthquake", "Storm", "Landslide", "Roadblock", "Other"]
+LEVELS = ["Peace", "Normal", "Warning", "Dangerous"]
+
+# Firestore's limit on `in` values (disjunctions) per query
+IN_FILTER_LIMIT = 30
+
+# feed / map time filters: label -> window length in ms (None = no lower bound)
+TIME_WINDOWS = {"Any time": None, "Last 1h": 3_600_000, "Last 24h": 86_400_000, "Last 7d": 604_800_000}
+
+
+def build_incident_doc(uid_email, username, inc_type, description, lat, lng, level="Normal",
+                       country=None, region=None, display_address=None, created_ms=None,
+                       source="streamlit", external_id=None, photo_url=None, title=None):
+    """
+    Build the Firestore document for one incident. Every writer (the dashboard form,
+    bulk ingestion) goes through here so the stored schema stays identical.
+    When created_ms is given (imported records) `created` is that time, otherwise the server timestamp.
+    `type` is what filters and indexes use; a free-text title (the form's "Other" field) is kept
+    separately in `title` for display.
+    """
+    uid = (uid_email or "anonymous").strip().lower()
+    if created_ms is None:
+        created_ms = int(time.time()*1000)
+        created = firestore.SERVER_TIMESTAMP
+    else:
+        created_ms = int(created_ms)
+        created = datetime.fromtimestamp(created_ms/1000.0, tz=timezone.utc)
+    doc = {
+        "uid": uid,
+        "username": username or (uid_email or "anonymous").split("@")[0],
+        "type": inc_type,
+        "description": description,
+        "level": level,
+        "country": country,
+        "region": region,
+        "display_address": display_address,
+        "location": firestore.GeoPoint(float(lat), float(lng)),
+        "created": created,
+        "created_ms": created_ms,
+        "source": source
+    }
+    if external_id is not None:
+        doc["external_id"] = str(external_id)
+    if photo_url is not None:
+        doc["photo_url"] = photo_url
+    if title and title != inc_type:
+        doc["title"] = title
+    return doc
+
+
+def parse_time_ms(v):
+    """Epoch seconds/ms (numbers or digit strings) or ISO-8601 text -> epoch ms. Naive times are UTC."""
+    if v in (None, ""):
+        return None
+    if isinstance(v, datetime):
+        dt = v if v.tzinfo else v.replace(tzinfo=timezone.utc)
+        return int(dt.timestamp()*1000)
+    if isinstance(v, (int, float)) or str(v).lstrip("-").replace(".", "", 1).isdigit():
+        n = float(v)
+        # values below ~1973 in ms are assumed to be epoch seconds
+        return int(n if n > 1e11 else n*1000)
+    s = str(v).strip().replace("Z", "+00:00")
+    dt = datetime.fromisoformat(s)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp()*1000)
+
+
+def filter_query(query, types=None, levels=None, since_ms=None, until_ms=None):
+    """
+    Server-side type/level equality (or `in`) plus a created_ms range. Firestore allows at most
+    IN_FILTER_LIMIT type x level combinations in one query; more raise ValueError (export.py splits them).
+    Combined with an order on created_ms these need the composite indexes in hosting/firestore.indexes.json.
+    """
+    types = list(dict.fromkeys(types or ()))
+    levels = list(dict.fromkeys(levels or ()))
+    if max(len(types), 1) * max(len(levels), 1) > IN_FILTER_LIMIT:
+        raise ValueError(f"{len(types)} types x {len(levels)} levels is more than {IN_FILTER_LIMIT} "
+                         "combinations for one query")
+    if types:
+        query = query.where("type", "==", types[0]) if len(types) == 1 else query.where("type", "in", types)
+    if levels:
+        query = query.where("level", "==", levels[0]) if len(levels) == 1 else query.where("level", "in", levels)
+    if since_ms is not None:
+        query = query.where("created_ms", ">=", int(since_ms))
+    if until_ms is not None:
+        query = query.where("created_ms", "<", int(until_ms))
+    return query
+
+
+def matches_filters(inc, types=None, levels=None, since_ms=None):
+    """The same filters as filter_query, for Incidents that arrive outside a query (live updates)."""
+    if types and inc.type not in types:
+        return False
+    if levels and inc.level not in levels:
+        return False
+    return since_ms is None or inc.created_ms >= since_ms
+
+
+def location_of(data):
+    """(lat, lng) from a GeoPoint or {'latitude','longitude'} dict, or (None, None)."""
+    loc = data.get("location") if data else None
+    if not loc:
+        return None, None
+    try:
+        if isinstance(loc, dict):
+            return float(loc.get("latitude")), float(loc.get("longitude"))
+        return float(loc.latitude), float(loc.longitude)
+    except (TypeError, ValueError, AttributeError):
+        return None, None
+
+
+def to_record(doc_id, data):
+    """Flatten an incident document into JSON-safe values: GeoPoint -> lat/lng, timestamps -> ISO strings."""
+    rec = {"id": doc_id}
+    for k, v in (data or {}).items():
+        if k == "location":
+            continue
+        if isinstance(v, datetime):
+            v = v.isoformat()
+        elif hasattr(v, "latitude") and hasattr(v, "longitude"):
+            v = {"lat": v.latitude, "lng": v.longitude}
+        rec[k] = v
+    rec["lat"], rec["lng"] = location_of(data)
+    return rec
+
+
+class Incident:
+    """
+    Compact in-memory incident used by the app instead of DocumentSnapshots / raw dicts.
+    The location is normalised to floats once, at construction. The heavy text fields
+    (description, display_address, photo_url, title) live in one tuple that can be dropped with
+    drop_heavy() and is fetched again through Incident.loader the next time it is read.
+    """
+    __slots__ = ("id", "lat", "lng", "created_ms", "type", "level", "uid", "username",
+                 "country", "region", "event_id", "_heavy")
+    HEAVY_FIELDS = ("description", "display_address", "photo_url", "title")
+    # callable(list of ids) -> {id: {heavy field: value}}; installed by the app
+    loader = None
+
+    def __init__(self, id, lat, lng, created_ms=0, type=None, level=None, uid=None, username=None,
+                 country=None, region=None, heavy=None, event_id=None):
+        self.id = id
+        self.lat = lat
+        self.lng = lng
+        self.created_ms = int(created_ms or 0)
+        self.type = type
+        self.level = level
+        self.uid = uid
+        self.username = username
+        self.country = country
+        self.region = region
+        self.event_id = event_id
+        self._heavy = heavy
+
+    @classmethod
+    def from_doc(cls, doc_id, data, heavy=True):
+        data = data or {}
+        lat, lng = location_of(data)
+        created_ms = data.get("created_ms")
+        if not created_ms and isinstance(data.get("created"), datetime):
+            created_ms = parse_time_ms(data["created"])
+        return cls(doc_id, lat, lng, created_ms, data.get("type"), data.get("level"), data.get("uid"),
+                   data.get("username"), data.get("country"), data.get("region"),
+                   tuple(data.get(f) for f in cls.HEAVY_FIELDS) if heavy else None, data.get("event_id"))
+
+    @classmethod
+    def from_snapshot(cls, snap, heavy=True):
+        return cls.from_doc(snap.id, snap.to_dict(), heavy)
+
+    @property
+    def has_location(self):
+        return self.lat is not None and self.lng is not None
+
+    @property
+    def heavy_loaded(self):
+        return self._heavy is not None
+
+    def drop_heavy(self):
+        self._heavy = None
+
+    def set_heavy(self, data):
+        self._heavy = tuple((data or {}).get(f) for f in self.HEAVY_FIELDS)
+
+    def _heavy_field(self, i):
+        if self._heavy is None:
+            load_heavy([self])
+        return self._heavy[i] if self._heavy is not None else None
+
+    @property
+    def description(self):
+        return self._heavy_field(0)
+
+    @property
+    def display_address(self):
+        return self._heavy_field(1)
+
+    @property
+    def photo_url(self):
+        return self._heavy_field(2)
+
+    @property
+    def display_type(self):
+        """The custom title of an "Other" report, otherwise its type."""
+        return self._heavy_field(3) or self.type
+
+    def __repr__(self):
+        return f"Incident({self.id!r}, {self.type!r}, {self.level!r}, {self.lat}, {self.lng}, {self.created_ms})"
+
+
+def load_heavy(incidents):
+    """Fetch heavy fields for every incident that dropped them, in one loader call."""
+    missing = [inc for inc in incidents if inc._heavy is None]
+    if not missing or Incident.loader is None:
+        return
+    try:
+        found = Incident.loader([inc.id for inc in missing]) or {}
+    except Exception as e:
+        print("Incident heavy-field load error:", e)
+        return
+    for inc in missing:
+        inc.set_heavy(found.get(inc.id))
+
+
+def normalize_level(value):
+    """Map free-form severity strings from feeds/CSV onto LEVELS (default Normal)."""
+    if not value:
+        return "Normal"
+    v = str(value).strip().lower()
+    for lv in LEVELS:
+        if v == lv.lower():
+            return lv
+    if v in ("red", "danger", "high", "severe", "extreme", "critical"):
+        return "Dangerous"
+    if v in ("orange", "yellow", "warn", "medium", "moderate", "elevated"):
+        return "Warning"
+    if v in ("green", "low", "minor", "info"):
+        return "Normal"
+    return "Normal"
@@ -0,0 +1,513 @@
+# ingest.py — bulk incident import from agency feed dumps (USGS / GDACS GeoJSON) and CSV / GeoJSON / NDJSON files
+#
+#   python ingest.py usgs_all_month.geojson --source usgs
+#   python ingest.py gdacs.geojson reports.csv --source gdacs --workers 8 --checkpoint .ingest-checkpoint.json
+#
+# Records are streamed, deduplicated by external id (deterministic document ids + Firestore create()),
+# enriched with country / region and written with BulkWriter (or 500-doc batches). Enrichment uses the
+# bundled gazetteer (places.py); only points far from any known place go to the network reverse geocoder
+# (geocoding.py, with its circuit breakers and cache, Nominatim calls spaced 1 s apart).
+# Progress is checkpointed after every committed chunk, so re-running the same command resumes; a chunk
+# with failed writes stops the import before the checkpoint moves past it.
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_init import DEFAULT_SECRETS_PATH, init_from_cli, load_secrets
+from geocoding import Geocoder
+from incidents import INCIDENTS_COLLECTION, INCIDENT_TYPES, build_incident_doc, normalize_level, parse_time_ms
+from places import DEFAULT_PLACES_PATH, PlaceIndex
+
+ALREADY_EXISTS = 6  # grpc status code returned by create() on an existing document
+MAX_BATCH_WRITES = 500
+
+GDACS_TYPES = {"EQ": "Earthquake", "TC": "Storm", "FL": "Flood", "WF": "Fire", "VO": "Volcano", "DR": "Drought"}
+
+_ALIASES = {
+    "external_id": ("external_id", "id", "event_id", "eventid", "code"),
+    "type": ("type", "incident_type", "category", "event_type"),
+    "level": ("level", "severity", "alertlevel", "alert"),
+    "description": ("description", "title", "summary", "name"),
+    "lat": ("lat", "latitude", "y"),
+    "lng": ("lng", "lon", "long", "longitude", "x"),
+    "created": ("created_ms", "time", "timestamp", "created", "date", "fromdate"),
+    "country": ("country",),
+    "region": ("region", "state", "province"),
+    "display_address": ("display_address", "address", "place", "location_name"),
+}
+
+
+# ---------------- Parsing ----------------
+def _pick(row, field):
+    for k in _ALIASES[field]:
+        v = row.get(k)
+        if v not in (None, ""):
+            return v
+    return None
+
+
+def _normalize_type(v):
+    if not v:
+        return "Other"
+    t = str(v).strip()
+    for known in INCIDENT_TYPES:
+        if t.lower() == known.lower():
+            return known
+    return t[:60]
+
+
+def _finish(rec):
+    """Validate a parsed record; returns None for rows that can't become incidents."""
+    try:
+        rec["lat"] = float(rec["lat"])
+        rec["lng"] = float(rec["lng"])
+    except (TypeError, ValueError, KeyError):
+        return None
+    if not (-90 <= rec["lat"] <= 90 and -180 <= rec["lng"] <= 180):
+        return None
+    try:
+        rec["created_ms"] = parse_time_ms(rec.get("created_ms"))
+    except ValueError:
+        rec["created_ms"] = None
+    if rec.get("external_id") in (None, ""):
+        # no upstream id: identical rows still collapse onto the same document
+        basis = f"{rec.get('type')}|{rec['lat']:.5f}|{rec['lng']:.5f}|{rec.get('created_ms')}|{rec.get('description')}"
+        rec["external_id"] = hashlib.sha1(basis.encode("utf-8")).hexdigest()
+    rec["external_id"] = str(rec["external_id"])
+    return rec
+
+
+def record_from_mapping(row):
+    rec = {
+        "external_id": _pick(row, "external_id"),
+        "type": _normalize_type(_pick(row, "type")),
+        "level": normalize_level(_pick(row, "level")),
+        "description": str(_pick(row, "description") or ""),
+        "lat": _pick(row, "lat"),
+        "lng": _pick(row, "lng"),
+        "created_ms": _pick(row, "created"),
+        "country": _pick(row, "country"),
+        "region": _pick(row, "region"),
+        "display_address": _pick(row, "display_address"),
+    }
+    return _finish(rec)
+
+
+def _feature_point(geom):
+    if not geom:
+        return None, None
+    coords = geom.get("coordinates")
+    if geom.get("type") == "Point" and coords:
+        return coords[1], coords[0]
+    # polygons / lines: average of all vertices is good enough for a marker
+    pts = []
+
+    def walk(c):
+        if c and isinstance(c[0], (int, float)):
+            pts.append(c)
+        else:
+            for x in c or []:
+                walk(x)
+    walk(coords)
+    if not pts:
+        return None, None
+    return sum(p[1] for p in pts)/len(pts), sum(p[0] for p in pts)/len(pts)
+
+
+def _usgs_level(props):
+    if props.get("alert"):
+        return normalize_level(props["alert"])
+    mag = props.get("mag") or 0
+    if mag >= 6:
+        return "Dangerous"
+    if mag >= 4.5:
+        return "Warning"
+    return "Normal"
+
+
+def record_from_feature(feat, feed="auto"):
+    props = feat.get("properties") or {}
+    lat, lng = _feature_point(feat.get("geometry"))
+    if feed == "auto":
+        if "eventtype" in props:
+            feed = "gdacs"
+        elif "mag" in props and "time" in props:
+            feed = "usgs"
+        else:
+            feed = "generic"
+    if feed == "usgs":
+        rec = {
+            "external_id": feat.get("id") or props.get("code"),
+            "type": "Earthquake",
+            "level": _usgs_level(props),
+            "description": props.get("title") or props.get("place") or "",
+            "lat": lat, "lng": lng,
+            "created_ms": props.get("time"),
+            "country": None, "region": None,
+            "display_address": props.get("place"),
+        }
+        return _finish(rec)
+    if feed == "gdacs":
+        etype = str(props.get("eventtype") or "").upper()
+        rec = {
+            "external_id": f"{etype}{props.get('eventid')}-{props.get('episodeid') or 0}",
+            "type": GDACS_TYPES.get(etype, "Other"),
+            "level": normalize_level(props.get("alertlevel")),
+            "description": props.get("description") or props.get("name") or props.get("htmldescription") or "",
+            "lat": lat, "lng": lng,
+            "created_ms": props.get("fromdate"),
+            "country": props.get("country"), "region": None,
+            "display_address": props.get("name"),
+        }
+        return _finish(rec)
+    row = dict(props)
+    row.setdefault("id", feat.get("id"))
+    row.setdefault("lat", lat)
+    row.setdefault("lng", lng)
+    return record_from_mapping(row)
+
+
+def _iter_json_array_items(f, chunk_size=1 << 16):
+    """Yield the objects of the GeoJSON `features` array (or a top-level array) without loading the file."""
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk_size)
+    while True:
+        stripped = buf.lstrip()
+        if stripped.startswith("["):
+            buf = stripped[1:]
+            break
+        idx = buf.find('"features"')
+        br = buf.find("[", idx) if idx >= 0 else -1
+        if br >= 0:
+            buf = buf[br + 1:]
+            break
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        buf += chunk
+    while True:
+        buf = buf.lstrip(" \t\r\n,")
+        if buf.startswith("]"):
+            return
+        try:
+            obj, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                if buf.strip():
+                    raise
+                return
+            buf += chunk
+            continue
+        yield obj
+        buf = buf[end:]
+
+
+def detect_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".csv", ".tsv"):
+        return "csv"
+    if ext in (".ndjson", ".jsonl", ".geojsonl", ".geojsons"):
+        return "ndjson"
+    return "geojson"
+
+
+def iter_records(path, fmt="auto", feed="auto"):
+    """Stream records from one file. Invalid rows are yielded as None so offsets stay stable for checkpoints."""
+    if fmt == "auto":
+        fmt = detect_format(path)
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if fmt == "csv":
+            dialect = "excel-tab" if path.lower().endswith(".tsv") else "excel"
+            for row in csv.DictReader(f, dialect=dialect):
+                yield record_from_mapping({(k or "").strip().lower(): v for k, v in row.items()})
+        elif fmt == "ndjson":
+            for line in f:
+                line = line.strip().lstrip("\x1e")  # RFC 8142 GeoJSON text sequences
+                if not line:
+                    continue
+                try:
+                    obj = json.loads(line)
+                except json.JSONDecodeError:
+                    yield None
+                    continue
+                if not isinstance(obj, dict):
+                    # valid JSON but not a record ([], "x", 3)
+                    yield None
+                    continue
+                yield record_from_feature(obj, feed) if obj.get("type") == "Feature" else record_from_mapping(obj)
+        else:
+            for feat in _iter_json_array_items(f):
+                yield record_from_feature(feat, feed)
+
+
+# ---------------- Enrichment ----------------
+# Nominatim's usage policy allows at most one request per second per application
+NOMINATIM_MIN_INTERVAL_S = 1.0
+# network lookups wait their turn behind the Nominatim spacing, so allow more than the app's budget
+INGEST_GEOCODE_BUDGET_S = 30.0
+
+
+def reverse_geocoder(places, geocoder=None):
+    """
+    (lat, lng) -> (country, region, display address), like the app's reverse_geocode: the gazetteer
+    answers offline, and geocoder (a geocoding.Geocoder) is asked only for points it cannot place.
+    """
+    def lookup(lat, lng):
+        country, region = places.locate(lat, lng)
+        if country is not None or geocoder is None:
+            return country, region, None
+        try:
+            return geocoder.reverse(lat, lng) or (None, None, None)
+        except Exception:
+            return None, None, None
+    return lookup
+
+
+def enrich(records, geocoder, pool):
+    """Fill country/region/display_address for records missing them, in parallel."""
+    todo = [r for r in records if not (r.get("country") and r.get("region"))]
+    for rec, (country, region, display) in zip(todo, pool.map(lambda r: geocoder(r["lat"], r["lng"]), todo)):
+        rec["country"] = rec.get("country") or country
+        rec["region"] = rec.get("region") or region
+        rec["display_address"] = rec.get("display_address") or display
+
+
+# ---------------- Writers ----------------
+def incident_doc_id(source, external_id):
+    return "ext-" + hashlib.sha1(f"{source}:{external_id}".encode("utf-8")).hexdigest()[:32]
+
+
+class BulkSink:
+    """Firestore BulkWriter; create() makes already-imported documents fail fast as duplicates."""
+
+    def __init__(self, db, collection=INCIDENTS_COLLECTION):
+        self.col = db.collection(collection)
+        self.bw = db.bulk_writer()
+        self.bw.on_write_result(self._on_result)
+        self.bw.on_write_error(self._on_error)
+        self.written = self.duplicates = self.failed = 0
+        self._lock = threading.Lock()
+
+    def _on_result(self, ref, result, bulk_writer):
+        with self._lock:
+            self.written += 1
+
+    def _on_error(self, error, bulk_writer):
+        if error.code == ALREADY_EXISTS:
+            with self._lock:
+                self.duplicates += 1
+            return False
+        if error.attempts < 5:
+            return True
+        with self._lock:
+            self.failed += 1
+        print(f"write failed for {error.operation}: {error.message}", file=sys.stderr)
+        return False
+
+    def write(self, doc_id, doc):
+        self.bw.create(self.col.document(doc_id), doc)
+
+    def flush(self):
+        self.bw.flush()
+
+    def close(self):
+        self.bw.close()
+
+
+class BatchSink:
+    """Plain 500-document batch commits; existing ids are looked up with get_all() and skipped."""
+
+    def __init__(self, db, collection=INCIDENTS_COLLECTION):
+        self.db = db
+        self.col = db.collection(collection)
+        self.pending = []
+        self.written = self.duplicates = self.failed = 0
+
+    def write(self, doc_id, doc):
+        self.pending.append((doc_id, doc))
+        if len(self.pending) >= MAX_BATCH_WRITES:
+            self.flush()
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        refs = [self.col.document(doc_id) for doc_id, _ in pending]
+        existing = {snap.id for snap in self.db.get_all(refs) if snap.exists}
+        batch = self.db.batch()
+        n = 0
+        for ref, (doc_id, doc) in zip(refs, pending):
+            if doc_id in existing:
+                self.duplicates += 1
+                continue
+            batch.create(ref, doc)
+            n += 1
+        if n:
+            try:
+                batch.commit()
+                self.written += n
+            except Exception as e:
+                self.failed += n
+                print(f"batch commit failed: {e}", file=sys.stderr)
+
+    def close(self):
+        self.flush()
+
+
+class DryRunSink:
+    def __init__(self):
+        self.written = self.duplicates = self.failed = 0
+
+    def write(self, doc_id, doc):
+        self.written += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# ---------------- Checkpoints ----------------
+class Checkpoint:
+    """{absolute file path: records consumed} persisted atomically after each committed chunk."""
+
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def get(self, key):
+        return int(self.state.get(key, 0))
+
+    def save(self, key, count):
+        self.state[key] = count
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+
+# ---------------- Driver ----------------
+def ingest_file(path, sink, source, checkpoint, geocoder=None, pool=None, fmt="auto", feed="auto",
+                chunk_size=MAX_BATCH_WRITES, seen=None, stats=None):
+    key = os.path.abspath(path)
+    done = checkpoint.get(key)
+    seen = seen if seen is not None else set()
+    stats = stats if stats is not None else {"read": 0, "invalid": 0, "duplicates": 0, "started": time.time()}
+    records = itertools.islice(iter_records(path, fmt, feed), done, None)
+    if done:
+        print(f"{path}: resuming after {done} records")
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            break
+        valid = []
+        for rec in chunk:
+            if rec is None:
+                stats["invalid"] += 1
+                continue
+            doc_id = incident_doc_id(source, rec["external_id"])
+            if doc_id in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(doc_id)
+            rec["_doc_id"] = doc_id
+            valid.append(rec)
+        if geocoder and pool and valid:
+            enrich(valid, geocoder, pool)
+        for rec in valid:
+            sink.write(rec["_doc_id"], build_incident_doc(
+                f"{source}@import", source, rec["type"], rec["description"], rec["lat"], rec["lng"], rec["level"],
+                country=rec.get("country"), region=rec.get("region"), display_address=rec.get("display_address"),
+                created_ms=rec.get("created_ms"), source=source, external_id=rec["external_id"]))
+        failed_before = sink.failed
+        sink.flush()
+        if sink.failed > failed_before:
+            # keep the checkpoint before this chunk so --resume retries it (created ones count as duplicates)
+            print(f"{path}: {sink.failed - failed_before} writes failed in the chunk after record {done}; "
+                  f"stopping, re-run to resume from there", file=sys.stderr)
+            stats["stopped"] = True
+            break
+        done += len(chunk)
+        stats["read"] += len(chunk)
+        checkpoint.save(key, done)
+        elapsed = max(time.time() - stats["started"], 1e-6)
+        print(f"{path}: {done} records | written {sink.written} | dupes {stats['duplicates'] + sink.duplicates} "
+              f"| invalid {stats['invalid']} | {stats['read']/elapsed:.0f} rec/s")
+    return stats
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Bulk-import incidents into Firestore.")
+    ap.add_argument("files", nargs="+")
+    ap.add_argument("--source", required=True, help="feed name stored on each incident and used to namespace external ids (e.g. usgs, gdacs)")
+    ap.add_argument("--format", dest="fmt", choices=["auto", "csv", "ndjson", "geojson"], default="auto")
+    ap.add_argument("--feed", choices=["auto", "usgs", "gdacs", "generic"], default="auto", help="how to read GeoJSON feature properties")
+    ap.add_argument("--writer", choices=["bulk", "batch"], default="bulk")
+    ap.add_argument("--chunk-size", type=int, default=MAX_BATCH_WRITES, help="records per committed chunk / checkpoint")
+    ap.add_argument("--workers", type=int, default=4,
+                    help="parallel enrichment threads (network lookups are spaced 1 s apart regardless)")
+    ap.add_argument("--no-geocode", action="store_true", help="skip country / region enrichment")
+    ap.add_argument("--offline", action="store_true", help="enrich from the bundled gazetteer only, no network lookups")
+    ap.add_argument("--places", default=DEFAULT_PLACES_PATH, help="gazetteer CSV (see places.py)")
+    ap.add_argument("--checkpoint", default=".ingest-checkpoint.json", help="checkpoint file ('' to disable)")
+    ap.add_argument("--dry-run", action="store_true", help="parse, dedupe and enrich without writing")
+    ap.add_argument("--secrets", default=DEFAULT_SECRETS_PATH)
+    ap.add_argument("--service-account", default=None)
+    args = ap.parse_args(argv)
+
+    if args.dry_run:
+        sink = DryRunSink()
+    else:
+        db, _ = init_from_cli(args.secrets, args.service_account)
+        sink = BulkSink(db) if args.writer == "bulk" else BatchSink(db)
+
+    geocoder = network = None
+    if not args.no_geocode:
+        try:
+            secrets = load_secrets(args.secrets)
+        except FileNotFoundError:
+            secrets = {}
+        if not args.offline:
+            network = Geocoder(secrets.get("OPENCAGE_KEY") or secrets.get("opencage_key"),
+                               secrets.get("geocoder_contact") or secrets.get("GEOCODER_CONTACT"),
+                               budget_s=INGEST_GEOCODE_BUDGET_S, nominatim_interval_s=NOMINATIM_MIN_INTERVAL_S)
+        geocoder = reverse_geocoder(PlaceIndex.load(args.places), network)
+
+    checkpoint = Checkpoint(args.checkpoint or None)
+    stats = {"read": 0, "invalid": 0, "duplicates": 0, "started": time.time()}
+    seen = set()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        try:
+            for path in args.files:
+                ingest_file(path, sink, args.source, checkpoint, geocoder, pool, args.fmt, args.feed,
+                            max(1, args.chunk_size), seen, stats)
+                if stats.get("stopped"):
+                    break
+        finally:
+            sink.close()
+    elapsed = max(time.time() - stats["started"], 1e-6)
+    print(json.dumps({
+        "read": stats["read"], "written": sink.written, "duplicates": stats["duplicates"] + sink.duplicates,
+        "invalid": stats["invalid"], "failed": sink.failed, "seconds": round(elapsed, 2),
+        "records_per_second": round(stats["read"]/elapsed, 1),
+        "geocoder": network.health() if network else None,
+    }))
+    return 0 if not sink.failed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
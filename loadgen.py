@@ -0,0 +1,324 @@
+# loadgen.py — simulated concurrent viewers driving app.py through Streamlit's AppTest
+#
+#   python loadgen.py                                         # 20 sessions, 4 at a time, 10k incidents
+#   python loadgen.py --sessions 200 --concurrency 16 --steps 12 --incidents 100k --out load.json
+#
+# Every session signs in, then performs --steps actions drawn from --mix (feed scroll with "Load more",
+# map clicks, report submissions) on one AppTest instance, i.e. one browser tab. All sessions share
+# this process, so caches, the outbox and the last-seen writer behave as on one server.
+#
+# AppTest swaps process-wide state (runtime, secrets) for each run, so runs of different sessions
+# are serialized here; sessions beyond the first wait for their turn like reruns queueing for the GIL
+# in a real server. Latency is measured from the click to the end of the rerun, including that wait.
+#
+# The app runs on the SQLite store (seeded with bench.py's synthetic incidents) with a stub geocoder,
+# so no Firebase or network is needed. Reported as JSON:
+#   reruns          latency percentiles per user action (one or more reruns: sign-in is two) and
+#                   overall, plus the time spent queued behind other sessions
+#   sessions        session_state size per session (memsize.state_sizes) and its largest keys
+#   backend_calls   store method calls and time, in total and per session
+#   process         RSS before / after, errors raised by the script
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+import geocoding
+import store
+from bench import CITIES, DESCRIPTIONS, latency_stats, parse_size, synthetic_incidents
+from memsize import state_sizes
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+PASSWORD = "loadtest-password"
+DEFAULT_MIX = "feed=5,map=3,submit=1"
+
+_run_lock = threading.Lock()
+
+
+class CountingStore:
+    """Wraps a store and counts calls / time per method (shared by every session)."""
+
+    def __init__(self, inner, name, counters):
+        self._inner = inner
+        self._name = name
+        self._counters = counters
+
+    def __getattr__(self, attr):
+        value = getattr(self._inner, attr)
+        if not callable(value) or attr.startswith("_"):
+            return value
+
+        def counted(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return value(*args, **kwargs)
+            finally:
+                self._counters.add(f"{self._name}.{attr}", time.perf_counter() - t0)
+        return counted
+
+
+class CallCounters:
+    def __init__(self):
+        self.calls = Counter()
+        self.seconds = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, key, seconds):
+        with self._lock:
+            self.calls[key] += 1
+            self.seconds[key] += seconds
+
+    def report(self, sessions):
+        return {key: {"calls": n, "per_session": round(n / max(1, sessions), 2),
+                      "total_ms": round(self.seconds[key] * 1000, 2)}
+                for key, n in sorted(self.calls.items())}
+
+
+class _StubLocation:
+    def __init__(self, lat, lng, name):
+        self.latitude, self.longitude = lat, lng
+        self.address = name
+        self.raw = {"address": {"country": "Pakistan", "state": "Sindh"}, "display_name": name}
+
+
+class StubNominatim:
+    """Stands in for geopy's Nominatim: instant answers around the first bench city."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def geocode(self, query, *args, **kwargs):
+        return _StubLocation(CITIES[0][0], CITIES[0][1], f"{query}, Karachi, Pakistan")
+
+    def reverse(self, point, *args, **kwargs):
+        lat, lng = point
+        return _StubLocation(lat, lng, f"Near {lat:.3f}, {lng:.3f}, Pakistan")
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    import resource
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def seed(sqlite_path, incidents, users, seed_value=0):
+    """Synthetic incidents plus `users` accounts (same password; every other one has a home location)."""
+    inc_store, user_store = store.open_stores("sqlite", sqlite_path=sqlite_path)
+    for doc_id, doc in synthetic_incidents(incidents, seed_value):
+        inc_store.create(doc_id, doc)
+    password_hash = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds=4))
+    encoded = base64.b64encode(password_hash).decode("utf-8")
+    now_ms = int(time.time()*1000)
+    emails = []
+    for i in range(users):
+        email = f"load{i}@example.com"
+        data = {"email": email, "username": f"load{i}", "password_hash": encoded,
+                "last_seen_ms": now_ms - 6 * 3_600_000}
+        if i % 2 == 0:
+            data.update(home_lat=CITIES[0][0], home_lng=CITIES[0][1])
+        user_store.create(email, data)
+        emails.append(email)
+    return emails
+
+
+class Session:
+    def __init__(self, sid, email, secrets, rnd, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.sid = sid
+        self.email = email
+        self.rnd = rnd
+        self.at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        for k, v in secrets.items():
+            self.at.secrets[k] = v
+        run = self.at._run
+
+        def serialized(*args, **kwargs):
+            t0 = time.perf_counter()
+            with _run_lock:
+                self.queued_s += time.perf_counter() - t0
+                return run(*args, **kwargs)
+        self.at._run = serialized
+        self.queued_s = 0.0
+        self.queued = []
+        self.latencies = {}
+        self.errors = []
+        self.clicks = 0
+
+    def _timed(self, action, fn):
+        t0, q0 = time.perf_counter(), self.queued_s
+        try:
+            fn()
+        except Exception as e:
+            self.errors.append(f"{action}: {type(e).__name__}: {e}")
+        self.latencies.setdefault(action, []).append(time.perf_counter() - t0)
+        self.queued.append(self.queued_s - q0)
+        self.errors.extend(f"{action}: {ex.value}" for ex in self.at.exception)
+
+    def _button(self, label):
+        for b in self.at.button:
+            if b.label == label:
+                return b
+        return None
+
+    def _goto(self, page):
+        self.at.session_state["page"] = page
+        self.at.run()
+
+    def login(self):
+        def run():
+            self._goto("login")
+            self.at.text_input(key="login_email").input(self.email)
+            self.at.text_input(key="login_pwd").input(PASSWORD)
+            self._button("Sign in").click().run()
+        self._timed("login", run)
+
+    def feed(self):
+        self._timed("feed_open", lambda: self._goto("feed"))
+        for _ in range(self.rnd.randint(0, 3)):
+            more = self._button("Load more")
+            if more is None:
+                break
+            self._timed("feed_load_more", lambda: more.click().run())
+
+    def map(self):
+        self._timed("map_open", lambda: self._goto("dashboard"))
+        load = self._button("Load map markers")
+        if load is not None and not self.at.session_state["map_markers_loaded"]:
+            self._timed("map_load_markers", lambda: load.click().run())
+        self.clicks += 1
+        lat, lng = CITIES[0][0] + self.rnd.uniform(-0.1, 0.1), CITIES[0][1] + self.rnd.uniform(-0.1, 0.1)
+        self.at.session_state["incident_map"] = {"instance": f"load-{self.sid}", "seq": 0,
+                                                 "click": {"lat": lat, "lng": lng, "n": self.clicks}}
+        self._timed("map_click", self.at.run)
+
+    def submit(self):
+        def run():
+            self._goto("dashboard")
+            self.at.session_state["selected_lat"] = CITIES[0][0] + self.rnd.uniform(-0.1, 0.1)
+            self.at.session_state["selected_lng"] = CITIES[0][1] + self.rnd.uniform(-0.1, 0.1)
+            self.at.text_area(key="ui_desc").input(self.rnd.choice(DESCRIPTIONS))
+            self._button("Submit report").click().run()
+        self._timed("submit", run)
+
+    def state_bytes(self):
+        return state_sizes(self.at.session_state.to_dict())
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("feed", "map", "submit"):
+            raise ValueError(f"unknown action {name!r} in --mix")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run_load(sessions=20, concurrency=4, steps=8, incidents=10_000, mix=DEFAULT_MIX, think_ms=0, seed_value=0,
+             timeout=60):
+    counters = CallCounters()
+    mix = parse_mix(mix)
+    with tempfile.TemporaryDirectory(prefix="loadgen-") as workdir:
+        sqlite_path = os.path.join(workdir, "reports.sqlite3")
+        t0 = time.perf_counter()
+        emails = seed(sqlite_path, incidents, max(1, sessions), seed_value)
+        seed_s = time.perf_counter() - t0
+
+        # the app opens its stores through store.open_stores and geocodes through geocoding.py (geopy's
+        # Nominatim): count the former, answer the latter locally
+        open_stores = store.open_stores
+        store.open_stores = lambda *a, **k: tuple(CountingStore(s, n, counters)
+                                                  for s, n in zip(open_stores(*a, **k), ("incidents", "users")))
+        geocoding.Nominatim = StubNominatim
+        secrets = {"STORAGE_BACKEND": "sqlite", "SQLITE_PATH": sqlite_path,
+                   "OUTBOX_PATH": os.path.join(workdir, "outbox.sqlite3")}
+
+        rss_before = rss_mb()
+        done = []
+
+        def one_session(sid):
+            rnd = random.Random(seed_value * 100_003 + sid)
+            s = Session(sid, emails[sid % len(emails)], secrets, rnd, timeout)
+            s.login()
+            for _ in range(steps):
+                getattr(s, rnd.choices(list(mix), list(mix.values()))[0])()
+                if think_ms:
+                    time.sleep(think_ms / 1000.0 * rnd.uniform(0.5, 1.5))
+            return s, s.state_bytes()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            done = list(pool.map(one_session, range(sessions)))
+        wall_s = time.perf_counter() - started
+        store.open_stores = open_stores
+
+    by_action = {}
+    for s, _ in done:
+        for action, samples in s.latencies.items():
+            by_action.setdefault(action, []).extend(samples)
+    every = [x for samples in by_action.values() for x in samples]
+    queued = [x for s, _ in done for x in s.queued]
+    totals = [sum(sizes.values()) for _, sizes in done]
+    biggest = Counter()
+    for _, sizes in done:
+        biggest.update(sizes)
+    errors = [e for s, _ in done for e in s.errors]
+    return {
+        "meta": {"sessions": sessions, "concurrency": concurrency, "steps": steps, "incidents": incidents,
+                 "mix": mix, "think_ms": think_ms, "seed": seed_value, "seed_s": round(seed_s, 2),
+                 "wall_s": round(wall_s, 2), "reruns_per_s": round(len(every) / max(wall_s, 1e-9), 2)},
+        "reruns": {"all": latency_stats(every), "queued": latency_stats(queued),
+                   "queued_share": round(sum(queued) / max(sum(every), 1e-9), 3),
+                   **{a: latency_stats(v) for a, v in sorted(by_action.items())}},
+        "sessions": {
+            "state_bytes": {"min": min(totals), "p50": sorted(totals)[len(totals) // 2], "max": max(totals),
+                            "mean": round(sum(totals) / len(totals))},
+            "largest_keys": {k: round(v / len(done)) for k, v in biggest.most_common(10)},
+        },
+        "backend_calls": counters.report(sessions),
+        "process": {"rss_before_mb": rss_before, "rss_after_mb": rss_mb(),
+                    "errors": len(errors), "error_samples": errors[:10]},
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Drive app.py with simulated concurrent sessions.")
+    ap.add_argument("--sessions", type=int, default=20)
+    ap.add_argument("--concurrency", type=int, default=4, help="sessions running at the same time")
+    ap.add_argument("--steps", type=int, default=8, help="actions per session after signing in")
+    ap.add_argument("--incidents", default="10k", help="seeded incidents, e.g. 10k or 100k")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help="action weights, e.g. feed=5,map=3,submit=1")
+    ap.add_argument("--think-ms", type=float, default=0, help="mean pause between actions")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--timeout", type=float, default=60, help="per-rerun timeout in seconds")
+    ap.add_argument("--out", help="write JSON here instead of stdout")
+    args = ap.parse_args(argv)
+
+    result = run_load(args.sessions, args.concurrency, args.steps, parse_size(args.incidents), args.mix,
+                      args.think_ms, args.seed, args.timeout)
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# mapdelta.py — marker state for the incident map component, sent to the browser as add/remove deltas
+#
+# The browser keeps its markers keyed by incident id and a content version. Each rerun ships only
+# what changed since the last state the component acknowledged:
+#
+#   server                                   browser (components/incident_map)
+#   delta {instance, seq, full, add, remove} -> apply (upsert by id/version, drop removed ids)
+#                                            <- value {instance, seq}   (ack, triggers one rerun)
+#
+# Streamlit only delivers the latest args to a component, so a browser can skip intermediate deltas.
+# Deltas are therefore computed against the last *acknowledged* state and also cover everything sent
+# since then; applying any of them on top of a partially updated browser gives the same result.
+# A freshly mounted iframe (page switch, reload) has a new instance id and ignores non-full payloads;
+# it answers with its instance id and the next delta is a full one.
+import hashlib
+
+from events import event_summary, group_by_event
+
+POPUP_TEXT_LEN = 200
+
+
+def marker_of(inc, count=1, level=None):
+    """
+    Compact marker dict for an Incident with a location, or None. For an aggregated event pass the
+    newest report, the event's report count and max level; the marker is keyed by event id.
+    """
+    if not inc.has_location:
+        return None
+    desc = (inc.description or "")[:POPUP_TEXT_LEN]
+    level = level or inc.level or "Normal"
+    key = f"{inc.id}|{inc.lat:.6f}|{inc.lng:.6f}|{inc.display_type}|{level}|{count}|{desc}"
+    return {
+        "id": inc.event_id or inc.id,
+        "v": hashlib.sha1(key.encode("utf-8")).hexdigest()[:10],
+        "report": inc.id,
+        "lat": round(inc.lat, 6),
+        "lng": round(inc.lng, 6),
+        "type": inc.display_type or "Report",
+        "level": level,
+        "count": count,
+        "desc": desc,
+    }
+
+
+def event_markers(incs, stats=None):
+    """
+    One marker per event (newest report, report count, max severity), None for unlocated ones.
+    stats: event_stats() of the loaded events, so the count is the stored one rather than the loaded one.
+    """
+    return [marker_of(lead, *event_summary(members, stats)) for lead, members in group_by_event(incs)]
+
+
+class MapDeltaTracker:
+    """Per-session view of what the map component holds. Not thread-safe; lives in st.session_state."""
+
+    def __init__(self):
+        self.instance = None     # browser instance the acked state belongs to
+        self.seq = 0             # seq of the latest delta sent
+        self.sent = {}           # id -> version as of the latest delta sent
+        self.acked = {}          # id -> version the browser confirmed
+        self.unacked = set()     # ids touched by deltas sent after the last ack
+        self.need_full = True
+        self.payload = None      # the delta at `seq`, re-sent unchanged while nothing changes
+        self.stats = {"deltas": 0, "full": 0, "added": 0, "removed": 0}
+
+    def receive(self, value):
+        """Handle the component value from the browser (None before it reported anything)."""
+        if not isinstance(value, dict) or not value.get("instance"):
+            return
+        if value["instance"] != self.instance:
+            self.instance = value["instance"]
+            if value.get("seq") != self.seq or not (self.payload and self.payload["full"]):
+                # new iframe with an empty map: start over with a full payload
+                self.acked = {}
+                self.sent = {}
+                self.unacked = set()
+                self.need_full = True
+                return
+        if value.get("seq") == self.seq:
+            self.acked = dict(self.sent)
+            self.unacked = set()
+
+    def delta(self, markers):
+        """Delta payload that brings the browser from its acked state to `markers`."""
+        current = {m["id"]: m for m in markers if m}
+        full = self.need_full
+        if not full and self.payload is not None and {i: m["v"] for i, m in current.items()} == self.sent:
+            return self.payload
+        maybe_present = set(self.acked) | self.unacked
+        remove = sorted(i for i in maybe_present if i not in current)
+        add = [m for i, m in current.items() if self.acked.get(i) != m["v"] or i in self.unacked]
+        self.seq += 1
+        self.need_full = False
+        self.sent = {i: m["v"] for i, m in current.items()}
+        self.unacked |= set(remove) | {m["id"] for m in add}
+        self.stats["deltas"] += 1
+        self.stats["full"] += int(full)
+        self.stats["added"] += len(add)
+        self.stats["removed"] += len(remove)
+        self.payload = {"instance": self.instance, "seq": self.seq, "full": full, "add": add, "remove": remove}
+        return self.payload
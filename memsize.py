@@ -0,0 +1,43 @@
+# memsize.py — approximate retained size of Python objects (session state accounting)
+import sys
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Bytes held by obj and everything it references (containers, instance __dict__ / __slots__),
+    counting shared objects once. An estimate: interned strings and small ints are counted too.
+    """
+    seen = set() if seen is None else seen
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, type):
+            continue
+        seen.add(id(o))
+        try:
+            total += sys.getsizeof(o)
+        except TypeError:
+            continue
+        if isinstance(o, (str, bytes, bytearray, int, float, bool)) or o is None:
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        else:
+            if hasattr(o, "__dict__"):
+                stack.append(vars(o))
+            for cls in type(o).__mro__:
+                slots = getattr(cls, "__slots__", ())
+                for name in (slots,) if isinstance(slots, str) else slots:
+                    if name not in ("__dict__", "__weakref__") and hasattr(o, name):
+                        stack.append(getattr(o, name))
+    return total
+
+
+def state_sizes(state):
+    """{key: deep size in bytes} for a mapping such as st.session_state, objects shared between keys counted once."""
+    seen = set()
+    return {key: deep_sizeof(value, seen) for key, value in state.items()}
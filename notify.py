@@ -0,0 +1,103 @@
+# notify.py — browser notification items and payloads (kept out of app.py so bench.py can time them)
+import base64
+import json
+
+from events import group_by_event, max_level
+from incidents import load_heavy
+
+# reports within this distance of a user's home location count as "missed" at sign-in
+MISSED_RADIUS_KM = 100
+MISSED_LIMIT = 50
+
+
+def event_items(incs, seen, prefix="New"):
+    """
+    One notification item per event instead of one per report. Event ids in `seen` are skipped,
+    and new ones are added to it, so a flood of follow-up reports stays quiet.
+    """
+    groups = []
+    for lead, members in group_by_event(incs):
+        if lead.event_id in seen:
+            continue
+        if lead.event_id:
+            seen.add(lead.event_id)
+        groups.append((lead, members))
+    # descriptions of light incidents come from one batched read, not one per notification
+    load_heavy([lead for lead, _ in groups])
+    items = []
+    for lead, members in groups:
+        count = f" ({len(members)} reports)" if len(members) > 1 else ""
+        items.append({"title": f"{prefix}: {lead.display_type or 'Report'}{count}",
+                      "body": (lead.description or "")[:140], "level": max_level(members)})
+    return items
+
+
+def missed_incidents(store, last_seen_ms, home=None, radius_km=MISSED_RADIUS_KM, limit=MISSED_LIMIT):
+    """Incidents created after last_seen_ms (near `home` (lat, lng) when the user has one), oldest first."""
+    if home is not None:
+        return store.near(home[0], home[1], radius_km, since_ms=last_seen_ms, limit=limit)
+    return store.newer_than(last_seen_ms, limit=limit)
+
+
+def _level_color(lv):
+    if not lv:
+        return "#2563EB"
+    lv_l = str(lv).strip().lower()
+    if lv_l in ("dangerous", "danger", "high"):
+        return "#ef4444"
+    if lv_l in ("warning",):
+        return "#f59e0b"
+    if lv_l in ("peace", "normal", "ok", "safe"):
+        return "#10b981"
+    return "#2563EB"
+
+
+def _level_icon(level):
+    """Small SVG data-URI icon colored by level."""
+    symbol = "•"
+    if level:
+        lv = str(level).lower()
+        if "danger" in lv:
+            symbol = "❗"
+        elif "warn" in lv:
+            symbol = "⚠️"
+        elif lv in ("normal", "peace", "ok", "safe"):
+            symbol = "✓"
+
+    svg = f"""<svg xmlns='http://www.w3.org/2000/svg' width='128' height='128'>
+  <rect rx='20' width='100%' height='100%' fill='{_level_color(level)}'/>
+  <text x='50%' y='58%' text-anchor='middle' font-size='68' font-family='Segoe UI, Arial, sans-serif' fill='white'>{symbol}</text>
+</svg>"""
+    svg_b64 = base64.b64encode(svg.encode("utf-8")).decode("utf-8")
+    return f"data:image/svg+xml;base64,{svg_b64}"
+
+
+def notification_html(items):
+    """
+    items: list of dicts with keys: title, body, optional 'level' (e.g. "Dangerous","Warning","Normal","Peace").
+    Returns the <script> that shows them via the browser Notification API.
+    """
+    enriched = [{"title": it.get("title", ""), "body": it.get("body", ""), "icon": _level_icon(it.get("level"))}
+                for it in items]
+    payload = json.dumps(enriched)
+
+    return f"""
+    <script>
+      (async function(){{
+        const items = {payload};
+        try {{
+          const perm = await Notification.requestPermission();
+          if (perm === 'granted') {{
+            for (const it of items) {{
+              try {{
+                const n = new Notification(it.title, {{ body: it.body, icon: it.icon }});
+                setTimeout(()=>n.close(), 6000);
+              }} catch(e){{ console.warn(e); }}
+            }}
+          }} else {{
+            console.log('Notification permission:', perm);
+          }}
+        }} catch(e){{ console.error('notify error', e); }}
+      }})();
+    </script>
+    """
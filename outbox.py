@@ -0,0 +1,160 @@
+# outbox.py — durable local queue for report submissions (SQLite), delivered by a background drainer
+#
+# Submitting a report only inserts a row keyed by the report's idempotency key, which is instant and
+# survives restarts. The drainer hands due rows to a delivery callable and retries failures with
+# exponential backoff. Inserting the same key twice is a no-op, and delivery writes the incident
+# under that key with create(), so double clicks and retries never produce duplicate reports.
+import atexit
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+DEFAULT_OUTBOX_PATH = "data/outbox.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    key TEXT PRIMARY KEY,
+    owner TEXT,
+    payload TEXT NOT NULL,
+    photo BLOB,
+    photo_name TEXT,
+    created_ms INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_ms INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_ms);
+"""
+
+
+class ReportOutbox:
+    """
+    deliver(key, payload, photo_bytes, photo_name) -> JSON-able result; raising means "retry later".
+    Rows are retried with backoff (base * 2**attempts, capped, with jitter) until max_attempts,
+    then kept as 'failed'. Delivered rows are deleted after `keep_done` seconds.
+    """
+
+    def __init__(self, path, deliver, interval=2.0, backoff_base=2.0, backoff_cap=300.0,
+                 max_attempts=50, keep_done=86_400):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.deliver = deliver
+        self.interval = float(interval)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_attempts = max_attempts
+        self.keep_done = keep_done
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._delivered = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"enqueued": 0, "duplicates": 0, "delivered": 0, "retries": 0, "failed": 0}
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def enqueue(self, key, payload, owner=None, photo_bytes=None, photo_name=None):
+        """Queue a report; returns False if this key was already queued (or delivered)."""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (key, owner, payload, photo, photo_name, created_ms) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, owner, json.dumps(payload), photo_bytes, photo_name, int(time.time()*1000)))
+            added = cur.rowcount == 1
+        self.stats["enqueued" if added else "duplicates"] += 1
+        self._wake.set()
+        return added
+
+    def status(self, key):
+        """(status, result or last error) for a key, or (None, None) when unknown."""
+        rows = self._execute("SELECT status, result, last_error FROM outbox WHERE key = ?", (key,))
+        if not rows:
+            return None, None
+        status, result, error = rows[0]
+        return status, (json.loads(result) if result else None) if status == "done" else error
+
+    def wait_delivered(self, key, timeout):
+        """Block up to timeout seconds for the key to be delivered; returns its result or None."""
+        deadline = time.time() + timeout
+        with self._delivered:
+            while True:
+                status, result = self.status(key)
+                if status == "done":
+                    return result
+                remaining = deadline - time.time()
+                if status == "failed" or remaining <= 0:
+                    return None
+                self._delivered.wait(remaining)
+
+    def pending_for(self, owner):
+        return self._execute("SELECT COUNT(*) FROM outbox WHERE owner = ? AND status = 'pending'", (owner,))[0][0]
+
+    def pending_count(self):
+        return self._execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'")[0][0]
+
+    def drain(self):
+        """Deliver every due row once. Returns the number delivered."""
+        with self._drain_lock:
+            now = int(time.time()*1000)
+            due = self._execute(
+                "SELECT key, payload, photo, photo_name, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_ms <= ? ORDER BY created_ms", (now,))
+            delivered = 0
+            for key, payload, photo, photo_name, attempts in due:
+                try:
+                    result = self.deliver(key, json.loads(payload), photo, photo_name)
+                except Exception as e:
+                    attempts += 1
+                    delay = min(self.backoff_cap, self.backoff_base * 2 ** attempts) * random.uniform(0.5, 1.0)
+                    status = "failed" if attempts >= self.max_attempts else "pending"
+                    self._execute("UPDATE outbox SET attempts = ?, next_attempt_ms = ?, last_error = ?, status = ? WHERE key = ?",
+                                  (attempts, int(time.time()*1000 + delay*1000), str(e)[:500], status, key))
+                    self.stats["retries"] += 1
+                    self.stats["failed"] += status == "failed"
+                    print(f"outbox delivery of {key} failed (attempt {attempts}):", e)
+                    continue
+                # photo bytes are not needed any more once delivered
+                self._execute("UPDATE outbox SET status = 'done', photo = NULL, result = ?, attempts = ? WHERE key = ?",
+                              (json.dumps(result), attempts + 1, key))
+                delivered += 1
+                self.stats["delivered"] += 1
+                with self._delivered:
+                    self._delivered.notify_all()
+            self._execute("DELETE FROM outbox WHERE status = 'done' AND created_ms < ?", (now - self.keep_done*1000,))
+            with self._delivered:
+                self._delivered.notify_all()
+            return delivered
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._thread = threading.Thread(target=self._run, name="report-outbox", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.drain()
+            except Exception as e:
+                print("outbox drain error:", e)
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
@@ -0,0 +1,148 @@
+# photos.py — content-addressed report photos: one Storage blob per distinct image, shared by reference
+#
+# A photo is stored as images/sha256/<digest>.<ext>, where digest hashes the decoded pixels after EXIF
+# rotation, so the same picture submitted again (re-saved, metadata stripped, by another witness) maps
+# to the blob that is already there and is not uploaded a second time.
+# Each blob has a reference document in PHOTOS_COLLECTION (digest -> path, url, generation, refs =
+# incident ids), changed only in Firestore transactions. The blob is deleted when its last incident
+# goes, conditional on the generation the document recorded, so a copy uploaded again meanwhile for
+# a new report is never removed.
+import hashlib
+import io
+import re
+import time
+
+from firebase_admin import firestore
+from PIL import Image, ImageOps
+
+from incidents import PHOTOS_COLLECTION
+
+PHOTO_PREFIX = "images/sha256/"
+# content-addressed names never get other bytes, so they may be cached for good
+PHOTO_CACHE_CONTROL = "public, max-age=31536000, immutable"
+_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+_DIGEST_IN_URL = re.compile(re.escape(PHOTO_PREFIX) + r"([0-9a-f]{64})\.")
+
+
+def photo_digest(data, name=None):
+    """
+    (sha256 hex, file extension) of an uploaded image. The hash covers mode, size and pixels after EXIF
+    rotation; bytes Pillow cannot decode are hashed as they are.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        ext = _EXTENSIONS.get(img.format)
+        img = ImageOps.exif_transpose(img)
+        h = hashlib.sha256(f"{img.mode} {img.width}x{img.height}\n".encode())
+        h.update(img.tobytes())
+        if ext:
+            return h.hexdigest(), ext
+    except Exception:
+        pass
+    ext = name.rsplit(".", 1)[-1].lower() if name and "." in name else "jpg"
+    return hashlib.sha256(data).hexdigest(), ext
+
+
+def digest_from_url(photo_url):
+    """The digest of a content-addressed photo URL; None for anything else (older per-report uploads)."""
+    m = _DIGEST_IN_URL.search(photo_url or "")
+    return m.group(1) if m else None
+
+
+def _public_url(blob):
+    try:
+        blob.make_public()
+        return blob.public_url
+    except Exception:
+        return None
+
+
+def _upload(blob, data, ext):
+    blob.cache_control = PHOTO_CACHE_CONTROL
+    blob.upload_from_string(data, content_type=Image.MIME.get(ext.upper().replace("JPG", "JPEG"), f"image/{ext}"))
+
+
+def _add_ref(db, ref, incident_id, uploaded=None):
+    """
+    Add incident_id to the reference document and return the document, or None when there is none and
+    nothing was uploaded; uploaded = (path, generation, url) creates it (or joins one a concurrent upload
+    created).
+    """
+    @firestore.transactional
+    def run(transaction):
+        snap = ref.get(transaction=transaction)
+        if snap.exists:
+            data = snap.to_dict()
+            refs = set(data.get("refs") or [])
+            refs.add(incident_id)
+            fields = {"refs": firestore.ArrayUnion([incident_id]), "count": len(refs)}
+            if uploaded:
+                # our upload overwrote the blob; generations only grow, keep the newest
+                fields["generation"] = max(int(data.get("generation") or 0), uploaded[1])
+            transaction.update(ref, fields)
+            return data
+        if not uploaded:
+            return None
+        data = {"path": uploaded[0], "generation": uploaded[1], "url": uploaded[2], "refs": [incident_id],
+                "count": 1, "created_ms": int(time.time()*1000)}
+        transaction.set(ref, data)
+        return data
+    return run(db.transaction())
+
+
+def store_photo(bucket, db, incident_id, data, name=None):
+    """
+    Upload a report photo unless the same image is already stored, and reference it from incident_id.
+    Safe to call again for the same incident. Returns the public URL (None when the bucket is not public).
+    Without db there is no reference counting; the blob is then only checked for existence.
+    """
+    digest, ext = photo_digest(data, name)
+    blob = bucket.blob(f"{PHOTO_PREFIX}{digest}.{ext}")
+    if db is None:
+        if not blob.exists():
+            _upload(blob, data, ext)
+        return _public_url(blob)
+    ref = db.collection(PHOTOS_COLLECTION).document(digest)
+    stored = _add_ref(db, ref, incident_id)
+    if stored is not None:
+        return stored.get("url")
+    # first copy, or its last reference was just dropped: upload so this copy gets its own generation
+    _upload(blob, data, ext)
+    url = _public_url(blob)
+    _add_ref(db, ref, incident_id, uploaded=(blob.name, int(blob.generation or 0), url))
+    return url
+
+
+def release_photo(bucket, db, incident_id, photo_url):
+    """
+    Drop a deleted incident's reference to its photo and delete the blob when no incident uses it any
+    more. Returns True when the blob was deleted. Photos stored before content addressing are left alone.
+    """
+    digest = digest_from_url(photo_url)
+    if not digest or bucket is None or db is None:
+        return False
+    ref = db.collection(PHOTOS_COLLECTION).document(digest)
+
+    @firestore.transactional
+    def run(transaction):
+        snap = ref.get(transaction=transaction)
+        if not snap.exists:
+            return None
+        data = snap.to_dict()
+        refs = set(data.get("refs") or []) - {incident_id}
+        if refs:
+            transaction.update(ref, {"refs": firestore.ArrayRemove([incident_id]), "count": len(refs)})
+            return None
+        transaction.delete(ref)
+        return data.get("path"), int(data.get("generation") or 0)
+
+    last = run(db.transaction())
+    if not last or not last[0]:
+        return False
+    from google.api_core.exceptions import NotFound, PreconditionFailed
+    try:
+        bucket.blob(last[0]).delete(if_generation_match=last[1] or None)
+        return True
+    except (NotFound, PreconditionFailed):
+        # already gone, or uploaded again for a new reference since
+        return False
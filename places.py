@@ -0,0 +1,301 @@
+# places.py — bundled gazetteer (data/places.csv): k-d tree for offline reverse geocoding and a
+# sorted prefix index for place search
+#
+#   python places.py locate 24.86 67.01
+#   python places.py search "hyderabad, sindh"
+#   python places.py build --cities cities15000.txt --admin1 admin1CodesASCII.txt --countries countryInfo.txt
+#
+# The bundled file is a hand-picked set of ~450 places: the larger towns of every Pakistani province,
+# the neighbouring countries and the big cities elsewhere, with approximate populations in thousands.
+# `build` regenerates it from the GeoNames dumps (download.geonames.org/export/dump) for full coverage.
+#
+# locate() answers with the country and region of the nearest place within max_km. It is a centroid
+# lookup: close to a border the neighbour's town can win. The display address still comes from the
+# network reverse geocoder (geocoding.py) when it is reachable.
+#
+# Place names (and the "|"-separated aliases in the alt column) are folded to lowercase ASCII words and
+# kept in one sorted list, once whole and once from each later word on, so a bisect finds both "dera
+# ghazi khan" and "khan" prefixes. resolve() only answers exact names, optionally narrowed by region /
+# country ("Hyderabad, Sindh"); anything else is left to the network geocoder.
+import argparse
+import bisect
+import csv
+import json
+import math
+import sys
+import time
+import unicodedata
+
+from geo import haversine
+
+DEFAULT_PLACES_PATH = "data/places.csv"
+# beyond this distance to the nearest known place, locate() gives up (the network answer is used)
+LOCATE_MAX_KM = 150
+FIELDS = ["name", "region", "country", "lat", "lng", "pop_k", "alt"]
+SUGGEST_LIMIT = 8
+
+
+def normalize(text):
+    """'São Paulo ' -> 'sao paulo': accents dropped, lowercase, runs of anything but letters/digits -> one space."""
+    folded = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join("".join(c if c.isalnum() else " " for c in folded).split())
+
+
+class Place:
+    __slots__ = ("name", "region", "country", "lat", "lng", "pop_k", "alt")
+
+    def __init__(self, name, region, country, lat, lng, pop_k=0, alt=()):
+        self.name, self.region, self.country = name, region or None, country or None
+        self.lat, self.lng, self.pop_k = float(lat), float(lng), int(pop_k or 0)
+        self.alt = tuple(a for a in (alt.split("|") if isinstance(alt, str) else alt) if a)
+
+    @property
+    def label(self):
+        """'Hyderabad, Sindh, Pakistan'; a region named like the place is left out ('Tokyo, Japan')."""
+        parts = [self.name]
+        for x in (self.region, self.country):
+            if x and x not in parts:
+                parts.append(x)
+        return ", ".join(parts)
+
+    def __repr__(self):
+        return f"Place({self.name!r}, {self.region!r}, {self.country!r}, {self.lat}, {self.lng})"
+
+
+def _unit(lat, lng):
+    """Point on the unit sphere: straight-line nearest there is great-circle nearest, with no dateline seam."""
+    phi, lam = math.radians(lat), math.radians(lng)
+    return math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi)
+
+
+class KDTree:
+    """
+    Static k-d tree over 3-D points, stored implicitly: each slice [lo, hi) is sorted on its split axis
+    and its median is the node, so the tree is one list of (point, index) with no node objects.
+    """
+
+    def __init__(self, points):
+        self._pts = [(p, i) for i, p in enumerate(points)]
+        stack = [(0, len(self._pts), 0)]
+        while stack:
+            lo, hi, axis = stack.pop()
+            if hi - lo < 2:
+                continue
+            self._pts[lo:hi] = sorted(self._pts[lo:hi], key=lambda e: e[0][axis])
+            mid = (lo + hi) // 2
+            stack.append((lo, mid, (axis + 1) % 3))
+            stack.append((mid + 1, hi, (axis + 1) % 3))
+
+    def __len__(self):
+        return len(self._pts)
+
+    def nearest(self, q):
+        """(index of the closest point, squared distance), or (None, inf) when empty."""
+        best_d, best_i = math.inf, None
+        # (lo, hi, axis, squared distance from q to the slice's side of the parent split)
+        stack = [(0, len(self._pts), 0, 0.0)]
+        while stack:
+            lo, hi, axis, bound = stack.pop()
+            if lo >= hi or bound >= best_d:
+                continue
+            mid = (lo + hi) // 2
+            p, i = self._pts[mid]
+            d = (p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2 + (p[2] - q[2]) ** 2
+            if d < best_d:
+                best_d, best_i = d, i
+            diff = q[axis] - p[axis]
+            nxt = (axis + 1) % 3
+            # far side pushed first: the near side is searched first and usually rules the far side out
+            if diff < 0:
+                stack.append((mid + 1, hi, nxt, diff * diff))
+                stack.append((lo, mid, nxt, 0.0))
+            else:
+                stack.append((lo, mid, nxt, diff * diff))
+                stack.append((mid + 1, hi, nxt, 0.0))
+        return best_i, best_d
+
+
+class PlaceIndex:
+    def __init__(self, places):
+        self.places = list(places)
+        self._tree = KDTree([_unit(p.lat, p.lng) for p in self.places])
+        # (folded key, 0 = whole name / 1 = from a later word, place index)
+        keys = set()
+        for i, p in enumerate(self.places):
+            for name in (p.name,) + p.alt:
+                words = normalize(name).split()
+                for w in range(len(words)):
+                    keys.add((" ".join(words[w:]), min(w, 1), i))
+        self._keys = sorted(keys)
+        self._by_label = {}
+        for i in sorted(range(len(self.places)), key=lambda i: -self.places[i].pop_k):
+            self._by_label.setdefault(self.places[i].label, i)
+
+    @classmethod
+    def load(cls, path=DEFAULT_PLACES_PATH):
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls(Place(row["name"], row["region"], row["country"], row["lat"], row["lng"], row.get("pop_k"),
+                             row.get("alt") or ()) for row in csv.DictReader(f))
+
+    def __len__(self):
+        return len(self.places)
+
+    def nearest(self, lat, lng):
+        """(Place, distance in km) of the closest known place, or (None, None) when the index is empty."""
+        i, _ = self._tree.nearest(_unit(float(lat), float(lng)))
+        if i is None:
+            return None, None
+        place = self.places[i]
+        return place, haversine(float(lat), float(lng), place.lat, place.lng)
+
+    def locate(self, lat, lng, max_km=LOCATE_MAX_KM):
+        """(country, region) of the nearest place within max_km, else (None, None)."""
+        place, km = self.nearest(lat, lng)
+        if place is None or km > max_km:
+            return None, None
+        return place.country, place.region
+
+    # ---- search ----
+    def _prefixed(self, prefix):
+        """(key, from-a-later-word flag, place index) for every key starting with the folded prefix."""
+        lo = bisect.bisect_left(self._keys, (prefix,))
+        for key, partial, i in self._keys[lo:]:
+            if not key.startswith(prefix):
+                break
+            yield key, partial, i
+
+    def suggest(self, text, limit=SUGGEST_LIMIT):
+        """Places whose name (or a later word of it, or an alias) starts with text: whole-name hits first, then by size."""
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        best = {}
+        for key, partial, i in self._prefixed(prefix):
+            rank = (key != prefix, partial)
+            if i not in best or rank < best[i]:
+                best[i] = rank
+        order = sorted(best, key=lambda i: (best[i], -self.places[i].pop_k, self.places[i].name))
+        return [self.places[i] for i in order[:limit]]
+
+    def _exact(self, name, qualifiers):
+        found = []
+        for key, partial, i in self._prefixed(name):
+            if key != name or partial:
+                continue
+            p = self.places[i]
+            where = f"{normalize(p.region)} {normalize(p.country)}"
+            if all(f" {q}" in f" {where}" for q in qualifiers) and p not in found:
+                found.append(p)
+        return found
+
+    def resolve(self, query, near=None):
+        """
+        The place a search box query names, or None when it isn't an exact place name here.
+        "Name, Region, Country" labels (and "Name Region" / "Name Country" word runs) narrow it down; between
+        equal names the one closest to `near` (lat, lng) wins, else the largest.
+        """
+        if not query:
+            return None
+        i = self._by_label.get(query.strip())
+        if i is not None:
+            return self.places[i]
+        parts = [normalize(part) for part in query.split(",")]
+        if not parts[0]:
+            return None
+        found = self._exact(parts[0], [q for q in parts[1:] if q])
+        words = parts[0].split()
+        # "hyderabad sindh": longest leading run of words that is a name, the rest narrows it
+        for cut in range(len(words) - 1, 0, -1):
+            if found:
+                break
+            found = self._exact(" ".join(words[:cut]), [" ".join(words[cut:])] + [q for q in parts[1:] if q])
+        if not found:
+            return None
+        if near is not None:
+            return min(found, key=lambda p: haversine(near[0], near[1], p.lat, p.lng))
+        return max(found, key=lambda p: p.pop_k)
+
+    def labels(self, limit=None):
+        """'Name, Region, Country' for the largest places first (the type-ahead options)."""
+        return list(self._by_label)[:limit]
+
+
+# ---------------- GeoNames import ----------------
+def _read_tsv(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip() and not line.startswith("#"):
+                yield line.rstrip("\n").split("\t")
+
+
+def from_geonames(cities_path, admin1_path, countries_path, min_pop=15000):
+    """Places from GeoNames' citiesNNNN.txt, admin1CodesASCII.txt and countryInfo.txt, by country, largest first."""
+    regions = {cols[0]: cols[1] for cols in _read_tsv(admin1_path)}
+    countries = {cols[0]: cols[4] for cols in _read_tsv(countries_path)}
+    places = []
+    for cols in _read_tsv(cities_path):
+        pop = int(cols[14] or 0)
+        if pop < min_pop:
+            continue
+        cc, admin1 = cols[8], cols[10]
+        # asciiname only when it isn't just the accent-free spelling of the name
+        alt = (cols[2],) if normalize(cols[2]) != normalize(cols[1]) else ()
+        places.append(Place(cols[1], regions.get(f"{cc}.{admin1}"), countries.get(cc, cc), cols[4], cols[5],
+                            pop // 1000, alt))
+    places.sort(key=lambda p: (p.country or "", -p.pop_k, p.name))
+    return places
+
+
+def write_csv(places, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(FIELDS)
+        for p in places:
+            w.writerow([p.name, p.region or "", p.country or "", f"{p.lat:.4f}", f"{p.lng:.4f}", p.pop_k, "|".join(p.alt)])
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Offline gazetteer: look up a point or a place name, or rebuild data/places.csv.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    loc = sub.add_parser("locate")
+    loc.add_argument("lat", type=float)
+    loc.add_argument("lng", type=float)
+    loc.add_argument("--places", default=DEFAULT_PLACES_PATH)
+    search = sub.add_parser("search")
+    search.add_argument("query")
+    search.add_argument("--places", default=DEFAULT_PLACES_PATH)
+    build = sub.add_parser("build")
+    build.add_argument("--cities", required=True, help="GeoNames cities15000.txt (or cities5000 / cities1000)")
+    build.add_argument("--admin1", required=True, help="GeoNames admin1CodesASCII.txt")
+    build.add_argument("--countries", required=True, help="GeoNames countryInfo.txt")
+    build.add_argument("--min-pop", type=int, default=15000)
+    build.add_argument("--out", default=DEFAULT_PLACES_PATH)
+    args = ap.parse_args(argv)
+
+    if args.command == "build":
+        places = from_geonames(args.cities, args.admin1, args.countries, args.min_pop)
+        write_csv(places, args.out)
+        print(json.dumps({"places": len(places), "out": args.out}))
+        return 0
+    started = time.perf_counter()
+    index = PlaceIndex.load(args.places)
+    loaded = time.perf_counter()
+    if args.command == "search":
+        hit = index.resolve(args.query)
+        suggestions = index.suggest(args.query)
+        print(json.dumps({"resolved": hit.label if hit else None, "lat": hit.lat if hit else None,
+                          "lng": hit.lng if hit else None, "suggestions": [p.label for p in suggestions],
+                          "load_ms": round((loaded - started) * 1000, 2),
+                          "lookup_us": round((time.perf_counter() - loaded) * 1e6, 1)}))
+        return 0
+    place, km = index.nearest(args.lat, args.lng)
+    country, region = index.locate(args.lat, args.lng)
+    print(json.dumps({"country": country, "region": region, "nearest": place.name if place else None,
+                      "km": round(km, 1) if km is not None else None, "places": len(index),
+                      "load_ms": round((loaded - started) * 1000, 2),
+                      "lookup_us": round((time.perf_counter() - loaded) * 1e6, 1)}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
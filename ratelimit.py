@@ -0,0 +1,128 @@
+# ratelimit.py — token-bucket limits for expensive actions (report submission, sign-in, geocoding)
+#
+# A RateLimiter has one bucket per scope it is keyed by (user, email, client, ...), each with its own
+# burst and refill period. A call is allowed only if every bucket it touches has a token; otherwise
+# nothing is taken and the caller gets the number of seconds until it would be allowed.
+#
+# Buckets live in process memory (MemoryBuckets) or, when several app instances must share limits,
+# in Firestore (FirestoreBuckets: one small document per bucket, updated in a transaction).
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from firebase_admin import firestore
+
+RATE_LIMITS_COLLECTION = "rate_limits"
+
+
+def _refill(state, rate, burst, now):
+    """Tokens available now for a bucket last seen as state = (tokens, ts), or full when unknown."""
+    if state is None:
+        return float(burst)
+    tokens, ts = state
+    return min(float(burst), tokens + max(0.0, now - ts) * rate)
+
+
+def _decide(available, cost, rates):
+    """(allowed, retry_after seconds, indexes of the buckets that were short)."""
+    short = [i for i, tokens in enumerate(available) if tokens < cost]
+    if not short:
+        return True, 0.0, []
+    return False, max((cost - available[i]) / rates[i] for i in short), short
+
+
+class MemoryBuckets:
+    """Process-local buckets; the least recently used are forgotten beyond max_keys (they refill anyway)."""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> (tokens, ts)
+        self._lock = threading.Lock()
+
+    def take(self, buckets, cost, now):
+        """buckets: [(key, rate per second, burst)]."""
+        with self._lock:
+            available = [_refill(self._buckets.get(key), rate, burst, now) for key, rate, burst in buckets]
+            allowed, retry_after, short = _decide(available, cost, [rate for _, rate, _ in buckets])
+            for (key, _, _), tokens in zip(buckets, available):
+                self._buckets[key] = (tokens - cost if allowed else tokens, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed, retry_after, short
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class FirestoreBuckets:
+    """Buckets shared by every app instance. Falls back to a local MemoryBuckets if Firestore fails."""
+
+    def __init__(self, db, collection=RATE_LIMITS_COLLECTION):
+        self.db = db
+        self.col = db.collection(collection)
+        self.fallback = MemoryBuckets()
+
+    def take(self, buckets, cost, now):
+        refs = [self.col.document(key.replace("/", "_")) for key, _, _ in buckets]
+
+        @firestore.transactional
+        def run(transaction):
+            available = []
+            for ref, (_, rate, burst) in zip(refs, buckets):
+                snap = ref.get(transaction=transaction)
+                data = snap.to_dict() if snap.exists else None
+                available.append(_refill((data["tokens"], data["ts"]) if data else None, rate, burst, now))
+            allowed, retry_after, short = _decide(available, cost, [rate for _, rate, _ in buckets])
+            if allowed:
+                for ref, tokens in zip(refs, available):
+                    transaction.set(ref, {"tokens": tokens - cost, "ts": now})
+            return allowed, retry_after, short
+
+        try:
+            return run(self.db.transaction())
+        except Exception as e:
+            print("rate limit backend error:", e)
+            return self.fallback.take(buckets, cost, now)
+
+
+class RateLimiter:
+    """
+    limits: {scope: (burst, period seconds)}, e.g. {"email": (5, 300), "client": (10, 60)}:
+    up to `burst` calls at once, refilling at burst/period per second.
+    """
+
+    def __init__(self, name, limits, backend=None):
+        self.name = name
+        self.limits = dict(limits)
+        self.backend = backend or MemoryBuckets()
+        self.stats = {"allowed": 0, "rejected": 0, "rejected_by": {scope: 0 for scope in self.limits}}
+        self._lock = threading.Lock()
+
+    def allow(self, cost=1, **keys):
+        """
+        allow(email=..., client=...) -> (allowed, retry_after seconds). Scopes without a configured
+        limit or with an empty key are ignored.
+        """
+        scopes = [scope for scope, key in keys.items() if key and scope in self.limits]
+        if not scopes:
+            return True, 0.0
+        buckets = []
+        for scope in scopes:
+            burst, period = self.limits[scope]
+            buckets.append((f"{self.name}:{scope}:{keys[scope]}", burst / float(period), burst))
+        allowed, retry_after, short = self.backend.take(buckets, cost, time.time())
+        with self._lock:
+            if allowed:
+                self.stats["allowed"] += 1
+            else:
+                self.stats["rejected"] += 1
+                for i in short:
+                    self.stats["rejected_by"][scopes[i]] += 1
+        return allowed, retry_after
+
+
+def wait_text(seconds):
+    seconds = max(1, math.ceil(seconds))
+    return f"{seconds} s" if seconds < 120 else f"{math.ceil(seconds / 60)} min"
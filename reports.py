@@ -0,0 +1,62 @@
+# reports.py — report submission: queue in the outbox, then deliver to Storage and the incident store
+import time
+import uuid
+
+from density import record_doc as record_density_doc
+from events import assign_event
+from incidents import build_incident_doc
+from photos import store_photo
+
+
+def queue_report(outbox, uid_email, username, inc_type, description, lat, lng, level="Normal", photo_bytes=None,
+                 photo_name=None, idempotency_key=None, title=None):
+    """Queue the report in the local outbox and return its key right away."""
+    key = idempotency_key or uuid.uuid4().hex
+    payload = {"uid_email": uid_email, "username": username, "inc_type": inc_type, "description": description,
+               "lat": lat, "lng": lng, "level": level, "created_ms": int(time.time()*1000)}
+    if title:
+        payload["title"] = title
+    outbox.enqueue(key, payload, owner=(uid_email or "").strip().lower(),
+                   photo_bytes=photo_bytes, photo_name=photo_name)
+    return key
+
+
+def deliver_report(store, key, payload, photo_bytes=None, photo_name=None, reverse_geocode=None, bucket=None, db=None,
+                   density=None):
+    """
+    Write one queued report under its idempotency key; safe to call again after a partial failure.
+    reverse_geocode(lat, lng) -> (country, region, display address). Photos need a Storage `bucket`;
+    events and the density grid need the Firestore client `db`; `density` (a density.DensityWriter)
+    queues the grid update instead of writing it inline.
+    """
+    existing = store.get(key)
+    if existing is not None:
+        return {"id": key, "event_id": existing.get("event_id"), "new_event": False}
+    lat, lng = payload["lat"], payload["lng"]
+    country, region, display_addr = reverse_geocode(lat, lng) if reverse_geocode else (None, None, None)
+    doc = build_incident_doc(payload["uid_email"], payload["username"], payload["inc_type"], payload["description"],
+                             lat, lng, payload["level"], country=country, region=region,
+                             display_address=display_addr, created_ms=payload["created_ms"],
+                             title=payload.get("title"))
+    if photo_bytes and bucket:
+        # content-addressed and reference-counted: a photo already stored is not uploaded again
+        doc["photo_url"] = store_photo(bucket, db, key, photo_bytes, photo_name)
+    event_id, new_event = None, False
+    if db is not None:
+        try:
+            event_id, new_event = assign_event(db, key, doc)
+        except Exception as e:
+            # aggregation is best effort; the report itself must still be saved. A retry after a
+            # failure further down joins the same event again without counting the report twice.
+            print("assign_event error:", e)
+    if not store.create(key, doc):
+        # an earlier attempt got through after all
+        return {"id": key, "event_id": event_id, "new_event": False}
+    if density is not None:
+        density.add_doc(doc)
+    elif db is not None:
+        try:
+            record_density_doc(db, doc)
+        except Exception as e:
+            print("density update error:", e)
+    return {"id": key, "event_id": event_id, "new_event": new_event}
@@ -0,0 +1,470 @@
+# store.py — storage backends for incidents and users behind one small repository interface
+#
+#   IncidentStore: query / newer_than / docs_since / near / get / heavy / create / delete
+#   UserStore:     get / create / update / set_many
+#
+# Implementations: Firestore (production), SQLite with an R-tree index on location (self-hosted,
+# offline benchmarks) and plain memory (tests, load generation). open_stores() picks one by name.
+# Incident queries return Incident objects newest first; the cursor for the next page is the id of
+# the last incident returned.
+import bisect
+import json
+import math
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+from density import covering_cells
+from geo import geohash_encode, haversine
+from incidents import INCIDENTS_COLLECTION, USERS_COLLECTION, Incident, filter_query, location_of, matches_filters
+
+BACKENDS = ("firestore", "sqlite", "memory")
+DEFAULT_SQLITE_PATH = "data/reports.sqlite3"
+# memory store spatial cells (~39 x 19.5 km at the equator); radius queries covering more cells scan
+NEAR_CELL_PRECISION = 4
+NEAR_MAX_CELLS = 256
+
+
+def _plain(data):
+    """Firestore-specific values -> plain ones (GeoPoint -> dict, server timestamp -> now)."""
+    out = {}
+    for k, v in (data or {}).items():
+        if v is firestore.SERVER_TIMESTAMP:
+            v = datetime.now(timezone.utc)
+        elif hasattr(v, "latitude") and hasattr(v, "longitude"):
+            v = {"latitude": float(v.latitude), "longitude": float(v.longitude)}
+        out[k] = v
+    return out
+
+
+def _json_default(v):
+    return v.isoformat() if isinstance(v, datetime) else str(v)
+
+
+def _bbox(lat, lng, radius_km):
+    """(min_lat, max_lat, min_lng, max_lng) enclosing a circle."""
+    dlat = radius_km / 111.0
+    dlng = radius_km / max(1e-6, 111.0 * math.cos(math.radians(lat)))
+    return lat - dlat, lat + dlat, lng - dlng, lng + dlng
+
+
+def _heavy_of(data):
+    return {f: (data or {}).get(f) for f in Incident.HEAVY_FIELDS}
+
+
+# ---------------- Firestore ----------------
+class FirestoreIncidentStore:
+    def __init__(self, db, collection=INCIDENTS_COLLECTION):
+        self.db = db
+        self.col = db.collection(collection)
+        # snapshots of recent page ends, so "next page" needs no extra read for its cursor
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cursor(self, after):
+        with self._lock:
+            snap = self._cursors.get(after)
+        if snap is None:
+            snap = self.col.document(after).get()
+        return snap if snap.exists else None
+
+    def query(self, types=(), levels=(), since_ms=None, until_ms=None, limit=30, after=None):
+        query = filter_query(self.col, types, levels, since_ms, until_ms)
+        query = query.order_by("created_ms", direction=firestore.Query.DESCENDING).limit(limit)
+        if after:
+            cursor = self._cursor(after)
+            if cursor is None:
+                return [], None
+            query = query.start_after(cursor)
+        snaps = list(query.stream())
+        if not snaps:
+            return [], None
+        with self._lock:
+            self._cursors[snaps[-1].id] = snaps[-1]
+            while len(self._cursors) > 1000:
+                self._cursors.popitem(last=False)
+        return [Incident.from_snapshot(s) for s in snaps], snaps[-1].id
+
+    def newer_than(self, since_ms, limit=100):
+        """Incidents with created_ms > since_ms, oldest first."""
+        query = self.col.where("created_ms", ">", int(since_ms)) \
+            .order_by("created_ms", direction=firestore.Query.ASCENDING).limit(limit)
+        return [Incident.from_snapshot(s) for s in query.stream()]
+
+    def docs_since(self, since_ms, limit=1000, after_id=None):
+        """
+        [(id, document)] oldest first, ordered by (created_ms, id) (snapshot catch-up): created_ms >= since_ms,
+        or with after_id, only rows after (since_ms, after_id), so pages never repeat on tied timestamps.
+        """
+        query = self.col.where("created_ms", ">=", int(since_ms)) \
+            .order_by("created_ms", direction=firestore.Query.ASCENDING).order_by("__name__")
+        if after_id:
+            query = query.start_after({"created_ms": int(since_ms), "__name__": after_id})
+        return [(s.id, s.to_dict() or {}) for s in query.limit(limit).stream()]
+
+    def near(self, lat, lng, radius_km, since_ms=0, limit=50):
+        # no geo index in Firestore: newest-after-since, filtered by distance
+        return [inc for inc in self.newer_than(since_ms, limit=limit*4)
+                if inc.has_location and haversine(lat, lng, inc.lat, inc.lng) <= radius_km][:limit]
+
+    def get(self, incident_id):
+        snap = self.col.document(incident_id).get()
+        return snap.to_dict() if snap.exists else None
+
+    def heavy(self, ids):
+        refs = [self.col.document(i) for i in ids]
+        return {s.id: s.to_dict() for s in self.db.get_all(refs, field_paths=list(Incident.HEAVY_FIELDS)) if s.exists}
+
+    def create(self, incident_id, doc):
+        """False when a document with this id already exists."""
+        from google.api_core.exceptions import AlreadyExists
+        try:
+            self.col.document(incident_id).create(doc)
+            return True
+        except AlreadyExists:
+            return False
+
+    def delete(self, incident_id):
+        self.col.document(incident_id).delete()
+
+
+class FirestoreUserStore:
+    def __init__(self, db, collection=USERS_COLLECTION):
+        self.db = db
+        self.col = db.collection(collection)
+
+    def get(self, email):
+        snap = self.col.document(email).get()
+        return snap.to_dict() if snap.exists else None
+
+    def create(self, email, data):
+        from google.api_core.exceptions import AlreadyExists
+        try:
+            self.col.document(email).create(data)
+            return True
+        except AlreadyExists:
+            return False
+
+    def update(self, email, fields):
+        self.col.document(email).set(fields, merge=True)
+
+    def set_many(self, updates):
+        """{email: {field: value}} as merge-sets in one batch (callers keep batches <= 500)."""
+        batch = self.db.batch()
+        for email, fields in updates.items():
+            batch.set(self.col.document(email), fields, merge=True)
+        batch.commit()
+
+
+# ---------------- In-memory ----------------
+class MemoryIncidentStore:
+    """Everything in dicts; a (created_ms, id) sorted list serves the newest-first queries."""
+    db = None
+
+    def __init__(self):
+        self._docs = {}
+        self._order = []
+        self._cells = {}    # geohash cell -> set of ids
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _scan_desc(self, start=None):
+        """Keys from newest to oldest, starting just below `start` ((created_ms, id)) when given."""
+        i = bisect.bisect_left(self._order, start) if start else len(self._order)
+        while i > 0:
+            i -= 1
+            yield self._order[i]
+
+    def query(self, types=(), levels=(), since_ms=None, until_ms=None, limit=30, after=None):
+        with self._lock:
+            start = None
+            if after:
+                doc = self._docs.get(after)
+                if doc is None:
+                    return [], None
+                start = (doc[0].created_ms, after)
+            out = []
+            for created_ms, doc_id in self._scan_desc(start):
+                if since_ms is not None and created_ms < since_ms:
+                    break
+                if until_ms is not None and created_ms >= until_ms:
+                    continue
+                inc = self._docs[doc_id][0]
+                if matches_filters(inc, types, levels):
+                    out.append(self._copy(doc_id))
+                    if len(out) >= limit:
+                        break
+        return out, (out[-1].id if out else None)
+
+    def _copy(self, doc_id):
+        inc, data = self._docs[doc_id]
+        return Incident.from_doc(doc_id, data)
+
+    def newer_than(self, since_ms, limit=100):
+        with self._lock:
+            i = bisect.bisect_left(self._order, (int(since_ms) + 1, ""))
+            return [self._copy(doc_id) for _, doc_id in self._order[i:i + limit]]
+
+    def docs_since(self, since_ms, limit=1000, after_id=None):
+        with self._lock:
+            i = (bisect.bisect_right(self._order, (int(since_ms), after_id)) if after_id
+                 else bisect.bisect_left(self._order, (int(since_ms), "")))
+            return [(doc_id, dict(self._docs[doc_id][1])) for _, doc_id in self._order[i:i + limit]]
+
+    def near(self, lat, lng, radius_km, since_ms=0, limit=50):
+        with self._lock:
+            recent = bisect.bisect_left(self._order, (int(since_ms) + 1, ""))
+            min_lat, max_lat, min_lng, max_lng = _bbox(lat, lng, radius_km)
+            cells = covering_cells((min_lng, min_lat, max_lng, max_lat), NEAR_CELL_PRECISION, NEAR_MAX_CELLS)
+            in_cells = sum(len(self._cells.get(c, ())) for c in cells) if cells is not None else len(self._docs)
+            if len(self._order) - recent <= in_cells:
+                # fewer reports since since_ms than in the area: walk the time index, oldest first
+                found = []
+                for i in range(recent, len(self._order)):
+                    inc = self._docs[self._order[i][1]][0]
+                    if inc.has_location and haversine(lat, lng, inc.lat, inc.lng) <= radius_km:
+                        found.append(inc)
+                        if len(found) >= limit:
+                            break
+            else:
+                ids = set().union(*(self._cells.get(c, ()) for c in cells))
+                found = [self._docs[i][0] for i in ids]
+                found = [inc for inc in found if inc.created_ms > since_ms
+                         and haversine(lat, lng, inc.lat, inc.lng) <= radius_km]
+                found.sort(key=lambda inc: (inc.created_ms, inc.id))
+            return [self._copy(inc.id) for inc in found[:limit]]
+
+    def get(self, incident_id):
+        with self._lock:
+            doc = self._docs.get(incident_id)
+            return dict(doc[1]) if doc else None
+
+    def heavy(self, ids):
+        with self._lock:
+            return {i: _heavy_of(self._docs[i][1]) for i in ids if i in self._docs}
+
+    def create(self, incident_id, doc):
+        data = _plain(doc)
+        with self._lock:
+            if incident_id in self._docs:
+                return False
+            inc = Incident.from_doc(incident_id, data, heavy=False)
+            self._docs[incident_id] = (inc, data)
+            bisect.insort(self._order, (inc.created_ms, incident_id))
+            if inc.has_location:
+                self._cells.setdefault(geohash_encode(inc.lat, inc.lng, NEAR_CELL_PRECISION), set()).add(incident_id)
+            return True
+
+    def delete(self, incident_id):
+        with self._lock:
+            doc = self._docs.pop(incident_id, None)
+            if doc and doc[0].has_location:
+                self._cells.get(geohash_encode(doc[0].lat, doc[0].lng, NEAR_CELL_PRECISION), set()).discard(incident_id)
+            if doc:
+                i = bisect.bisect_left(self._order, (doc[0].created_ms, incident_id))
+                if i < len(self._order) and self._order[i] == (doc[0].created_ms, incident_id):
+                    del self._order[i]
+
+
+class MemoryUserStore:
+    db = None
+
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def get(self, email):
+        with self._lock:
+            data = self._users.get(email)
+            return dict(data) if data is not None else None
+
+    def create(self, email, data):
+        with self._lock:
+            if email in self._users:
+                return False
+            self._users[email] = _plain(data)
+            return True
+
+    def update(self, email, fields):
+        with self._lock:
+            self._users.setdefault(email, {}).update(_plain(fields))
+
+    def set_many(self, updates):
+        for email, fields in updates.items():
+            self.update(email, fields)
+
+
+# ---------------- SQLite ----------------
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS incidents (
+    rid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    created_ms INTEGER NOT NULL,
+    type TEXT,
+    level TEXT,
+    lat REAL,
+    lng REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS incidents_created ON incidents (created_ms, id);
+CREATE INDEX IF NOT EXISTS incidents_type_created ON incidents (type, created_ms);
+CREATE INDEX IF NOT EXISTS incidents_level_created ON incidents (level, created_ms);
+CREATE VIRTUAL TABLE IF NOT EXISTS incidents_rtree USING rtree (rid, min_lat, max_lat, min_lng, max_lng);
+CREATE TABLE IF NOT EXISTS users (email TEXT PRIMARY KEY, data TEXT NOT NULL);
+"""
+
+
+class _SqliteBase:
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self._lock = lock
+
+    def _rows(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+
+class SqliteIncidentStore(_SqliteBase):
+    """Documents as JSON plus indexed columns; locations in an R-tree for radius queries."""
+    db = None
+
+    def query(self, types=(), levels=(), since_ms=None, until_ms=None, limit=30, after=None):
+        where, params = [], []
+        if types:
+            where.append(f"type IN ({','.join('?' * len(types))})")
+            params += list(types)
+        if levels:
+            where.append(f"level IN ({','.join('?' * len(levels))})")
+            params += list(levels)
+        if since_ms is not None:
+            where.append("created_ms >= ?")
+            params.append(int(since_ms))
+        if until_ms is not None:
+            where.append("created_ms < ?")
+            params.append(int(until_ms))
+        if after:
+            cur = self._rows("SELECT created_ms FROM incidents WHERE id = ?", (after,))
+            if not cur:
+                return [], None
+            # keyset pagination on (created_ms, id)
+            where.append("(created_ms < ? OR (created_ms = ? AND id < ?))")
+            params += [cur[0][0], cur[0][0], after]
+        sql = "SELECT id, data FROM incidents"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_ms DESC, id DESC LIMIT ?"
+        incs = [Incident.from_doc(i, json.loads(d)) for i, d in self._rows(sql, params + [int(limit)])]
+        return incs, (incs[-1].id if incs else None)
+
+    def newer_than(self, since_ms, limit=100):
+        rows = self._rows("SELECT id, data FROM incidents WHERE created_ms > ? ORDER BY created_ms, id LIMIT ?",
+                          (int(since_ms), int(limit)))
+        return [Incident.from_doc(i, json.loads(d)) for i, d in rows]
+
+    def docs_since(self, since_ms, limit=1000, after_id=None):
+        if after_id:
+            rows = self._rows("SELECT id, data FROM incidents WHERE (created_ms, id) > (?, ?) ORDER BY created_ms, id LIMIT ?",
+                              (int(since_ms), after_id, int(limit)))
+        else:
+            rows = self._rows("SELECT id, data FROM incidents WHERE created_ms >= ? ORDER BY created_ms, id LIMIT ?",
+                              (int(since_ms), int(limit)))
+        return [(i, json.loads(d)) for i, d in rows]
+
+    def near(self, lat, lng, radius_km, since_ms=0, limit=50):
+        min_lat, max_lat, min_lng, max_lng = _bbox(lat, lng, radius_km)
+        rows = self._rows(
+            "SELECT i.id, i.data FROM incidents_rtree r JOIN incidents i ON i.rid = r.rid "
+            "WHERE r.min_lat <= ? AND r.max_lat >= ? AND r.min_lng <= ? AND r.max_lng >= ? AND i.created_ms > ? "
+            "ORDER BY i.created_ms", (max_lat, min_lat, max_lng, min_lng, int(since_ms)))
+        found = (Incident.from_doc(i, json.loads(d)) for i, d in rows)
+        return [inc for inc in found if haversine(lat, lng, inc.lat, inc.lng) <= radius_km][:limit]
+
+    def get(self, incident_id):
+        rows = self._rows("SELECT data FROM incidents WHERE id = ?", (incident_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def heavy(self, ids):
+        ids = list(ids)
+        rows = self._rows(f"SELECT id, data FROM incidents WHERE id IN ({','.join('?' * len(ids))})", ids) if ids else []
+        return {i: _heavy_of(json.loads(d)) for i, d in rows}
+
+    def create(self, incident_id, doc):
+        data = _plain(doc)
+        lat, lng = location_of(data)
+        inc = Incident.from_doc(incident_id, data, heavy=False)
+        with self._lock:
+            try:
+                with self.conn:
+                    cur = self.conn.execute(
+                        "INSERT INTO incidents (id, created_ms, type, level, lat, lng, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (incident_id, inc.created_ms, inc.type, inc.level, lat, lng, json.dumps(data, default=_json_default)))
+                    if lat is not None and lng is not None:
+                        self.conn.execute("INSERT INTO incidents_rtree VALUES (?, ?, ?, ?, ?)", (cur.lastrowid, lat, lat, lng, lng))
+            except sqlite3.IntegrityError:
+                return False
+        return True
+
+    def delete(self, incident_id):
+        with self._lock, self.conn:
+            rows = self.conn.execute("SELECT rid FROM incidents WHERE id = ?", (incident_id,)).fetchall()
+            if rows:
+                self.conn.execute("DELETE FROM incidents_rtree WHERE rid = ?", (rows[0][0],))
+                self.conn.execute("DELETE FROM incidents WHERE rid = ?", (rows[0][0],))
+
+
+class SqliteUserStore(_SqliteBase):
+    db = None
+
+    def get(self, email):
+        rows = self._rows("SELECT data FROM users WHERE email = ?", (email,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def create(self, email, data):
+        with self._lock:
+            try:
+                with self.conn:
+                    self.conn.execute("INSERT INTO users VALUES (?, ?)", (email, json.dumps(_plain(data), default=_json_default)))
+            except sqlite3.IntegrityError:
+                return False
+        return True
+
+    def update(self, email, fields):
+        self.set_many({email: fields})
+
+    def set_many(self, updates):
+        with self._lock, self.conn:
+            for email, fields in updates.items():
+                rows = self.conn.execute("SELECT data FROM users WHERE email = ?", (email,)).fetchall()
+                data = json.loads(rows[0][0]) if rows else {}
+                data.update(_plain(fields))
+                self.conn.execute("INSERT OR REPLACE INTO users VALUES (?, ?)", (email, json.dumps(data, default=_json_default)))
+
+
+def open_sqlite(path=DEFAULT_SQLITE_PATH):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SQLITE_SCHEMA)
+    conn.isolation_level = ""
+    lock = threading.RLock()
+    return SqliteIncidentStore(conn, lock), SqliteUserStore(conn, lock)
+
+
+def open_stores(backend="firestore", db=None, sqlite_path=None):
+    """(IncidentStore, UserStore) for a backend name; Firestore needs the client as `db`."""
+    if backend == "firestore":
+        if db is None:
+            raise ValueError("the firestore backend needs a Firestore client")
+        return FirestoreIncidentStore(db), FirestoreUserStore(db)
+    if backend == "sqlite":
+        return open_sqlite(sqlite_path or DEFAULT_SQLITE_PATH)
+    if backend == "memory":
+        return MemoryIncidentStore(), MemoryUserStore()
+    raise ValueError(f"unknown storage backend {backend!r} (expected one of {', '.join(BACKENDS)})")
@@ -0,0 +1,77 @@
+# test_mapdelta.py — MapDeltaTracker deltas against the acknowledged browser state
+from mapdelta import MapDeltaTracker
+
+
+def m(id, v="1"):
+    return {"id": id, "v": v}
+
+
+def ids(markers):
+    return sorted(x["id"] for x in markers)
+
+
+def ack(tracker, instance="i1"):
+    tracker.receive({"instance": instance, "seq": tracker.seq})
+
+
+def test_first_delta_is_full():
+    t = MapDeltaTracker()
+    d = t.delta([m("a"), m("b"), None])
+    assert d["full"] and d["seq"] == 1
+    assert ids(d["add"]) == ["a", "b"] and d["remove"] == []
+
+
+def test_delta_after_ack_has_only_changes():
+    t = MapDeltaTracker()
+    t.delta([m("a"), m("b"), m("c")])
+    ack(t)
+    d = t.delta([m("a"), m("b", "2"), m("d")])
+    assert not d["full"]
+    assert ids(d["add"]) == ["b", "d"]
+    assert d["remove"] == ["c"]
+
+
+def test_unchanged_markers_resend_the_same_payload():
+    t = MapDeltaTracker()
+    first = t.delta([m("a")])
+    assert t.delta([m("a")]) is first
+    assert t.seq == 1
+
+
+def test_unacked_deltas_are_covered_by_the_next_one():
+    # the browser may skip a delta, so the next one repeats everything since the last ack
+    t = MapDeltaTracker()
+    t.delta([m("a"), m("b")])
+    ack(t)
+    t.delta([m("a"), m("b"), m("c")])
+    d = t.delta([m("a", "2"), m("b"), m("c")])
+    assert ids(d["add"]) == ["a", "c"]
+    t.delta([m("b")])
+    ack(t)
+    d = t.delta([m("b"), m("e")])
+    assert ids(d["add"]) == ["e"] and d["remove"] == []
+
+
+def test_new_iframe_gets_a_full_payload():
+    t = MapDeltaTracker()
+    t.delta([m("a"), m("b")])
+    ack(t, "i1")
+    t.delta([m("a")])
+    # page switch: a fresh iframe reports a new instance with a stale seq
+    t.receive({"instance": "i2", "seq": 1})
+    d = t.delta([m("a"), m("c")])
+    assert d["full"]
+    assert ids(d["add"]) == ["a", "c"] and d["remove"] == []
+
+
+def test_ack_of_an_old_seq_is_ignored():
+    t = MapDeltaTracker()
+    t.delta([m("a")])
+    ack(t)
+    t.delta([m("a"), m("b")])
+    t.receive({"instance": "i1", "seq": 1})
+    d = t.delta([m("a"), m("b"), m("c")])
+    assert ids(d["add"]) == ["b", "c"]
+    t.receive(None)
+    t.receive({"seq": 5})
+    assert t.instance == "i1"
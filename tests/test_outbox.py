@@ -0,0 +1,62 @@
+# test_outbox.py — ReportOutbox idempotency and retry, driven through drain()
+import pytest
+
+from outbox import ReportOutbox
+
+
+class Deliver:
+    def __init__(self, fail=0):
+        self.fail = fail
+        self.calls = []
+
+    def __call__(self, key, payload, photo_bytes, photo_name):
+        self.calls.append(key)
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("offline")
+        return {"id": key, "text": payload["text"]}
+
+
+@pytest.fixture
+def make_outbox(tmp_path):
+    # backoff_base=0 makes a failed row due again at once
+    return lambda deliver, **kw: ReportOutbox(str(tmp_path / "outbox.sqlite3"), deliver, backoff_base=0, **kw)
+
+
+def test_duplicate_enqueue_is_ignored(make_outbox):
+    deliver = Deliver()
+    ob = make_outbox(deliver)
+    assert ob.enqueue("k1", {"text": "first"}, owner="a@x.org")
+    assert not ob.enqueue("k1", {"text": "second"}, owner="a@x.org")
+    assert ob.pending_for("a@x.org") == 1
+    assert ob.drain() == 1
+    assert ob.status("k1") == ("done", {"id": "k1", "text": "first"})
+    # already delivered: queuing it again is still a no-op
+    assert not ob.enqueue("k1", {"text": "third"})
+    assert ob.drain() == 0
+    assert deliver.calls == ["k1"]
+    assert ob.stats["duplicates"] == 2
+
+
+def test_failed_delivery_is_retried(make_outbox):
+    deliver = Deliver(fail=1)
+    ob = make_outbox(deliver)
+    ob.enqueue("k1", {"text": "hi"}, photo_bytes=b"jpeg")
+    assert ob.drain() == 0
+    assert ob.status("k1") == ("pending", "offline")
+    assert ob.drain() == 1
+    assert ob.status("k1")[0] == "done"
+    assert ob.wait_delivered("k1", timeout=0) == {"id": "k1", "text": "hi"}
+    assert ob.stats["retries"] == 1
+    assert ob.pending_count() == 0
+
+
+def test_gives_up_after_max_attempts(make_outbox):
+    ob = make_outbox(Deliver(fail=10), max_attempts=2)
+    ob.enqueue("k1", {"text": "hi"})
+    ob.drain()
+    ob.drain()
+    assert ob.status("k1") == ("failed", "offline")
+    assert ob.drain() == 0
+    assert ob.wait_delivered("k1", timeout=1) is None
+    assert ob.stats["failed"] == 1
@@ -0,0 +1,63 @@
+# test_writebehind.py — LastSeenWriter coalescing and re-queueing, driven through flush()
+from writebehind import LastSeenWriter
+
+
+class FakeUsers:
+    def __init__(self, fail=0, during=None):
+        self.fail = fail          # number of set_many calls to reject
+        self.during = during      # called inside set_many, before failing (a concurrent enqueue)
+        self.docs = {}
+        self.calls = []
+
+    def set_many(self, updates):
+        self.calls.append(dict(updates))
+        if self.during:
+            self.during()
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("unavailable")
+        for email, fields in updates.items():
+            self.docs.setdefault(email, {}).update(fields)
+
+
+def test_newest_value_wins_per_user():
+    users = FakeUsers()
+    w = LastSeenWriter(users)
+    w.enqueue("A@x.org ", 200)
+    w.enqueue("a@x.org", 100)
+    w.enqueue("b@x.org", 50)
+    assert w.pending_for("a@x.org") == 200
+    assert w.flush() == 2
+    assert users.docs == {"a@x.org": {"last_seen_ms": 200}, "b@x.org": {"last_seen_ms": 50}}
+    assert w.stats["coalesced"] == 1
+    assert w.pending_count() == 0
+    assert w.flush() == 0
+
+
+def test_failed_chunk_is_requeued():
+    users = FakeUsers(fail=1)
+    w = LastSeenWriter(users, max_batch=2)
+    for i, email in enumerate(["a@x.org", "b@x.org", "c@x.org"]):
+        w.enqueue(email, 10 + i)
+    assert w.flush() == 1
+    assert users.docs == {"c@x.org": {"last_seen_ms": 12}}
+    assert w.pending_count() == 2
+    assert w.stats["errors"] == 1
+    assert w.flush() == 2
+    assert users.docs["a@x.org"] == {"last_seen_ms": 10}
+    assert w.pending_count() == 0
+
+
+def test_requeue_keeps_a_newer_value():
+    w = LastSeenWriter(None)
+    w.users = FakeUsers(fail=1, during=lambda: w.enqueue("a@x.org", 500))
+    w.enqueue("a@x.org", 100)
+    assert w.flush() == 0
+    assert w.pending_for("a@x.org") == 500
+
+
+def test_blank_email_is_ignored():
+    w = LastSeenWriter(FakeUsers())
+    w.enqueue("", 1)
+    w.enqueue(None, 1)
+    assert w.pending_count() == 0
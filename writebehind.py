@@ -0,0 +1,95 @@
+# writebehind.py — coalescing write-behind queue for per-user last_seen_ms updates
+import atexit
+import threading
+import time
+
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_WRITES = 500
+
+
+class LastSeenWriter:
+    """
+    Collects last_seen_ms updates in memory, keeping only the newest value per user,
+    and writes them through the user store (store.set_many) as batched merge-sets.
+
+    Flushes happen every `interval` seconds from a daemon thread (after start()),
+    at interpreter shutdown, or on demand via flush() — which is what tests should call.
+    """
+
+    def __init__(self, users, interval=5.0, max_batch=MAX_BATCH_WRITES):
+        self.users = users
+        self.interval = float(interval)
+        self.max_batch = max(1, min(int(max_batch), MAX_BATCH_WRITES))
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"enqueued": 0, "coalesced": 0, "written": 0, "batches": 0, "errors": 0}
+
+    def enqueue(self, email, ms=None):
+        if not email:
+            return
+        key = email.strip().lower()
+        if ms is None:
+            ms = int(time.time()*1000)
+        ms = int(ms)
+        with self._lock:
+            self.stats["enqueued"] += 1
+            prev = self._pending.get(key)
+            if prev is not None:
+                self.stats["coalesced"] += 1
+                if prev >= ms:
+                    return
+            self._pending[key] = ms
+
+    def pending_for(self, email):
+        """Newest not-yet-written last_seen_ms for this user, or None."""
+        if not email:
+            return None
+        with self._lock:
+            return self._pending.get(email.strip().lower())
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self):
+        """Write everything queued so far. Returns the number of user docs written."""
+        with self._flush_lock:
+            with self._lock:
+                items = list(self._pending.items())
+                self._pending = {}
+            written = 0
+            for i in range(0, len(items), self.max_batch):
+                chunk = items[i:i + self.max_batch]
+                try:
+                    self.users.set_many({email: {"last_seen_ms": ms} for email, ms in chunk})
+                    written += len(chunk)
+                    self.stats["batches"] += 1
+                except Exception as e:
+                    print("LastSeenWriter flush error:", e)
+                    self.stats["errors"] += 1
+                    # put the failed chunk back, unless a newer value arrived meanwhile
+                    with self._lock:
+                        for email, ms in chunk:
+                            if self._pending.get(email, -1) < ms:
+                                self._pending[email] = ms
+            self.stats["written"] += written
+            return written
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._thread = threading.Thread(target=self._run, name="last-seen-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self.flush()